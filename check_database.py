@@ -2,9 +2,18 @@
 """
 Database utility script for checking database status and performing basic operations.
 Run this script to verify database connectivity and check table status.
+
+Options:
+    --advise          Run the index advisor over the catalogued portal queries
+    --create-indexes  Apply pending migrations (which create the recommended indexes), then advise
+    --verbose         Show the full query plan for every catalogued query
+    --verify-ledger   Check facility utilisation against the utilisation ledger
+    --verify-balances Check account running balances against the posted journal lines
 """
 
+import argparse
 import os
+import sqlite3
 import sys
 from pathlib import Path
 
@@ -12,7 +21,11 @@ from pathlib import Path
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from src.database import Database
+from src.database import Database, resolve_db_path
+from src.credit_ledger import verify_ledger
+from src.index_advisor import print_report
+from src.trial_balance import verify_account_balances
+from src.migrations import migrate, get_schema_version
 
 def check_database():
     """Check database connectivity and basic information"""
@@ -68,5 +81,77 @@ def check_database():
     print("\nDatabase check completed successfully.")
     return True
 
+def advise_indexes(create: bool = False, verbose: bool = False):
+    """Run the index advisor, optionally creating the missing indexes first"""
+    try:
+        # A plain connection, as Database() would apply pending migrations on connect:
+        # --advise only reports, and --create-indexes is the one path that migrates
+        connection = sqlite3.connect(resolve_db_path("supply_chain_finance.db"))
+        try:
+            if create:
+                before = get_schema_version(connection)
+                after = migrate(connection, verbose=True)
+                if after == before:
+                    print(f"Schema already at version {after}; no migrations applied.")
+            return print_report(connection, verbose=verbose) == 0
+        finally:
+            connection.close()
+    except Exception as e:
+        print(f"Error running index advisor: {e}")
+        return False
+
+def check_utilization_ledger():
+    """Report facilities whose utilisation disagrees with the utilisation ledger"""
+    try:
+        with Database() as db:
+            mismatches = verify_ledger(db)
+    except Exception as e:
+        print(f"Error checking utilisation ledger: {e}")
+        return False
+    
+    if not mismatches:
+        print("Facility utilisation matches the utilisation ledger.")
+        return True
+    print(f"{len(mismatches)} facility(ies) disagree with the utilisation ledger (amounts in cents):")
+    for facility_id, utilised, ledger_utilised, reserved, ledger_reserved in mismatches:
+        print(f"  Facility {facility_id}: utilised {utilised} vs ledger {ledger_utilised}, "
+              f"reserved {reserved} vs ledger {ledger_reserved}")
+    return False
+
+
+def check_account_balances():
+    """Report accounts whose running balance disagrees with their posted journal lines"""
+    try:
+        with Database() as db:
+            mismatches = verify_account_balances(db)
+    except Exception as e:
+        print(f"Error checking account balances: {e}")
+        return False
+    
+    if not mismatches:
+        print("Account balances match the posted journal lines.")
+        return True
+    print(f"{len(mismatches)} account(s) disagree with their journal lines (amounts in cents):")
+    for account_id, code, balance, expected in mismatches:
+        print(f"  Account {code} (Id {account_id}): balance {balance} vs journal {expected}")
+    return False
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the Supply Chain Finance database")
+    parser.add_argument("--advise", action="store_true", help="run the index advisor over the portal queries")
+    parser.add_argument("--create-indexes", action="store_true", help="apply pending migrations, then run the advisor")
+    parser.add_argument("--verbose", action="store_true", help="print every query plan")
+    parser.add_argument("--verify-ledger", action="store_true", help="check utilisation against the ledger")
+    parser.add_argument("--verify-balances", action="store_true", help="check account balances against the journal")
+    args = parser.parse_args()
+
+    if args.verify_ledger:
+        sys.exit(0 if check_utilization_ledger() else 1)
+
+    if args.verify_balances:
+        sys.exit(0 if check_account_balances() else 1)
+
+    if args.advise or args.create_indexes:
+        ok = advise_indexes(create=args.create_indexes, verbose=args.verbose)
+        sys.exit(0 if ok else 1)
     check_database()
@@ -22,9 +22,9 @@ def patched_validate_invoice(self, invoice: dict):
     logging.debug(f"Starting validation of invoice {invoice['id']}")
     print(f"\nValidating invoice {invoice['number']}")
 
-    # Update status to Validated (1)
-    logging.debug("Updating invoice status to Validated (1)")
-    if self.update_invoice_status(invoice['id'], 1):
+    # Update status to Validated
+    logging.debug("Updating invoice status to Validated")
+    if self.update_invoice_status(invoice['id'], 'validate'):
         logging.debug("Status update successful")
         print("Invoice validation completed - Status updated to 'Validated'")
         
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """
 Comprehensive accounting report to show all entries and verify they're working
+For paged, filtered exports (CSV, JSONL, Parquet) see ledger_export.py
 """
 
 import sqlite3
-from database import Database
+from itertools import groupby
+
+from database import Database, from_minor
 
 def accounting_report():
     """Generate comprehensive accounting report"""
@@ -27,9 +30,8 @@ def accounting_report():
             ORDER BY je.Id
         """)
         
-        journal_entries = db.cursor.fetchall()
-        
-        for entry in journal_entries:
+        # Streamed from the cursor, so memory does not grow with the ledger
+        for entry in db.cursor:
             print(f"JE #{entry[0]}: {entry[1]}")
             print(f"   Date: {entry[2][:10]}")
             print(f"   Invoice: {entry[4] if entry[4] else 'N/A'}")
@@ -41,39 +43,44 @@ def accounting_report():
         print("\n2. JOURNAL ENTRY LINES DETAIL")
         print("-" * 40)
         
-        for entry in journal_entries:
-            je_id = entry[0]
-            je_ref = entry[1]
-            
+        # One ordered join for every entry's lines; the per-entry totals come from
+        # window sums, and groupby splits the stream back into entries. The window
+        # is ordered like the result, so SQLite walks the lines index without a sort
+        # and only buffers one entry's lines at a time.
+        db.cursor.execute("""
+            SELECT je.Id, je.TransactionReference, acc.AccountCode, acc.AccountName,
+                   jel.DebitAmount, jel.CreditAmount, jel.Description,
+                   SUM(jel.DebitAmount) OVER entry, SUM(jel.CreditAmount) OVER entry
+            FROM JournalEntries je
+            LEFT JOIN JournalEntryLines jel ON jel.JournalEntryId = je.Id
+            LEFT JOIN Accounts acc ON acc.Id = jel.AccountId
+            WINDOW entry AS (PARTITION BY je.Id ORDER BY jel.Id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+            ORDER BY je.Id, jel.Id
+        """)
+        
+        for (je_id, je_ref), lines in groupby(db.cursor, key=lambda row: (row[0], row[1])):
             print(f"\nJournal Entry: {je_ref}")
             
-            db.cursor.execute("""
-                SELECT jel.Id, acc.AccountCode, acc.AccountName, 
-                       jel.DebitAmount, jel.CreditAmount, jel.Description
-                FROM JournalEntryLines jel
-                JOIN Accounts acc ON jel.AccountId = acc.Id
-                WHERE jel.JournalEntryId = ?
-                ORDER BY jel.Id
-            """, (je_id,))
-            
-            lines = db.cursor.fetchall()
-            
             total_debit = 0.0
             total_credit = 0.0
             
             for line in lines:
-                debit = float(line[3]) if line[3] and line[3] != '0' else 0.0
-                credit = float(line[4]) if line[4] and line[4] != '0' else 0.0
+                total_debit = from_minor(line[7])
+                total_credit = from_minor(line[8])
+                if line[2] is None:
+                    # Entry without lines, or a line whose account is gone
+                    continue
                 
-                total_debit += debit
-                total_credit += credit
+                debit = from_minor(line[4])
+                credit = from_minor(line[5])
                 
                 if debit > 0:
-                    print(f"   Dr  {line[1]} - {line[2]:<25} ${debit:>10,.2f}")
+                    print(f"   Dr  {line[2]} - {line[3]:<25} ${debit:>10,.2f}")
                 elif credit > 0:
-                    print(f"       Cr  {line[1]} - {line[2]:<23} ${credit:>10,.2f}")
+                    print(f"       Cr  {line[2]} - {line[3]:<23} ${credit:>10,.2f}")
                 else:
-                    print(f"   Memo: {line[5]}")
+                    print(f"   Memo: {line[6]}")
             
             print(f"   {'='*50}")
             print(f"   Total Debits:  ${total_debit:>10,.2f}")
@@ -91,8 +98,6 @@ def accounting_report():
             ORDER BY AccountCode
         """)
         
-        accounts = db.cursor.fetchall()
-        
         account_types = {
             0: "Asset",
             1: "Liability", 
@@ -104,9 +109,9 @@ def accounting_report():
         current_type = None
         type_totals = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
         
-        for account in accounts:
+        for account in db.cursor:
             acc_type = account[2]
-            balance = float(account[3]) if account[3] else 0.0
+            balance = from_minor(account[3])
             type_totals[acc_type] += balance
             
             if current_type != acc_type:
@@ -149,8 +154,6 @@ def accounting_report():
                 ORDER BY t.Id
             """)
             
-            transactions = db.cursor.fetchall()
-            
             # Transaction type mapping
             type_names = {
                 1: "Funding",
@@ -159,8 +162,8 @@ def accounting_report():
                 4: "Interest"
             }
             
-            for txn in transactions:
-                amount = float(txn[2]) if txn[2] else 0.0
+            for txn in db.cursor:
+                amount = from_minor(txn[2])
                 txn_type = type_names.get(txn[4], f"Type {txn[4]}")
                 print(f"Transaction #{txn[0]}")
                 print(f"   Invoice: {txn[1] if txn[1] else 'N/A'}")
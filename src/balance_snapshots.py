@@ -0,0 +1,172 @@
+"""
+Statement balance snapshots for the Supply Chain Finance Management System
+
+A snapshot date D stores, for every organization with a non-zero balance, the
+statement balance of its transactions dated before D (BalanceSnapshots,
+migration 011); organizations without a row have a zero balance. Statement
+opening balances are then the nearest snapshot plus the transactions dated
+since it (TransactionService.balances_before / generate_account_statement),
+so their cost stays flat however long the history grows.
+
+Snapshots are taken by a nightly job: each one is the previous snapshot plus
+one grouped query over the transactions dated since, never a full scan.
+Triggers on Transactions move the snapshots a back-dated, corrected or
+deleted transaction falls before, so existing snapshots stay exact.
+
+Daily snapshots older than DAILY_RETENTION_DAYS are pruned; month-start
+snapshots are kept.
+"""
+
+from datetime import datetime, timedelta
+
+if __package__:
+    from .database import Database, format_date, format_timestamp
+    from .transaction_service import SIGNED_AMOUNT_SQL
+else:
+    from database import Database, format_date, format_timestamp
+    from transaction_service import SIGNED_AMOUNT_SQL
+
+PERIODS = ('day', 'month')
+
+# Daily snapshots kept before pruning (month-start snapshots are kept)
+DAILY_RETENTION_DAYS = 35
+
+
+def snapshot_date(period: str = 'day', now: datetime = None) -> str:
+    """Snapshot date of a period ending now: today for 'day', the first of the month for 'month'"""
+    if period not in PERIODS:
+        raise ValueError(f"Unknown snapshot period: {period}")
+    now = now or datetime.now()
+    return format_date(now if period == 'day' else now.replace(day=1))
+
+
+def snapshot_dates(db: Database) -> list:
+    """[(as of date, period)] of the stored snapshots, oldest first"""
+    db.cursor.execute("SELECT AsOfDate, Period FROM BalanceSnapshotDates ORDER BY AsOfDate")
+    return db.cursor.fetchall()
+
+
+def compute_balances(db: Database, as_of: str) -> dict:
+    """{organization_id: balance} of the transactions dated before as_of, from the previous snapshot"""
+    db.cursor.execute("SELECT MAX(AsOfDate) FROM BalanceSnapshotDates WHERE AsOfDate < ?", (as_of,))
+    previous = db.cursor.fetchone()[0]
+    balances = {}
+    if previous:
+        db.cursor.execute("SELECT OrganizationId, Balance FROM BalanceSnapshots WHERE AsOfDate = ?", (previous,))
+        balances = dict(db.cursor.fetchall())
+    db.cursor.execute(f"""
+        SELECT OrganizationId, SUM({SIGNED_AMOUNT_SQL})
+        FROM Transactions
+        WHERE TransactionDate >= ? AND TransactionDate < ?
+        GROUP BY OrganizationId
+    """, (previous or '', as_of))
+    for organization_id, delta_minor in db.cursor.fetchall():
+        balances[organization_id] = balances.get(organization_id, 0) + (delta_minor or 0)
+    return balances
+
+
+def take_balance_snapshot(db: Database, as_of=None, period: str = 'day') -> int:
+    """
+    Store the balances of every organization as of a date (default: the period's snapshot date).
+
+    Returns the organizations written; 0 if the date already has a snapshot.
+    """
+    as_of = format_date(as_of) if as_of else snapshot_date(period)
+    with db.transaction():
+        db.cursor.execute("SELECT 1 FROM BalanceSnapshotDates WHERE AsOfDate = ?", (as_of,))
+        if db.cursor.fetchone():
+            return 0
+        balances = compute_balances(db, as_of)
+        db.cursor.executemany("""
+            INSERT INTO BalanceSnapshots (OrganizationId, AsOfDate, Balance) VALUES (?, ?, ?)
+        """, [(organization_id, as_of, balance_minor)
+              for organization_id, balance_minor in sorted(balances.items()) if balance_minor])
+        written = db.cursor.rowcount
+        db.cursor.execute("""
+            INSERT INTO BalanceSnapshotDates (AsOfDate, Period, CreatedDate) VALUES (?, ?, ?)
+        """, (as_of, period, format_timestamp()))
+    return max(written, 0)
+
+
+def prune_balance_snapshots(db: Database, keep_days: int = DAILY_RETENTION_DAYS, now: datetime = None) -> int:
+    """Delete daily snapshots older than keep_days; returns the snapshot dates removed"""
+    cutoff = format_date((now or datetime.now()) - timedelta(days=keep_days))
+    with db.transaction():
+        db.cursor.execute("""
+            DELETE FROM BalanceSnapshots
+            WHERE AsOfDate IN (SELECT AsOfDate FROM BalanceSnapshotDates WHERE Period = 'day' AND AsOfDate < ?)
+        """, (cutoff,))
+        db.cursor.execute("DELETE FROM BalanceSnapshotDates WHERE Period = 'day' AND AsOfDate < ?", (cutoff,))
+        return db.cursor.rowcount
+
+
+def verify_balance_snapshot(db: Database, as_of: str) -> list:
+    """
+    Compare a stored snapshot with the transactions dated before it.
+
+    Returns [(organization_id, stored, expected)] for the organizations that
+    disagree; empty when the snapshot is exact.
+    """
+    db.cursor.execute(f"""
+        SELECT OrganizationId, SUM({SIGNED_AMOUNT_SQL})
+        FROM Transactions
+        WHERE TransactionDate < ?
+        GROUP BY OrganizationId
+    """, (as_of,))
+    expected = {organization_id: total or 0 for organization_id, total in db.cursor.fetchall()}
+    db.cursor.execute("SELECT OrganizationId, Balance FROM BalanceSnapshots WHERE AsOfDate = ?", (as_of,))
+    stored = dict(db.cursor.fetchall())
+    return [(organization_id, stored.get(organization_id, 0), expected.get(organization_id, 0))
+            for organization_id in sorted(set(stored) | set(expected))
+            if stored.get(organization_id, 0) != expected.get(organization_id, 0)]
+
+
+def run_nightly(db_name: str = "supply_chain_finance.db", now: datetime = None) -> dict:
+    """Take today's snapshot (a month snapshot on the first of the month) and prune old daily ones"""
+    now = now or datetime.now()
+    period = 'month' if now.day == 1 else 'day'
+    with Database(db_name) as db:
+        written = take_balance_snapshot(db, snapshot_date(period, now), period)
+        pruned = prune_balance_snapshots(db, now=now)
+    return {'as_of': snapshot_date(period, now), 'period': period, 'organizations': written, 'pruned': pruned}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Take statement balance snapshots")
+    parser.add_argument("--as-of", help="snapshot date (default: today, or the first of the month with --period month)")
+    parser.add_argument("--period", choices=PERIODS, help="snapshot period (default: nightly run)")
+    parser.add_argument("--verify", action="store_true", help="check every stored snapshot against the transactions")
+    parser.add_argument("--db", default="supply_chain_finance.db", help="database file")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.verify:
+            with Database(args.db) as db:
+                failures = 0
+                for as_of, period in snapshot_dates(db):
+                    mismatches = verify_balance_snapshot(db, as_of)
+                    failures += bool(mismatches)
+                    print(f"{as_of} ({period}): {'OK' if not mismatches else f'{len(mismatches)} mismatch(es)'}")
+                    for organization_id, stored, expected in mismatches[:20]:
+                        print(f"  organization {organization_id}: stored {stored}, expected {expected}")
+            return 1 if failures else 0
+        if args.as_of or args.period:
+            period = args.period or 'day'
+            with Database(args.db) as db:
+                as_of = format_date(args.as_of) if args.as_of else snapshot_date(period)
+                written = take_balance_snapshot(db, as_of, period)
+            print(f"Snapshot {as_of} ({period}): {written:,} organization(s)")
+        else:
+            result = run_nightly(args.db)
+            print(f"Snapshot {result['as_of']} ({result['period']}): {result['organizations']:,} organization(s), "
+                  f"{result['pruned']} old daily snapshot(s) pruned")
+    except ValueError as e:
+        print(f"Error taking balance snapshot: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,6 +3,7 @@ Bank Portal for Supply Chain Finance Management System
 Converted from C# BankApplication class
 """
 
+import io
 import os
 import sys
 from typing import Optional, List
@@ -11,8 +12,14 @@ from datetime import datetime, timedelta
 # Add the parent directory to the path to import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.database import Database
+from src.database import Database, to_minor, from_minor, parse_date, format_date, format_timestamp
 from src.auth_service import authenticate, is_authorized
+from src.stakeholders import StakeholderResolver
+from src.batch_funding import BatchFundingEngine, RateCard
+from src.invoice_workflow import InvoiceReviewService
+from src.exposure_index import get_exposure_index, facility_type_name
+from src.limit_tree import write_limit_tree
+from src import invoice_states, credit_ledger, trial_balance, ledger_export
 
 
 class BankApplication:
@@ -20,6 +27,9 @@ class BankApplication:
     
     def __init__(self):
         self.db = Database()
+        self.stakeholders = StakeholderResolver()
+        self.reviews = InvoiceReviewService(stakeholders=self.stakeholders)
+        self.exposure = get_exposure_index()
         self.current_user = None
         self.current_organization = None
         self.auth_service = None
@@ -191,7 +201,13 @@ class BankApplication:
         """Get all non-bank organizations from database"""
         try:
             db = Database()
-            query = "SELECT Id, Name, IsBuyer, IsSeller FROM Organizations WHERE IsBank = 0"
+            query = """
+                SELECT o.Id, o.Name, o.IsBuyer, o.IsSeller,
+                       EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                               WHERE cl.OrganizationId = o.Id) as HasFacilities
+                FROM Organizations o
+                WHERE o.IsBank = 0
+            """
             db.cursor.execute(query)
             results = db.cursor.fetchall()
             db.close()
@@ -202,7 +218,8 @@ class BankApplication:
                     'id': row[0],
                     'name': row[1],
                     'is_buyer': bool(row[2]),
-                    'is_seller': bool(row[3])
+                    'is_seller': bool(row[3]),
+                    'has_facilities': bool(row[4])
                 })
             
             return organizations
@@ -339,7 +356,7 @@ class BankApplication:
                 return
             
             # Create CreditLimits record
-            timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+            timestamp = format_timestamp()
             
             credit_limit_query = """
                 INSERT INTO CreditLimits (OrganizationId, MasterLimit, LastReviewDate, NextReviewDate)
@@ -347,11 +364,11 @@ class BankApplication:
             """
             
             # Set next review date to 1 year from now
-            next_review = (datetime.now() + timedelta(days=365)).strftime('%d-%m-%Y %H:%M:%S')
+            next_review = format_timestamp(datetime.now() + timedelta(days=365))
             
             db.cursor.execute(credit_limit_query, (
                 org_id,
-                str(master_limit_amount),
+                to_minor(master_limit_amount),
                 timestamp,
                 next_review
             ))
@@ -403,11 +420,11 @@ class BankApplication:
                     db.cursor.execute(facility_query, (
                         credit_limit_id,
                         facility_type - 1,  # 0-based indexing for Type
-                        str(facility_limit),
-                        "0.0",  # Initial utilization
+                        to_minor(facility_limit),
+                        0,  # Initial utilization
                         next_review,
                         30,  # 30 days grace period
-                        str(facility_limit)
+                        to_minor(facility_limit)
                     ))
                     
                     total_allocated += facility_limit
@@ -417,7 +434,7 @@ class BankApplication:
                     print(f"  Skipping {facility_name} - invalid amount format")
                     continue
             
-            db.connection.commit()
+            db.commit()
             db.close()
             
             print(f"\n" + "=" * 50)
@@ -449,6 +466,7 @@ class BankApplication:
         print("2. Grant Facility to Any Customer")
         print("3. Manage Buyer-Specific Limits")
         print("4. Launch GrantBuyerLimit Program")
+        print("5. Limit Tree Report")
         print("0. Back")
         
         choice = input("\nSelect an option: ").strip()
@@ -461,6 +479,8 @@ class BankApplication:
             self.manage_buyer_limits()
         elif choice == "4":
             self.launch_grant_buyer_limit()
+        elif choice == "5":
+            self.view_limit_tree_report()
         elif choice == "0":
             return
         else:
@@ -475,20 +495,9 @@ class BankApplication:
         print()
         
         try:
-            db = Database()
-            
-            # Get all credit facilities with organization info
-            query = """
-                SELECT o.Name, f.Type, f.TotalLimit, f.CurrentUtilization, 1 as IsActive,
-                       cl.LastReviewDate, o.Id as OrgId
-                FROM Facilities f
-                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
-                JOIN Organizations o ON cl.OrganizationId = o.Id
-                ORDER BY o.Name, f.Type
-            """
-            
-            db.cursor.execute(query)
-            facilities = db.cursor.fetchall()
+            # Every facility with its organization, from the exposure index
+            facilities = [facility for facility in self.exposure.all_facilities()
+                          if facility['organization_name'] is not None]
             
             if not facilities:
                 print("No credit facilities found.")
@@ -497,38 +506,65 @@ class BankApplication:
                 print("-" * 100)
                 
                 for facility in facilities:
-                    org_name = facility[0]
-                    facility_type = "Invoice Finance" if facility[1] == 0 else f"Type {facility[1]}"
-                    limit_amount = float(facility[2]) if facility[2] else 0.0
-                    utilized_amount = float(facility[3]) if facility[3] else 0.0
-                    available_amount = limit_amount - utilized_amount
-                    status = "Active" if facility[4] else "Inactive"
+                    org_name = facility['organization_name']
+                    facility_type = facility_type_name(facility['type'])
+                    limit_amount = from_minor(facility['limit'])
+                    utilized_amount = from_minor(facility['utilised'])
+                    available_amount = from_minor(facility['available'])
+                    status = "Active"
                     
                     print(f"{org_name:<25} {facility_type:<15} ${limit_amount:<14,.0f} ${utilized_amount:<14,.0f} ${available_amount:<14,.0f} {status:<8}")
             
-            db.close()
-            
         except Exception as e:
             print(f"Error retrieving credit facilities: {e}")
         
         self.wait_for_enter()
 
-    def generate_limit_tree_report(self) -> str:
-        # 1. Organization
-        #    |-Limit Amount : 100,000
-        #       |-Invoice Financing Limit: 50,000
-        #          |-Utiliozation : 20,000
-        #          |-Available Limit: 30,000
-        
+    def view_limit_tree_report(self):
+        """Print the bank-wide limit tree, or save it as JSON"""
+        self.clear_screen()
+        print("LIMIT TREE REPORT")
+        print("=" * 17)
+        print()
+        print("1. Tree view")
+        print("2. Table view")
+        print("3. Save as JSON")
+        print("0. Back")
         
+        choice = input("\nSelect an option: ").strip()
+        if choice == "0":
+            return
         
+        try:
+            if choice == "1":
+                # Written to the screen one organization at a time
+                write_limit_tree(sys.stdout, 'text')
+            elif choice == "2":
+                write_limit_tree(sys.stdout, 'table')
+            elif choice == "3":
+                default_path = f"limit_tree_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+                path = input(f"File name [{default_path}]: ").strip() or default_path
+                with open(path, 'w', encoding='utf-8') as out:
+                    count = write_limit_tree(out, 'json')
+                print(f"\n{count:,} organization(s) written to {path}")
+            else:
+                print("\nInvalid option.")
+        except Exception as e:
+            print(f"Error generating limit tree report: {e}")
         
-        """Generate tree-style limits report"""
-        return "Tree-style limits report (placeholder)"
+        self.wait_for_enter()
+
+    def generate_limit_tree_report(self, fmt: str = 'text') -> str:
+        """Generate the tree-style limits report (Organization -> Master Limit -> Facility); fmt is 'text' or 'json'"""
+        out = io.StringIO()
+        write_limit_tree(out, fmt)
+        return out.getvalue()
 
     def generate_all_limits_report(self) -> str:
         """Generate tabular limits report"""
-        return "Tabular limits report (placeholder)"
+        out = io.StringIO()
+        write_limit_tree(out, 'table')
+        return out.getvalue()
 
     def grant_facility_to_customer(self):
         """Grant facility to any customer"""
@@ -556,7 +592,7 @@ class BankApplication:
                 type_str = " & ".join(org_type) if org_type else "Unknown"
                 
                 # Check if they already have facilities
-                has_facility = self.is_organization_our_customer(org['id'])
+                has_facility = org.get('has_facilities', False)
                 status = " (HAS FACILITIES)" if has_facility else " (NO FACILITIES)"
                 
                 print(f"{org['id']:3d}. {org['name']:30} ({type_str}){status}")
@@ -712,9 +748,14 @@ class BankApplication:
                 print(f"   → Buyer Uploaded (counterparty: {invoice.get('counterparty_name', 'Unknown')})")
             else:
                 print(f"   → Seller Uploaded (counterparty: {invoice.get('counterparty_name', 'Unknown')})")
+        print("B. Bulk action on several invoices")
         print("0. Back")
         
-        selection = input(f"\nSelect invoice to review (1-{len(invoices)} or 0): ").strip()
+        selection = input(f"\nSelect invoice to review (1-{len(invoices)}, B or 0): ").strip()
+        
+        if selection.upper() == "B":
+            self.bulk_review_invoices(invoices)
+            return
         
         try:
             selection = int(selection)
@@ -727,20 +768,70 @@ class BankApplication:
             print("Invalid input.")
             self.wait_for_enter()
 
+    def bulk_review_invoices(self, invoices: List):
+        """Validate, approve or reject several listed invoices at once"""
+        picked = input("\nInvoices to process (e.g. 1,3,5-9 or ALL): ").strip().upper()
+        try:
+            if picked == "ALL":
+                positions = range(1, len(invoices) + 1)
+            else:
+                positions = set()
+                for part in picked.split(","):
+                    first, _, last = part.strip().partition("-")
+                    positions.update(range(int(first), int(last or first) + 1))
+            selected = [invoices[n - 1] for n in sorted(positions) if 1 <= n <= len(invoices)]
+        except ValueError:
+            print("Invalid selection.")
+            self.wait_for_enter()
+            return
+        
+        if not selected:
+            print("No invoices selected.")
+            self.wait_for_enter()
+            return
+        
+        print(f"\n{len(selected)} invoice(s) selected, total ${sum(i['amount'] for i in selected):,.2f}")
+        print("1. Validate")
+        print("2. Approve for Funding")
+        print("3. Reject")
+        print("0. Back")
+        
+        choice = input("\nSelect action: ").strip()
+        invoice_ids = [invoice['id'] for invoice in selected]
+        
+        if choice == "1":
+            report = self.reviews.validate_invoices(invoice_ids, self.current_user['id'])
+        elif choice == "2":
+            report = self.reviews.approve_invoices(invoice_ids, self.current_user['id'])
+        elif choice == "3":
+            reason = input("Enter rejection reason for the selected invoices: ").strip()
+            if not reason:
+                print("Rejection cancelled - no reason provided.")
+                self.wait_for_enter()
+                return
+            report = self.reviews.reject_invoices({invoice_id: reason for invoice_id in invoice_ids},
+                                                  self.current_user['id'])
+        else:
+            return
+        
+        report.print_summary()
+        self.wait_for_enter()
+
     def get_invoices_by_status(self, status: str) -> List:
         """Get invoices by status"""
-        # Map status names to database status codes
+        # Map status names to database status codes (see invoice_states)
         status_map = {
-            "new": 1,                            # New (applicable to both buyer and seller)
-            "validated": 2,                      # Validated (buyer or seller invoice)
-            "approved": 3,                       # Approved (buyer or seller invoice)
-            "funded": 4,                         # Funded seller invoice (once seller invoice is funded)
-            "funding_pending_seller": 5,         # Funding sent for Seller Approval (for buyer uploaded invoice)
-            "pending_seller_approval": 6,        # Pending Seller approval (for buyer uploaded invoice)
-            "seller_approved": 7,                # Seller Approved (for buyer uploaded invoice)
-            "discounted": 8,                     # Discounted Invoice (payment regardless if buyer or seller)
-            "due": 9,                            # Invoice Due on Maturity Date
-            "settled": 10                        # Invoice fully settled (paid by the buyer)
+            "new": invoice_states.NEW,
+            "validated": invoice_states.VALIDATED,
+            "approved": invoice_states.APPROVED,
+            "funded": invoice_states.FUNDED,
+            "funding_pending_seller": invoice_states.FUNDING_OFFERED,
+            "pending_seller_approval": invoice_states.PENDING_SELLER_APPROVAL,
+            "seller_approved": invoice_states.SELLER_APPROVED,
+            "discounted": invoice_states.DISCOUNTED,
+            "due": invoice_states.DUE,
+            "settled": invoice_states.SETTLED,
+            "rejected": invoice_states.REJECTED
         }
         
         status_code = status_map.get(status, 0)
@@ -759,7 +850,7 @@ class BankApplication:
         print(f"Due Date: {invoice.get('due_date', 'Unknown')}")
         print(f"Seller: {invoice.get('seller_name', 'Unknown')}")
         print(f"Buyer: {invoice.get('buyer_name', 'Unknown')}")
-        print(f"Status: {invoice.get('status', 'Unknown')}")
+        print(f"Status: {invoice_states.status_name(invoice.get('status'))}")
         print(f"Counterparty: {invoice.get('counterparty_name', 'Unknown')}")
         
         print("\nAvailable Actions:")
@@ -773,15 +864,18 @@ class BankApplication:
         choice = input("\nSelect action: ").strip()
         
         if choice == "1":
-            self.validate_invoice(invoice)
+            with self.stakeholders.operation():
+                self.validate_invoice(invoice)
         elif choice == "2":
-            self.approve_invoice(invoice)
+            with self.stakeholders.operation():
+                self.approve_invoice(invoice)
         #elif choice == "3":
         #    self.request_buyer_approval(invoice)
         #elif choice == "4":
         #    self.make_early_payment_offer(invoice)
         elif choice == "3":
-            self.reject_invoice(invoice)
+            with self.stakeholders.operation():
+                self.reject_invoice(invoice)
         elif choice == "0":
             return
         else:
@@ -798,8 +892,8 @@ class BankApplication:
             #   the invoice for early payment with the quoted discount rate sent by the bank admin
         print(f"\nValidating invoice {invoice['number']}")
 
-        # Update status to Validated (2)
-        if self.update_invoice_status(invoice['id'], 2):
+        # New -> Validated
+        if self.update_invoice_status(invoice['id'], 'validate'):
             print("Invoice validation completed - Status updated to 'Validated'")
             
             # Determine if this is a buyer or seller uploaded invoice
@@ -827,8 +921,8 @@ class BankApplication:
         """Approve invoice for funding"""
         print(f"\nApproving invoice {invoice['number']} for funding")
         
-        # Update status to Approved (3)
-        if self.update_invoice_status(invoice['id'], 3):
+        # Validated -> Approved
+        if self.update_invoice_status(invoice['id'], 'approve'):
             print("Invoice approved successfully - Status updated to 'Approved'")
             print("Invoice is now ready for funding.")
             
@@ -934,20 +1028,10 @@ class BankApplication:
         """Reject an invoice"""
         reason = input(f"\nEnter rejection reason for invoice {invoice['number']}: ").strip()
         if reason:
-            # Update status to Rejected (5)
-            if self.update_invoice_status(invoice['id'], 5):
+            # New or Validated -> Rejected, with the reason
+            if self.update_invoice_status(invoice['id'], 'reject', RejectionReason=reason):
                 print("Invoice rejected successfully.")
                 
-                # Update rejection reason in database
-                try:
-                    db = Database()
-                    db.cursor.execute("UPDATE Invoices SET RejectionReason = ? WHERE Id = ?", (reason, invoice['id']))
-                    db.connection.commit()
-                    db.close()
-                except Exception as db_error:
-                    print(f"Database error while updating rejection reason: {db_error}")
-                
-                
                 # Create rejection accounting entry (for audit trail)
                 stakeholders = self.get_invoice_stakeholders(invoice['id'])
                 self.create_accounting_entry(
@@ -989,18 +1073,18 @@ class BankApplication:
             self.wait_for_enter()
             return
         
+        # Customer flags (has credit facilities) for the whole list from one index refresh
+        with self.exposure.operation():
+            customer_flags = [self.get_customer_flags(invoice) for invoice in approved_invoices]
+        
         print("Approved Invoices Ready for Funding:")
-        for i, invoice in enumerate(approved_invoices, 1):
+        for i, (invoice, (seller_is_customer, buyer_is_customer)) in enumerate(zip(approved_invoices, customer_flags), 1):
             # Determine which party is our customer based on credit facilities
             seller_name = invoice.get('seller_name', 'Unknown')
             buyer_name = invoice.get('buyer_name', 'Unknown')
             issue_date = invoice.get('issue_date', 'Unknown')
             due_date = invoice.get('due_date', 'Unknown')
             
-            # Check if seller is our customer (has credit facilities)
-            seller_is_customer = self.is_organization_our_customer(invoice.get('seller_id'))
-            buyer_is_customer = self.is_organization_our_customer(invoice.get('buyer_id'))
-            
             if seller_is_customer and not buyer_is_customer:
                 # Seller is our customer - traditional invoice financing
                 print(f"{i}. Invoice #{invoice['number']} | Amount: ${invoice['amount']:,.2f} | Due: {due_date} | "
@@ -1061,14 +1145,21 @@ class BankApplication:
                       f"Seller: {seller_name} | Buyer: {buyer_name}")
                 print(f"   → WARNING: Neither party appears to be our customer")
         
-        print("\n0. Back")
+        print("\nB. Batch fund approved invoices")
+        print("0. Back")
+        
+        selection = input(f"\nSelect invoice to fund (1-{len(approved_invoices)}, B or 0): ").strip()
         
-        selection = input(f"\nSelect invoice to fund (1-{len(approved_invoices)} or 0): ").strip()
+        if selection.upper() == "B":
+            self.batch_fund_invoices()
+            return
         
         try:
             selection = int(selection)
             if 1 <= selection <= len(approved_invoices):
-                self.fund_invoice(approved_invoices[selection - 1])
+                # Stakeholders are resolved once for the whole funding flow
+                with self.stakeholders.operation():
+                    self.fund_invoice(approved_invoices[selection - 1])
             elif selection != 0:
                 print("Invalid selection.")
                 self.wait_for_enter()
@@ -1076,9 +1167,80 @@ class BankApplication:
             print("Invalid input.")
             self.wait_for_enter()
 
+    def batch_fund_invoices(self):
+        """Fund a selection of approved invoices at one rate card"""
+        self.clear_screen()
+        print("BATCH FUND APPROVED INVOICES")
+        print("=" * 28)
+        print()
+        print("1. All approved invoices")
+        print("2. Approved invoices of one buyer")
+        print("3. Approved invoices due within a date window")
+        print("0. Back")
+        
+        choice = input("\nSelect invoices to fund: ").strip()
+        engine = BatchFundingEngine(stakeholders=self.stakeholders, exposure=self.exposure)
+        
+        try:
+            if choice == "1":
+                invoices = engine.select()
+            elif choice == "2":
+                buyers = {}
+                for invoice in engine.select():
+                    buyers.setdefault(invoice['buyer_id'], invoice['buyer_name'])
+                if not buyers:
+                    print("No invoices approved and ready for funding.")
+                    self.wait_for_enter()
+                    return
+                for buyer_id, buyer_name in buyers.items():
+                    print(f"{buyer_id}. {buyer_name}")
+                invoices = engine.select(buyer_id=int(input("\nBuyer ID: ").strip()))
+            elif choice == "3":
+                due_from = parse_date(input("Due from (DD-MM-YYYY): ").strip())
+                due_to = parse_date(input("Due to (DD-MM-YYYY): ").strip())
+                if due_from is None or due_to is None:
+                    print("Invalid date. Batch funding cancelled.")
+                    self.wait_for_enter()
+                    return
+                invoices = engine.select(due_from=due_from, due_to=due_to)
+            else:
+                return
+            
+            if not invoices:
+                print("No approved invoices match the selection.")
+                self.wait_for_enter()
+                return
+            
+            print(f"\n{len(invoices)} invoice(s) selected, face value ${sum(i['amount'] for i in invoices):,.2f}")
+            print("\nPlease enter the rate card:")
+            base_rate = float(input("Base Rate (%): "))
+            margin = float(input("Department Margin (%): "))
+            rate_card = RateCard(base_rate, margin)
+        except ValueError as e:
+            print(f"Invalid input: {e}. Batch funding cancelled.")
+            self.wait_for_enter()
+            return
+        
+        # Preview against the current utilisation before anything is written
+        preview = engine.plan(invoices, rate_card)
+        print(f"\nFinal Discount Rate: {base_rate + margin:.2f}%")
+        print(f"Invoices within limits: {len(preview)} of {len(invoices)}")
+        print(f"Total to be advanced: ${sum(pricing['funded_amount'] for _, pricing, _ in preview):,.2f}")
+        
+        confirm = input("\nConfirm batch funding (Y/N)? ").strip().upper()
+        if confirm != "Y":
+            print("Batch funding cancelled.")
+            self.wait_for_enter()
+            return
+        
+        report = engine.run(invoices, rate_card, self.current_user['id'])
+        print()
+        report.print_summary()
+        self.wait_for_enter()
+
     def get_approved_invoices(self) -> List:
         """Get approved invoices ready for funding"""
-        return self.get_real_invoices_by_status(3)  # Status 3 = Approved
+        return self.get_real_invoices_by_status(invoice_states.APPROVED)
 
     def fund_invoice(self, invoice: dict):
         """Fund an individual invoice"""
@@ -1090,8 +1252,7 @@ class BankApplication:
         # Determine financing type
         seller_name = invoice.get('seller_name', 'Unknown')
         buyer_name = invoice.get('buyer_name', 'Unknown')
-        seller_is_customer = self.is_organization_our_customer(invoice.get('seller_id'))
-        buyer_is_customer = self.is_organization_our_customer(invoice.get('buyer_id'))
+        seller_is_customer, buyer_is_customer = self.get_customer_flags(invoice)
         
         # Format dates for display
         issue_date = invoice.get('issue_date', 'Unknown')
@@ -1100,8 +1261,7 @@ class BankApplication:
         # Calculate days to maturity
         try:
             if due_date != 'Unknown':
-                from datetime import datetime
-                due_date_obj = datetime.strptime(due_date.split()[0], '%Y-%m-%d') if ' ' in due_date else datetime.strptime(due_date, '%Y-%m-%d')
+                due_date_obj = parse_date(due_date)
                 today = datetime.now()
                 days_to_maturity = (due_date_obj - today).days
                 maturity_str = f"{days_to_maturity} days remaining"
@@ -1173,87 +1333,93 @@ class BankApplication:
                 seller_org_id = stakeholders.get('seller_org_id')
                 buyer_org_id = stakeholders.get('buyer_org_id')
                 
-                # Check credit availability for both seller and buyer
-                if not self.check_credit_availability(seller_org_id, invoice['amount']):
+                # Check credit availability for both seller and buyer from one index refresh
+                with self.exposure.operation():
+                    seller_has_credit = self.check_credit_availability(seller_org_id, invoice['amount'])
+                    buyer_has_credit = self.check_credit_availability(buyer_org_id, invoice['amount'])
+                
+                if not seller_has_credit:
                     print(f"Error: Seller does not have sufficient credit limit for ${invoice['amount']:,.2f}")
                     self.wait_for_enter()
                     return
                 
-                if not self.check_credit_availability(buyer_org_id, invoice['amount']):
+                if not buyer_has_credit:
                     print(f"Error: Buyer does not have sufficient credit limit for ${invoice['amount']:,.2f}")
                     self.wait_for_enter()
                     return
                 
-                # Update invoice status based on whether this is a buyer or seller uploaded invoice
-                # For seller uploaded invoices: set to Funded (4)
-                # For buyer uploaded invoices: set to Funding Sent for Seller Approval (5)
-                new_status = 4  # Default to Funded
+                # Seller uploaded invoices are funded; buyer uploaded invoices are
+                # sent to the seller for approval of the early payment first
+                transition = 'fund'
                 if invoice.get('seller_name', None) == invoice.get('counterparty_name', None):
-                    # Buyer uploaded invoice - set to Funding Sent for Seller Approval
-                    new_status = 5
+                    transition = 'offer_funding'
                 
-                if self.update_invoice_status(invoice['id'], new_status):
-                    # Update funding details in database
-                    db = Database()
-                    try:
-                        db.cursor.execute("""
-                            UPDATE Invoices 
-                            SET FundedAmount = ?, DiscountRate = ? 
-                            WHERE Id = ?
-                        """, (str(funded_amount), str(final_rate), invoice['id']))
-                        db.connection.commit()
-                        db.close()
-                        
-                        print("\nFunding processed successfully!")
-                        if new_status == 4:
-                            print("Invoice status updated to 'Funded'")
-                        else:
-                            print("Invoice status updated to 'Funding Sent for Seller Approval'")
+                # Everything below is one unit of work: status, funding details, credit
+                # utilization, notifications, the funding transaction and its journal
+                # entries commit together or not at all
+                try:
+                    with self.db.transaction():
+                        # Only moves an invoice that is still Approved, so funding the
+                        # same invoice twice at once fails here instead of paying twice
+                        if not self.update_invoice_status(invoice['id'], transition,
+                                                          FundedAmount=to_minor(funded_amount),
+                                                          DiscountRate=str(final_rate)):
+                            raise RuntimeError("Failed to update invoice status")
+
                         #if buyer uploaded send notification with ActionRequired=True (for approval)
-                        stakeholders = self.get_invoice_stakeholders(invoice['id'])
                         if invoice.get('seller_name', None) == invoice.get('counterparty_name', None):
                             # Buyer uploaded invoice - notify seller for approval
                             if stakeholders.get('seller_user_id'):
                                 seller_message = f"Early payment opportunity: Invoice #{invoice['number']} from {invoice.get('buyer_name', 'Unknown')} has been approved for funding at a discount rate of {final_rate:.2f}%. If you accept, you will receive ${funded_amount:,.2f} now instead of ${invoice['amount']:,.2f} at maturity."
-                                self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id'], "Early Payment Opportunity", "Action", True)
+                                if not self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id'], "Early Payment Opportunity", "Action", True):
+                                    raise RuntimeError("Failed to notify seller")
                                 print(f"Early payment offer notification sent to seller: {stakeholders.get('seller_name', 'Unknown')}")
                         else:
                             # Seller uploaded invoice - notify of successful funding
                             if stakeholders.get('seller_user_id'):
                                 seller_message = f"Invoice #{invoice['number']} has been funded successfully. ${funded_amount:,.2f} has been credited to your account."
-                                self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id'], "Invoice Funded", "Success", False)
+                                if not self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id'], "Invoice Funded", "Success", False):
+                                    raise RuntimeError("Failed to notify seller")
                                 print(f"Funding notification sent to seller: {stakeholders.get('seller_name', 'Unknown')}")
                         #if seller uploaded send notification with ActionRequired=False 
-                        
+
                         # Update credit utilization for both seller and buyer
-                        if self.update_credit_utilization(seller_org_id, invoice['amount'], True):
-                            print(f"Seller credit utilization updated")
-                        
-                        if self.update_credit_utilization(buyer_org_id, invoice['amount'], True):
-                            print(f"Buyer credit utilization updated")
-                        
+                        if not self.update_credit_utilization(seller_org_id, invoice['amount'], True, invoice['id']):
+                            raise RuntimeError("Failed to update seller credit utilization")
+                        print(f"Seller credit utilization updated")
+
+                        if not self.update_credit_utilization(buyer_org_id, invoice['amount'], True, invoice['id']):
+                            raise RuntimeError("Failed to update buyer credit utilization")
+                        print(f"Buyer credit utilization updated")
+
                         # Send notifications to all parties
-                        stakeholders = self.get_invoice_stakeholders(invoice['id'])
-                        
                         # Notify seller
                         if stakeholders.get('seller_user_id'):
                             seller_message = f"Funding completed! ${funded_amount:,.2f} has been credited to your account for invoice {invoice['number']}. Discount rate: {final_rate:.2f}%"
-                            self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id'])
+                            if not self.send_notification(stakeholders['seller_user_id'], seller_message, invoice['id']):
+                                raise RuntimeError("Failed to notify seller")
                             print(f"Funding notification sent to seller: {stakeholders.get('seller_name', 'Unknown')}")
-                        
+
                         # Notify buyer
                         if stakeholders.get('buyer_user_id'):
                             buyer_message = f"Invoice {invoice['number']} has been funded. You will need to pay ${invoice['amount']:,.2f} at maturity. Due date: {invoice.get('due_date', 'TBD')}"
-                            self.send_notification(stakeholders['buyer_user_id'], buyer_message, invoice['id'])
+                            if not self.send_notification(stakeholders['buyer_user_id'], buyer_message, invoice['id']):
+                                raise RuntimeError("Failed to notify buyer")
                             print(f"Payment reminder sent to buyer: {stakeholders.get('buyer_name', 'Unknown')}")
-                        
+
                         # Record funding transaction
-                        self.record_funding(invoice, base_rate, margin, final_rate, funded_amount, discount_amount)
-                        
-                    except Exception as e:
-                        print(f"Error updating funding details: {e}")
-                else:
-                    print("Error: Failed to update invoice status")
+                        if not self.record_funding(invoice, base_rate, margin, final_rate, funded_amount, discount_amount):
+                            raise RuntimeError("Failed to record funding transaction")
+
+                    print("\nFunding processed successfully!")
+                    if transition == 'fund':
+                        print("Invoice status updated to 'Funded'")
+                    else:
+                        print("Invoice status updated to 'Funding Sent for Seller Approval'")
+
+                except Exception as e:
+                    print(f"Error processing funding: {e}")
+                    print("No changes were saved for this invoice.")
             else:
                 print("Funding cancelled.")
                 
@@ -1263,11 +1429,11 @@ class BankApplication:
         self.wait_for_enter()
 
     def record_funding(self, invoice: dict, base_rate: float, margin: float, 
-                      final_rate: float, funded_amount: float, discount_amount: float):
-        """Record funding transaction"""
+                      final_rate: float, funded_amount: float, discount_amount: float) -> bool:
+        """Record funding transaction and its accounting entries"""
         try:
             db = Database()
-            timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+            timestamp = format_timestamp()
             
             # Insert transaction record
             query = """
@@ -1282,7 +1448,7 @@ class BankApplication:
             invoice_query = "SELECT DueDate, SellerId FROM Invoices WHERE Id = ?"
             db.cursor.execute(invoice_query, (invoice['id'],))
             invoice_details = db.cursor.fetchone()
-            maturity_date = invoice_details[0] if invoice_details and invoice_details[0] else timestamp
+            maturity_date = invoice_details[0] if invoice_details and invoice_details[0] else format_date()
             seller_org_id = invoice_details[1] if invoice_details and invoice_details[1] else 1
             
             db.cursor.execute(query, (
@@ -1291,14 +1457,14 @@ class BankApplication:
                 seller_org_id,  # Organization that received the funding
                 invoice['id'],
                 description,
-                str(funded_amount),
+                to_minor(funded_amount),
                 str(final_rate),
                 timestamp,
                 maturity_date,
                 0  # IsPaid: False initially
             ))
             
-            db.connection.commit()
+            db.commit()
             db.close()
             
             print("Funding transaction recorded in database.")
@@ -1307,7 +1473,7 @@ class BankApplication:
             stakeholders = self.get_invoice_stakeholders(invoice['id'])
             
             # 1. Record the funding transaction (loan advance)
-            self.create_accounting_entry(
+            entries_created = self.create_accounting_entry(
                 "FUNDING", 
                 funded_amount, 
                 invoice['id'], 
@@ -1318,7 +1484,7 @@ class BankApplication:
             
             # 2. Record the discount/fee income
             if discount_amount > 0:
-                self.create_accounting_entry(
+                entries_created = entries_created and self.create_accounting_entry(
                     "INTEREST_INCOME", 
                     discount_amount, 
                     invoice['id'], 
@@ -1328,7 +1494,7 @@ class BankApplication:
                 )
             
             # 3. Automatically credit the seller (this completes the seller side)
-            self.create_accounting_entry(
+            entries_created = entries_created and self.create_accounting_entry(
                 "SELLER_PAYMENT", 
                 funded_amount, 
                 invoice['id'], 
@@ -1337,11 +1503,17 @@ class BankApplication:
                 stakeholders.get('buyer_org_id')
             )
             
+            if not entries_created:
+                print("Error: Failed to create accounting entries for funding transaction")
+                return False
+
             print("Accounting entries created for funding transaction.")
             print(f"Seller automatically credited ${funded_amount:,.2f}")
+            return True
             
         except Exception as e:
             print(f"Error recording funding transaction: {e}")
+            return False
 
     def process_payments(self):
         """Process payments for funded invoices (buyer payments only)"""
@@ -1350,8 +1522,8 @@ class BankApplication:
         print("=" * 15)
         print()
         
-        # Get funded invoices (status 4) - these need buyer payment
-        funded_invoices = self.get_real_invoices_by_status(4)
+        # Funded invoices need buyer payment
+        funded_invoices = self.get_real_invoices_by_status(invoice_states.FUNDED)
         
         if not funded_invoices:
             print("No funded invoices requiring buyer payment found.")
@@ -1375,7 +1547,8 @@ class BankApplication:
                 return
             elif 1 <= choice <= len(funded_invoices):
                 selected_invoice = funded_invoices[choice - 1]
-                self.record_invoice_payment(selected_invoice)
+                with self.stakeholders.operation():
+                    self.record_invoice_payment(selected_invoice)
             else:
                 print("Invalid selection.")
                 self.wait_for_enter()
@@ -1405,8 +1578,12 @@ class BankApplication:
                 return
             
             payment_date = input("Enter payment date (DD-MM-YYYY) or press Enter for today: ").strip()
-            if not payment_date:
-                payment_date = datetime.now().strftime('%d-%m-%Y')
+            try:
+                payment_date = format_date(payment_date or None)
+            except ValueError:
+                print("Invalid date format. Please use DD-MM-YYYY.")
+                self.wait_for_enter()
+                return
             
             print(f"\nPayment Details:")
             print(f"Amount: ${payment_amount:,.2f}")
@@ -1415,12 +1592,12 @@ class BankApplication:
             confirm = input("\nConfirm payment recording (Y/N)? ").strip().upper()
             
             if confirm == "Y":
-                # Update invoice status to Fully Settled (10)
-                if self.update_invoice_status(invoice['id'], 10):
+                # Funded -> Settled
+                if self.update_invoice_status(invoice['id'], 'settle'):
                     # Record payment transaction
                     try:
+                        stakeholders = self.get_invoice_stakeholders(invoice['id'])
                         db = Database()
-                        timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
                         
                         # Insert payment transaction
                         query = """
@@ -1430,7 +1607,7 @@ class BankApplication:
                         """
                         
                         description = f"Payment received for invoice {invoice['number']}"
-                        payment_timestamp = payment_date + " " + datetime.now().strftime('%H:%M:%S')
+                        payment_timestamp = f"{payment_date} {datetime.now().strftime('%H:%M:%S')}"
                         
                         db.cursor.execute(query, (
                             2,  # Type: 2 for Payment
@@ -1438,33 +1615,30 @@ class BankApplication:
                             stakeholders.get('buyer_org_id', 1),  # Organization that made the payment
                             invoice['id'],
                             description,
-                            str(payment_amount),
+                            to_minor(payment_amount),
                             payment_timestamp,
-                            payment_timestamp,  # Maturity date same as payment date since it's paid
+                            payment_date,  # Maturity date same as payment date since it's paid
                             1,  # IsPaid: True
                             payment_timestamp
                         ))
                         
-                        db.connection.commit()
+                        db.commit()
                         db.close()
                         
                         print("\nPayment recorded successfully!")
                         print("Invoice status updated to 'Fully Settled'")
                         
                         # Restore credit utilization for both seller and buyer
-                        stakeholders = self.get_invoice_stakeholders(invoice['id'])
                         seller_org_id = stakeholders.get('seller_org_id')
                         buyer_org_id = stakeholders.get('buyer_org_id')
                         
-                        if self.update_credit_utilization(seller_org_id, invoice['amount'], False):
+                        if self.update_credit_utilization(seller_org_id, invoice['amount'], False, invoice['id']):
                             print(f"Seller credit limit restored")
                         
-                        if self.update_credit_utilization(buyer_org_id, invoice['amount'], False):
+                        if self.update_credit_utilization(buyer_org_id, invoice['amount'], False, invoice['id']):
                             print(f"Buyer credit limit restored")
                         
                         # Send notifications
-                        stakeholders = self.get_invoice_stakeholders(invoice['id'])
-                        
                         # Notify seller
                         if stakeholders.get('seller_user_id'):
                             seller_message = f"Buyer payment of ${payment_amount:,.2f} has been received for invoice {invoice['number']}. The financing cycle is now complete."
@@ -1553,6 +1727,7 @@ class BankApplication:
             print("Reports:")
             print("5. View Account Balances")
             print("6. Generate Trial Balance")
+            print("10. Export Ledger")
             print()
             print("Transaction Processing:")
             print("7. Create Invoice Financing Entry")
@@ -1581,6 +1756,8 @@ class BankApplication:
                 self.create_payment_entry()
             elif choice == "9":
                 self.view_transaction_history()
+            elif choice == "10":
+                self.export_ledger()
             elif choice == "0":
                 exit_menu = True
             else:
@@ -1591,10 +1768,83 @@ class BankApplication:
                 print("=" * 28)
                 print()
 
+    def export_ledger(self):
+        """Export journal lines, journal entries or transactions to a file, a page at a time"""
+        self.clear_screen()
+        print("EXPORT LEDGER")
+        print("=" * 13)
+        print()
+        print("1. Journal entry lines")
+        print("2. Journal entries")
+        print("3. Transactions")
+        print("0. Back")
+        
+        dataset = {'1': 'journal_lines', '2': 'journal_entries', '3': 'transactions'}.get(
+            input("\nSelect a dataset: ").strip())
+        if dataset is None:
+            return
+        
+        formats = sorted(ledger_export.WRITERS)
+        fmt = input(f"Format ({'/'.join(formats)}) [csv]: ").strip().lower() or 'csv'
+        if fmt not in formats:
+            print("\nInvalid format.")
+            self.wait_for_enter()
+            return
+        
+        filters = {
+            'date_from': input("From date (DD-MM-YYYY, blank for all): ").strip() or None,
+            'date_to': input("To date (DD-MM-YYYY, blank for all): ").strip() or None,
+            'invoice_number': input("Invoice number (blank for all): ").strip() or None,
+        }
+        org_text = input("Organization ID (blank for all): ").strip()
+        if org_text:
+            if not org_text.isdigit():
+                print("\nInvalid organization ID.")
+                self.wait_for_enter()
+                return
+            filters['organization_id'] = int(org_text)
+        
+        extension = 'txt' if fmt == 'text' else fmt
+        default_path = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        path = input(f"File name [{default_path}]: ").strip() or default_path
+        
+        try:
+            if fmt in ledger_export.BINARY_FORMATS:
+                with open(path, 'wb') as out:
+                    count = ledger_export.export_ledger(out, dataset, fmt, **filters)
+            else:
+                with open(path, 'w', encoding='utf-8', newline='') as out:
+                    count = ledger_export.export_ledger(out, dataset, fmt, **filters)
+            print(f"\n{count:,} row(s) written to {path}")
+        except Exception as e:
+            print(f"Error exporting ledger: {e}")
+        
+        self.wait_for_enter()
+
     def view_chart_of_accounts(self):
         """View chart of accounts"""
-        print("\nVIEW CHART OF ACCOUNTS")
-        print("Feature not implemented yet.")
+        self.clear_screen()
+        print("CHART OF ACCOUNTS")
+        print("=" * 17)
+        print()
+        
+        try:
+            with Database() as db:
+                accounts = trial_balance.load_accounts(db, active_only=False)
+            
+            if not accounts:
+                print("No accounts found.")
+            else:
+                print(f"{'Code':<8} {'Account':<35} {'Type':<10} {'Status':<8}")
+                print("-" * 64)
+                for account in accounts:
+                    account_type = trial_balance.ACCOUNT_TYPES.get(account['type'], 'Unknown')
+                    status = "Active" if account['active'] else "Inactive"
+                    print(f"{account['code']:<8} {account['name']:<35} {account_type:<10} {status:<8}")
+                    
+        except Exception as e:
+            print(f"Error retrieving chart of accounts: {e}")
+        
         self.wait_for_enter()
 
     def view_journal_entries(self):
@@ -1617,14 +1867,77 @@ class BankApplication:
 
     def view_account_balances(self):
         """View account balances"""
-        print("\nVIEW ACCOUNT BALANCES")
-        print("Feature not implemented yet.")
+        self.clear_screen()
+        print("ACCOUNT BALANCES")
+        print("=" * 16)
+        print()
+        
+        try:
+            with Database() as db:
+                # Running balances, kept current on every journal posting
+                accounts = trial_balance.account_balances(db)
+            
+            current_type = None
+            for line in accounts:
+                if not line['active'] and not line['balance']:
+                    continue
+                if line['type'] != current_type:
+                    current_type = line['type']
+                    heading = {0: "ASSETS", 1: "LIABILITIES", 2: "EQUITY", 3: "REVENUE", 4: "EXPENSES"}.get(current_type, "OTHER")
+                    print(f"\n{heading}:")
+                print(f"   {line['code']} - {line['name']:<35} ${from_minor(line['balance']):>15,.2f}")
+                
+        except Exception as e:
+            print(f"Error retrieving account balances: {e}")
+        
         self.wait_for_enter()
 
     def generate_trial_balance(self):
         """Generate trial balance"""
-        print("\nGENERATE TRIAL BALANCE")
-        print("Feature not implemented yet.")
+        self.clear_screen()
+        print("TRIAL BALANCE")
+        print("=" * 13)
+        print()
+        
+        try:
+            with Database() as db:
+                tb = trial_balance.trial_balance(db)
+            
+            print(f"As of: {format_timestamp()}")
+            print()
+            print(f"{'Code':<8} {'Account':<35} {'Debit':>16} {'Credit':>16}")
+            print("-" * 78)
+            for line in tb['lines']:
+                if not line['debit'] and not line['credit']:
+                    continue
+                debit = f"${from_minor(line['debit']):,.2f}" if line['debit'] else ""
+                credit = f"${from_minor(line['credit']):,.2f}" if line['credit'] else ""
+                print(f"{line['code']:<8} {line['name']:<35} {debit:>16} {credit:>16}")
+            print("-" * 78)
+            print(f"{'':<8} {'TOTAL':<35} {'$' + format(from_minor(tb['total_debit']), ',.2f'):>16} "
+                  f"{'$' + format(from_minor(tb['total_credit']), ',.2f'):>16}")
+            
+            difference = tb['total_debit'] - tb['total_credit']
+            if difference:
+                print(f"\nWARNING: Trial balance is out of balance by ${from_minor(abs(difference)):,.2f}")
+            else:
+                print("\nTrial balance is in balance.")
+            
+            save = input("\nSave as period snapshot (Y/N)? ").strip().upper()
+            if save == "Y":
+                as_of_input = input("Period end date (DD-MM-YYYY, blank for today): ").strip()
+                try:
+                    as_of = parse_date(as_of_input) if as_of_input else None
+                except ValueError:
+                    print("Invalid date.")
+                else:
+                    with Database() as db:
+                        snapshot_id = trial_balance.take_snapshot(db, self.current_user['id'], as_of)
+                    print(f"Trial balance snapshot #{snapshot_id} saved.")
+                    
+        except Exception as e:
+            print(f"Error generating trial balance: {e}")
+        
         self.wait_for_enter()
 
     def create_invoice_financing_entry(self):
@@ -1649,41 +1962,21 @@ class BankApplication:
         """Wait for user to press Enter"""
         input("\nPress Enter to continue...")
 
-    def update_invoice_status(self, invoice_id: int, new_status: int, notes: str = "") -> bool:
-        """Update invoice status in database"""
+    def update_invoice_status(self, invoice_id: int, transition: str, **values) -> bool:
+        """Move an invoice through a state machine transition (see invoice_states.TRANSITIONS)"""
         try:
             db = Database()
             
-            # Status mapping:
-            # 1=New (applicable to both buyer and seller)
-            # 2=Validated (buyer or seller invoice)
-            # 3=Approved (buyer or seller invoice)
-            # 4=Funded seller invoice (once seller invoice is funded)
-            # 5=Funding sent for Seller Approval (for buyer uploaded invoice)
-            # 6=Pending Seller approval (for buyer uploaded invoice)
-            # 7=Seller Approved (for buyer uploaded invoice)
-            # 8=Discounted Invoice (payment regardless if buyer or seller)
-            # 9=Invoice Due on Maturity Date
-            # 10=Invoice fully settled (paid by the buyer)
-            query = "UPDATE Invoices SET Status = ? WHERE Id = ?"
-            db.cursor.execute(query, (new_status, invoice_id))
-            
-            # Add status change timestamp based on status
-            timestamp = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
-            
-            if new_status == 4:  # Funded
-                db.cursor.execute("UPDATE Invoices SET FundingDate = ? WHERE Id = ?", (timestamp, invoice_id))
-            elif new_status == 10:  # Fully settled
-                db.cursor.execute("UPDATE Invoices SET PaymentDate = ? WHERE Id = ?", (timestamp, invoice_id))
-            elif new_status == 3:  # Approved (buyer approval)
-                db.cursor.execute("UPDATE Invoices SET BuyerApproved = 1, BuyerApprovalDate = ? WHERE Id = ?", (timestamp, invoice_id))
-            elif new_status == 5:  # Funding sent for seller approval
-                db.cursor.execute("UPDATE Invoices SET FundingOfferDate = ? WHERE Id = ?", (timestamp, invoice_id))
-            elif new_status == 7:  # Seller approved
-                db.cursor.execute("UPDATE Invoices SET SellerApprovalDate = ? WHERE Id = ?", (timestamp, invoice_id))
-            
-            db.connection.commit()
+            # One conditional UPDATE sets the status and the transition's columns;
+            # it matches nothing if the invoice is not in a status the transition starts from
+            moved = invoice_states.transition(db, transition, [invoice_id], **values)
+            
+            db.commit()
             db.close()
+            
+            if not moved:
+                print(f"Invoice {invoice_id} is not in a status that allows '{transition}'")
+                return False
             return True
             
         except Exception as e:
@@ -1695,7 +1988,7 @@ class BankApplication:
         try:
             db = Database()
             
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            timestamp = format_timestamp()
             
             # Insert notification with all required fields
             query = """
@@ -1716,7 +2009,7 @@ class BankApplication:
             )
             
             db.cursor.execute(query, values)
-            db.connection.commit()
+            db.commit()
             db.close()
             return True
             
@@ -1727,33 +2020,8 @@ class BankApplication:
     def get_invoice_stakeholders(self, invoice_id: int) -> dict:
         """Get seller and buyer user IDs for an invoice"""
         try:
-            db = Database()
-            
-            query = """
-                SELECT i.SellerId, i.BuyerId, i.InvoiceNumber,
-                       seller_users.Id as SellerUserId, buyer_users.Id as BuyerUserId,
-                       seller_users.Name as SellerName, buyer_users.Name as BuyerName
-                FROM Invoices i
-                LEFT JOIN Users seller_users ON seller_users.OrganizationId = i.SellerId AND seller_users.Role = 2
-                LEFT JOIN Users buyer_users ON buyer_users.OrganizationId = i.BuyerId AND buyer_users.Role = 2
-                WHERE i.Id = ?
-            """
-            
-            db.cursor.execute(query, (invoice_id,))
-            result = db.cursor.fetchone()
-            db.close()
-            
-            if result:
-                return {
-                    'seller_org_id': result[0],
-                    'buyer_org_id': result[1],
-                    'invoice_number': result[2],
-                    'seller_user_id': result[3],
-                    'buyer_user_id': result[4],
-                    'seller_name': result[5],
-                    'buyer_name': result[6]
-                }
-            return {}
+            # Cached; resolved once per invoice inside self.stakeholders.operation()
+            return self.stakeholders.resolve(invoice_id)
             
         except Exception as e:
             print(f"Error getting invoice stakeholders: {e}")
@@ -1767,7 +2035,11 @@ class BankApplication:
             query = """
                 SELECT i.Id, i.InvoiceNumber, i.Amount, i.Description, i.IssueDate, i.DueDate,
                        seller.Name as SellerName, buyer.Name as BuyerName, i.Status, i.SellerId, i.BuyerId, 
-                       i.CounterpartyId, counterparty.Name as CounterpartyName
+                       i.CounterpartyId, counterparty.Name as CounterpartyName,
+                       EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                               WHERE cl.OrganizationId = i.SellerId) as SellerIsCustomer,
+                       EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                               WHERE cl.OrganizationId = i.BuyerId) as BuyerIsCustomer
                 FROM Invoices i
                 LEFT JOIN Organizations seller ON i.SellerId = seller.Id
                 LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
@@ -1790,46 +2062,21 @@ class BankApplication:
                 if not counterparty_name or counterparty_name == "Unknown":
                     counterparty_name = row[6]  # Default to seller name
                 
-                # Format dates nicely if possible
-                issue_date = row[4]
-                due_date = row[5]
-                
-                # Try to format the dates in a more readable way
-                try:
-                    from datetime import datetime
-                    
-                    # Parse and reformat issue date
-                    if issue_date:
-                        if ' ' in issue_date:  # Contains time component
-                            issue_date_obj = datetime.strptime(issue_date.split()[0], '%Y-%m-%d')
-                        else:
-                            issue_date_obj = datetime.strptime(issue_date, '%Y-%m-%d')
-                        issue_date = issue_date_obj.strftime('%Y-%m-%d')
-                    
-                    # Parse and reformat due date
-                    if due_date:
-                        if ' ' in due_date:  # Contains time component
-                            due_date_obj = datetime.strptime(due_date.split()[0], '%Y-%m-%d')
-                        else:
-                            due_date_obj = datetime.strptime(due_date, '%Y-%m-%d')
-                        due_date = due_date_obj.strftime('%Y-%m-%d')
-                except Exception:
-                    # If there's any error, keep the original dates
-                    pass
-                
                 invoices.append({
                     'id': row[0],
                     'number': row[1],
-                    'amount': float(row[2]) if row[2] else 0.0,
+                    'amount': from_minor(row[2]),
                     'description': row[3],
-                    'issue_date': issue_date,
-                    'due_date': due_date,
+                    'issue_date': row[4],  # Stored as YYYY-MM-DD
+                    'due_date': row[5],
                     'seller_name': row[6],
                     'buyer_name': row[7],
                     'status': row[8],
                     'seller_id': row[9],
                     'buyer_id': row[10],
-                    'counterparty_name': counterparty_name
+                    'counterparty_name': counterparty_name,
+                    'seller_is_customer': bool(row[13]),  # Has credit facilities with us
+                    'buyer_is_customer': bool(row[14])
                 })
             
             return invoices
@@ -1842,7 +2089,7 @@ class BankApplication:
         """Create accounting journal entries for different transaction types"""
         try:
             db = Database()
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            timestamp = format_timestamp()
             
             # Generate transaction reference
             trans_ref = f"{transaction_type.upper()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
@@ -1866,47 +2113,48 @@ class BankApplication:
             ))
             
             journal_entry_id = db.cursor.lastrowid
+            amount_minor = to_minor(amount)  # Journal lines store integer cents
             
             # Create journal entry lines based on transaction type
             if transaction_type in ["VALIDATION", "APPROVAL"]:
                 # No monetary entries for validation/approval - just documentation
                 # Add a memo entry
-                self.create_journal_line(db, journal_entry_id, 1, "0", "0", f"Memo: {description}", seller_org_id)
+                self.create_journal_line(db, journal_entry_id, 1, 0, 0, f"Memo: {description}", seller_org_id)
                 
             elif transaction_type == "FUNDING":
                 # Dr: Loans to Customers (1300)    Cr: Cash (1100)
-                self.create_journal_line(db, journal_entry_id, 3, str(amount), "0", f"Loan advance for invoice funding - {description}", seller_org_id)  # Debit
-                self.create_journal_line(db, journal_entry_id, 1, "0", str(amount), f"Cash disbursement for invoice funding - {description}", seller_org_id)  # Credit
+                self.create_journal_line(db, journal_entry_id, 3, amount_minor, 0, f"Loan advance for invoice funding - {description}", seller_org_id)  # Debit
+                self.create_journal_line(db, journal_entry_id, 1, 0, amount_minor, f"Cash disbursement for invoice funding - {description}", seller_org_id)  # Credit
                 
             elif transaction_type == "PAYMENT":
                 # Dr: Cash (1100)    Cr: Loans to Customers (1300)
-                self.create_journal_line(db, journal_entry_id, 1, str(amount), "0", f"Payment received - {description}", buyer_org_id)  # Debit
-                self.create_journal_line(db, journal_entry_id, 3, "0", str(amount), f"Loan repayment - {description}", buyer_org_id)  # Credit
+                self.create_journal_line(db, journal_entry_id, 1, amount_minor, 0, f"Payment received - {description}", buyer_org_id)  # Debit
+                self.create_journal_line(db, journal_entry_id, 3, 0, amount_minor, f"Loan repayment - {description}", buyer_org_id)  # Credit
                 
             elif transaction_type == "SELLER_PAYMENT":
                 # Dr: Cash (1100)    Cr: Cash (1100) - This represents the actual payment to seller
                 # This is essentially a memo entry since the cash was already debited in FUNDING
-                self.create_journal_line(db, journal_entry_id, 1, "0", "0", f"Memo: Seller payment processed - {description}", seller_org_id)
+                self.create_journal_line(db, journal_entry_id, 1, 0, 0, f"Memo: Seller payment processed - {description}", seller_org_id)
                 
             elif transaction_type == "FEE_INCOME":
                 # Dr: Cash (1100)    Cr: Fee Income (4200)
-                self.create_journal_line(db, journal_entry_id, 1, str(amount), "0", f"Fee income earned - {description}", 1)  # Debit
-                self.create_journal_line(db, journal_entry_id, 14, "0", str(amount), f"Fee income earned - {description}", 1)  # Credit
+                self.create_journal_line(db, journal_entry_id, 1, amount_minor, 0, f"Fee income earned - {description}", 1)  # Debit
+                self.create_journal_line(db, journal_entry_id, 14, 0, amount_minor, f"Fee income earned - {description}", 1)  # Credit
                 
             elif transaction_type == "INTEREST_INCOME":
                 # Dr: Accounts Receivable (1200)    Cr: Interest Income (4100)
-                self.create_journal_line(db, journal_entry_id, 2, str(amount), "0", f"Interest income accrued - {description}", seller_org_id)  # Debit
-                self.create_journal_line(db, journal_entry_id, 13, "0", str(amount), f"Interest income accrued - {description}", seller_org_id)  # Credit
+                self.create_journal_line(db, journal_entry_id, 2, amount_minor, 0, f"Interest income accrued - {description}", seller_org_id)  # Debit
+                self.create_journal_line(db, journal_entry_id, 13, 0, amount_minor, f"Interest income accrued - {description}", seller_org_id)  # Credit
             
             elif transaction_type == "REJECTION":
                 # Memo entry for rejections
-                self.create_journal_line(db, journal_entry_id, 1, "0", "0", f"Memo: {description}", seller_org_id)
+                self.create_journal_line(db, journal_entry_id, 1, 0, 0, f"Memo: {description}", seller_org_id)
                 
             elif transaction_type == "MATURITY":
                 # Handle matured invoices - may need special accounting
-                self.create_journal_line(db, journal_entry_id, 1, "0", "0", f"Memo: {description}", buyer_org_id)
+                self.create_journal_line(db, journal_entry_id, 1, 0, 0, f"Memo: {description}", buyer_org_id)
             
-            db.connection.commit()
+            db.commit()
             db.close()
             
             print(f"Accounting entry created: {trans_ref}")
@@ -1916,8 +2164,8 @@ class BankApplication:
             print(f"Error creating accounting entry: {e}")
             return False
     
-    def create_journal_line(self, db, journal_entry_id: int, account_id: int, debit_amount: str, credit_amount: str, description: str, org_id: int = None):
-        """Create individual journal entry line"""
+    def create_journal_line(self, db, journal_entry_id: int, account_id: int, debit_amount: int, credit_amount: int, description: str, org_id: int = None):
+        """Create individual journal entry line (amounts in integer cents)"""
         line_query = """
             INSERT INTO JournalEntryLines (JournalEntryId, AccountId, DebitAmount, CreditAmount, Description, OrganizationId)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -1932,61 +2180,39 @@ class BankApplication:
             org_id
         ))
 
-    def update_account_balance(self, account_id: int, amount: float, is_debit: bool) -> bool:
-        """Update account balance based on debit/credit"""
-        try:
-            # Use the existing database connection passed in create_accounting_entry
-            # This function should be called within a transaction context
-            return True  # Balance updates will be handled in a batch at period end
-            
-        except Exception as e:
-            print(f"Error updating account balance: {e}")
-            return False
-
-    def update_credit_utilization(self, organization_id: int, amount: float, is_utilization: bool) -> bool:
+    def update_credit_utilization(self, organization_id: int, amount: float, is_utilization: bool,
+                                  invoice_id: int = None) -> bool:
         """Update credit utilization for an organization"""
         try:
             db = Database()
+            amount_minor = to_minor(amount)
+            user_id = self.current_user['id'] if self.current_user else None
             
-            # Get current facility info
-            query = """
-                SELECT f.Id, f.TotalLimit, f.CurrentUtilization 
-                FROM Facilities f 
-                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
-                WHERE cl.OrganizationId = ?
-            """
-            db.cursor.execute(query, (organization_id,))
-            facility = db.cursor.fetchone()
-            
-            if not facility:
-                print(f"No active credit facility found for organization {organization_id}")
-                db.close()
-                return False
-            
-            facility_id, limit, current_utilization = facility
-            current_utilization = float(current_utilization) if current_utilization else 0.0
-            limit_amount = float(limit) if limit else 0.0
-            
+            # One conditional UPDATE plus a ledger row; the limit is enforced in SQL,
+            # so concurrent funding against the same organization cannot overshoot it
             if is_utilization:
                 # Increase utilization (when funding)
-                new_utilization = current_utilization + amount
-                if new_utilization > limit_amount:
-                    print(f"Credit limit exceeded! Available: ${limit_amount - current_utilization:,.2f}, Requested: ${amount:,.2f}")
-                    db.close()
-                    return False
+                updated = credit_ledger.consume(db, organization_id, amount_minor, invoice_id, user_id)
             else:
                 # Decrease utilization (when payment received)
-                new_utilization = max(0, current_utilization - amount)
+                updated = credit_ledger.repay(db, organization_id, amount_minor, invoice_id, user_id)
+            db.commit()
             
-            # Update utilization
-            update_query = "UPDATE Facilities SET CurrentUtilization = ? WHERE Id = ?"
-            db.cursor.execute(update_query, (str(new_utilization), facility_id))
-            db.connection.commit()
+            position = credit_ledger.facility_position(db, organization_id)
+            db.close()
             
-            print(f"Credit utilization updated: ${current_utilization:,.2f} → ${new_utilization:,.2f}")
-            print(f"Available credit: ${limit_amount - new_utilization:,.2f}")
+            if position is None:
+                print(f"No active credit facility found for organization {organization_id}")
+                return False
             
-            db.close()
+            _, limit_minor, utilised_minor, reserved_minor = position
+            available_minor = limit_minor - utilised_minor - reserved_minor
+            if not updated:
+                print(f"Credit limit exceeded! Available: ${from_minor(available_minor):,.2f}, Requested: ${amount:,.2f}")
+                return False
+            
+            print(f"Credit utilization is now ${from_minor(utilised_minor):,.2f}")
+            print(f"Available credit: ${from_minor(available_minor):,.2f}")
             return True
             
         except Exception as e:
@@ -1996,27 +2222,10 @@ class BankApplication:
     def check_credit_availability(self, organization_id: int, required_amount: float) -> bool:
         """Check if organization has sufficient credit available"""
         try:
-            db = Database()
-            
-            query = """
-                SELECT f.TotalLimit, f.CurrentUtilization 
-                FROM Facilities f 
-                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
-                WHERE cl.OrganizationId = ?
-            """
-            db.cursor.execute(query, (organization_id,))
-            facility = db.cursor.fetchone()
-            
-            if not facility:
-                db.close()
-                return False
-            
-            limit_amount = float(facility[0]) if facility[0] else 0.0
-            utilized_amount = float(facility[1]) if facility[1] else 0.0
-            available = limit_amount - utilized_amount
-            
-            db.close()
-            return available >= required_amount
+            # Headroom net of utilisation and reservations; advisory only, since
+            # update_credit_utilization enforces the limit again when it writes
+            available_minor = self.exposure.available(organization_id)
+            return available_minor is not None and available_minor >= to_minor(required_amount)
             
         except Exception as e:
             print(f"Error checking credit availability: {e}")
@@ -2028,25 +2237,20 @@ class BankApplication:
             return False
             
         try:
-            db = Database()
-            
-            # Check if organization has any credit facilities
-            query = """
-                SELECT COUNT(*) 
-                FROM Facilities f 
-                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
-                WHERE cl.OrganizationId = ?
-            """
-            db.cursor.execute(query, (org_id,))
-            result = db.cursor.fetchone()
-            db.close()
-            
-            return result and result[0] > 0
+            # Customers are the organizations with credit facilities
+            return self.exposure.has_facilities(org_id)
             
         except Exception as e:
             print(f"Error checking customer status: {e}")
             return False
 
+    def get_customer_flags(self, invoice: dict) -> tuple:
+        """Return (seller_is_customer, buyer_is_customer), using the flags loaded with the invoice when present"""
+        if 'seller_is_customer' in invoice and 'buyer_is_customer' in invoice:
+            return invoice['seller_is_customer'], invoice['buyer_is_customer']
+        return (self.is_organization_our_customer(invoice.get('seller_id')),
+                self.is_organization_our_customer(invoice.get('buyer_id')))
+
 def main():
     """Main function to run the bank portal"""
     try:
@@ -0,0 +1,392 @@
+"""
+Batch funding of approved invoices for the Bank Portal
+
+Funds many approved invoices in one run at a common rate card.
+The selection is priced in memory, credit limits are checked against a
+snapshot of facility utilisation taken once for the run, and the results are
+written with executemany, one transaction per FUNDING_BATCH_SIZE invoices:
+status and funding details, credit utilisation, the Transactions rows, the
+journal entries and the notifications of each batch commit together.
+
+Pricing, limit checks, journal lines and notifications are the same as
+BankApplication.fund_invoice produces for a single invoice.
+"""
+
+import time
+from datetime import datetime
+
+from src import invoice_states, credit_ledger
+from src.database import Database, to_minor, from_minor, format_date, format_timestamp
+from src.stakeholders import StakeholderResolver, QUERY_CHUNK_SIZE
+from src.exposure_index import ExposureIndex, get_exposure_index
+
+# Invoices written per transaction
+FUNDING_BATCH_SIZE = 200
+
+# Outcome of each invoice in a run
+FUNDED = 'funded'
+OFFERED = 'offered'          # Funding sent for seller approval
+REJECTED = 'rejected'        # Failed a limit check; left at Approved
+SKIPPED = 'skipped'          # No longer approved when its batch was written
+FAILED = 'failed'            # Its batch could not be written; left at Approved
+
+
+def _chunks(items: list, size: int = QUERY_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class RateCard:
+    """Base rate plus margin (in %), with optional per-buyer margins"""
+
+    def __init__(self, base_rate: float, margin: float, buyer_margins: dict = None):
+        if base_rate < 0 or margin < 0:
+            raise ValueError("Rates cannot be negative")
+        buyer_margins = dict(buyer_margins or {})
+        if any(value < 0 for value in buyer_margins.values()):
+            raise ValueError("Rates cannot be negative")
+        self.base_rate = base_rate
+        self.margin = margin
+        self.buyer_margins = buyer_margins  # buyer org id -> margin
+
+    def margin_for(self, buyer_id: int) -> float:
+        return self.buyer_margins.get(buyer_id, self.margin)
+
+    def rate_for(self, buyer_id: int) -> float:
+        """Final discount rate (%) for an invoice of this buyer"""
+        return self.base_rate + self.margin_for(buyer_id)
+
+
+class BatchFundingReport:
+    """Per-invoice outcomes and totals for one batch funding run"""
+
+    def __init__(self):
+        self.outcomes = []   # One dict per selected invoice, in selection order
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, invoice: dict, outcome: str, reason: str = "", **pricing):
+        self.outcomes.append({
+            'invoice_id': invoice['id'],
+            'number': invoice['number'],
+            'amount': invoice['amount'],
+            'outcome': outcome,
+            'reason': reason,
+            'final_rate': pricing.get('final_rate'),
+            'discount_amount': pricing.get('discount_amount', 0.0),
+            'funded_amount': pricing.get('funded_amount', 0.0)
+        })
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def count(self, *outcomes) -> int:
+        return sum(1 for o in self.outcomes if o['outcome'] in outcomes)
+
+    @property
+    def total_funded(self) -> float:
+        return sum(o['funded_amount'] for o in self.outcomes if o['outcome'] in (FUNDED, OFFERED))
+
+    @property
+    def total_discount(self) -> float:
+        return sum(o['discount_amount'] for o in self.outcomes if o['outcome'] in (FUNDED, OFFERED))
+
+    def print_summary(self, show_all: bool = True):
+        """Print the per-invoice outcomes and the totals"""
+        if show_all and self.outcomes:
+            print(f"{'Invoice':<20} {'Amount':>15} {'Rate':>7} {'Funded':>15}  Outcome")
+            print("-" * 75)
+            for o in self.outcomes:
+                rate = f"{o['final_rate']:.2f}%" if o['final_rate'] is not None else "-"
+                detail = f"{o['outcome']}" + (f" ({o['reason']})" if o['reason'] else "")
+                print(f"{o['number']:<20} {o['amount']:>15,.2f} {rate:>7} {o['funded_amount']:>15,.2f}  {detail}")
+            print()
+        print(f"Batch funding finished in {self.elapsed:.2f}s ({self.batches} batch(es))")
+        print(f"  Funded:                  {self.count(FUNDED):,}")
+        print(f"  Sent for approval:       {self.count(OFFERED):,}")
+        print(f"  Rejected (limits):       {self.count(REJECTED):,}")
+        print(f"  Skipped:                 {self.count(SKIPPED):,}")
+        print(f"  Failed:                  {self.count(FAILED):,}")
+        print(f"  Total advanced:          ${self.total_funded:,.2f}")
+        print(f"  Total discount:          ${self.total_discount:,.2f}")
+
+
+def select_approved_invoices(db: Database, buyer_id: int = None, due_from=None, due_to=None) -> list:
+    """
+    Return approved invoices, earliest due first, optionally for one buyer
+    and/or with a due date in [due_from, due_to].
+    """
+    conditions = ["i.Status = ?"]
+    params = [invoice_states.APPROVED]
+    if buyer_id is not None:
+        conditions.append("i.BuyerId = ?")
+        params.append(buyer_id)
+    if due_from is not None:
+        conditions.append("i.DueDate >= ?")
+        params.append(format_date(due_from))
+    if due_to is not None:
+        conditions.append("i.DueDate <= ?")
+        params.append(format_date(due_to))
+
+    db.cursor.execute(f"""
+        SELECT i.Id, i.InvoiceNumber, i.Amount, i.DueDate, i.SellerId, i.BuyerId,
+               seller.Name, buyer.Name, counterparty.Name
+        FROM Invoices i
+        LEFT JOIN Organizations seller ON i.SellerId = seller.Id
+        LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
+        LEFT JOIN Organizations counterparty ON i.CounterpartyId = counterparty.Id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY i.DueDate, i.Id
+    """, params)
+
+    invoices = []
+    for row in db.cursor.fetchall():
+        invoices.append({
+            'id': row[0],
+            'number': row[1],
+            'amount': from_minor(row[2]),
+            'due_date': row[3],
+            'seller_id': row[4],
+            'buyer_id': row[5],
+            'seller_name': row[6],
+            'buyer_name': row[7],
+            # Same default as get_real_invoices_by_status: no counterparty reads as the seller
+            'counterparty_name': row[8] or row[6]
+        })
+    return invoices
+
+
+def price_invoice(invoice: dict, rate_card: RateCard) -> dict:
+    """Discount and advance for one invoice, as fund_invoice computes them"""
+    base_rate = rate_card.base_rate
+    margin = rate_card.margin_for(invoice['buyer_id'])
+    final_rate = base_rate + margin
+    discount_amount = invoice['amount'] * (final_rate / 100)
+    return {
+        'base_rate': base_rate,
+        'margin': margin,
+        'final_rate': final_rate,
+        'discount_amount': discount_amount,
+        'funded_amount': invoice['amount'] - discount_amount
+    }
+
+
+class BatchFundingEngine:
+    """Price, limit-check and fund a selection of approved invoices"""
+
+    def __init__(self, db_name: str = "supply_chain_finance.db", stakeholders: StakeholderResolver = None,
+                 batch_size: int = FUNDING_BATCH_SIZE, exposure: ExposureIndex = None):
+        self.db_name = db_name
+        self.stakeholders = stakeholders or StakeholderResolver(db_name)
+        self.batch_size = batch_size
+        self.exposure = exposure or get_exposure_index(db_name)
+
+    def select(self, buyer_id: int = None, due_from=None, due_to=None) -> list:
+        """Approved invoices matching the selection"""
+        with Database(self.db_name) as db:
+            return select_approved_invoices(db, buyer_id, due_from, due_to)
+
+    def plan(self, invoices: list, rate_card: RateCard, report: BatchFundingReport = None) -> list:
+        """
+        Price the invoices and check limits against one utilisation snapshot.
+
+        Returns [(invoice, pricing, transition)] for the invoices that fit;
+        the others are added to the report as rejected.
+        """
+        report = report if report is not None else BatchFundingReport()
+        # Like check_credit_availability, an organization's first facility is the one checked
+        snapshot = self.exposure.utilisation_snapshot(org_id for invoice in invoices
+                                                      for org_id in (invoice['seller_id'], invoice['buyer_id']))
+
+        planned = []
+        for invoice in invoices:
+            pricing = price_invoice(invoice, rate_card)
+            if pricing['funded_amount'] <= 0:
+                report.add(invoice, REJECTED, "discount not below face value", **pricing)
+                continue
+
+            amount_minor = to_minor(invoice['amount'])
+            reason = ""
+            for role, org_id in (('Seller', invoice['seller_id']), ('Buyer', invoice['buyer_id'])):
+                facility = snapshot.get(org_id)
+                if facility is None:
+                    reason = f"{role} has no credit facility"
+                    break
+                if facility['limit'] - facility['used'] < amount_minor:
+                    reason = f"{role} credit limit exceeded"
+                    break
+            if reason:
+                report.add(invoice, REJECTED, reason, **pricing)
+                continue
+
+            # Both parties' utilisation grows by the face value, as in fund_invoice
+            snapshot[invoice['seller_id']]['used'] += amount_minor
+            snapshot[invoice['buyer_id']]['used'] += amount_minor
+
+            # Buyer uploaded invoices go to the seller for approval first
+            buyer_uploaded = invoice['seller_name'] == invoice['counterparty_name']
+            planned.append((invoice, pricing, 'offer_funding' if buyer_uploaded else 'fund'))
+        return planned
+
+    def run(self, invoices: list, rate_card: RateCard, user_id: int, verbose: bool = True) -> BatchFundingReport:
+        """Fund the invoices, one transaction per batch; returns the per-invoice report"""
+        report = BatchFundingReport()
+        planned = self.plan(invoices, rate_card, report)
+
+        with self.stakeholders.operation():
+            stakeholders = self.stakeholders.resolve_many([invoice['id'] for invoice, _, _ in planned])
+
+            for batch in _chunks(planned, self.batch_size):
+                report.batches += 1
+                try:
+                    with Database(self.db_name) as db:
+                        with db.transaction():
+                            written = self._write_batch(db, batch, stakeholders, user_id)
+                except Exception as e:
+                    print(f"Error funding batch {report.batches}: {e}")
+                    for invoice, pricing, _ in batch:
+                        report.add(invoice, FAILED, str(e), **pricing)
+                    continue
+
+                for invoice, pricing, transition in batch:
+                    if invoice['id'] not in written:
+                        report.add(invoice, SKIPPED, "no longer approved", **pricing)
+                    else:
+                        report.add(invoice, OFFERED if transition == 'offer_funding' else FUNDED,
+                                   **pricing)
+                if verbose:
+                    print(f"Batch {report.batches}: {len(written)} of {len(batch)} invoice(s) written")
+
+        position = {invoice['id']: n for n, invoice in enumerate(invoices)}
+        report.outcomes.sort(key=lambda o: position[o['invoice_id']])
+        report.finish()
+        return report
+
+    def _write_batch(self, db: Database, batch: list, stakeholders: dict, user_id: int) -> set:
+        """Write one batch inside the caller's transaction; returns the ids of the invoices written"""
+        # Another user may have moved an invoice on since it was selected
+        ids = [invoice['id'] for invoice, _, _ in batch]
+        db.cursor.execute(
+            f"SELECT Id FROM Invoices WHERE Id IN ({','.join('?' * len(ids))}) AND Status = ?",
+            (*ids, invoice_states.APPROVED)
+        )
+        still_approved = {row[0] for row in db.cursor.fetchall()}
+        batch = [entry for entry in batch if entry[0]['id'] in still_approved]
+        if not batch:
+            return set()
+
+        timestamp = format_timestamp()
+        today = format_date()
+        reference_time = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+        # Invoice status and funding details: the state machine's conditional UPDATE,
+        # one executemany per transition since the amounts differ per invoice
+        for name in ('fund', 'offer_funding'):
+            rows = [(invoice['id'], {'FundedAmount': to_minor(pricing['funded_amount']),
+                                     'DiscountRate': str(pricing['final_rate'])})
+                    for invoice, pricing, transition in batch if transition == name]
+            if rows and invoice_states.transition_each(db, name, rows, timestamp) != len(rows):
+                raise RuntimeError("An invoice left Approved while its batch was being written")
+
+        # Credit utilisation through the ledger: one guarded increment per facility, so
+        # a limit used up elsewhere since the snapshot fails the batch instead of overdrawing it
+        failed = credit_ledger.consume_many(db, [
+            (org_id, to_minor(invoice['amount']), invoice['id'])
+            for invoice, _, _ in batch
+            for org_id in (invoice['seller_id'], invoice['buyer_id'])
+        ], user_id)
+        if failed:
+            raise RuntimeError(f"Credit limit exceeded for organization(s) {', '.join(map(str, failed))}")
+
+        # Funding transactions
+        db.cursor.executemany("""
+            INSERT INTO Transactions (Type, FacilityType, OrganizationId, InvoiceId, Description, Amount,
+                                      InterestOrDiscountRate, TransactionDate, MaturityDate, IsPaid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (1, 0, invoice['seller_id'] or 1, invoice['id'],
+             f"Invoice funding - Base rate: {pricing['base_rate']}%, Margin: {pricing['margin']}%, "
+             f"Final rate: {pricing['final_rate']}%, Discount: ${pricing['discount_amount']:,.2f}",
+             to_minor(pricing['funded_amount']), str(pricing['final_rate']), timestamp,
+             invoice['due_date'] or today, 0)
+            for invoice, pricing, _ in batch
+        ])
+
+        # Journal entries: ids are allocated up front (the write lock is held) so
+        # headers and lines can both go in with executemany
+        entries, lines = [], []
+        entry_id = db.next_id('JournalEntries')
+        for invoice, pricing, _ in batch:
+            parties = stakeholders.get(invoice['id'], {})
+            seller_org_id = parties.get('seller_org_id', invoice['seller_id'])
+            funded_minor = to_minor(pricing['funded_amount'])
+            discount_minor = to_minor(pricing['discount_amount'])
+
+            # FUNDING - Dr: Loans to Customers (1300)    Cr: Cash (1100)
+            description = f"Invoice funding advance - {invoice['number']}"
+            entries.append((entry_id, f"FUNDING-{reference_time}", timestamp, description, 1, invoice['id'], 1, timestamp, user_id))
+            lines.append((entry_id, 3, funded_minor, 0, f"Loan advance for invoice funding - {description}", seller_org_id))
+            lines.append((entry_id, 1, 0, funded_minor, f"Cash disbursement for invoice funding - {description}", seller_org_id))
+            entry_id += 1
+
+            # INTEREST_INCOME - Dr: Accounts Receivable (1200)    Cr: Interest Income (4100)
+            if pricing['discount_amount'] > 0:
+                description = f"Discount income from invoice {invoice['number']}"
+                entries.append((entry_id, f"INTEREST_INCOME-{reference_time}", timestamp, description, 1, invoice['id'], 1, timestamp, user_id))
+                lines.append((entry_id, 2, discount_minor, 0, f"Interest income accrued - {description}", seller_org_id))
+                lines.append((entry_id, 13, 0, discount_minor, f"Interest income accrued - {description}", seller_org_id))
+                entry_id += 1
+
+            # SELLER_PAYMENT - memo; the cash already left in FUNDING
+            description = f"Payment to seller for invoice {invoice['number']}"
+            entries.append((entry_id, f"SELLER_PAYMENT-{reference_time}", timestamp, description, 1, invoice['id'], 1, timestamp, user_id))
+            lines.append((entry_id, 1, 0, 0, f"Memo: Seller payment processed - {description}", seller_org_id))
+            entry_id += 1
+
+        db.cursor.executemany("""
+            INSERT INTO JournalEntries (Id, TransactionReference, TransactionDate, Description,
+                                        OrganizationId, InvoiceId, Status, PostedDate, PostedByUserId)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, entries)
+        db.cursor.executemany("""
+            INSERT INTO JournalEntryLines (JournalEntryId, AccountId, DebitAmount, CreditAmount, Description, OrganizationId)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, lines)
+
+        # Notifications
+        notifications = []
+        for invoice, pricing, transition in batch:
+            parties = stakeholders.get(invoice['id'], {})
+            seller_user_id = parties.get('seller_user_id')
+            buyer_user_id = parties.get('buyer_user_id')
+            funded_amount = pricing['funded_amount']
+            final_rate = pricing['final_rate']
+            if seller_user_id:
+                if transition == 'offer_funding':
+                    notifications.append((seller_user_id, "Early Payment Opportunity",
+                        f"Early payment opportunity: Invoice #{invoice['number']} from {invoice['buyer_name'] or 'Unknown'} "
+                        f"has been approved for funding at a discount rate of {final_rate:.2f}%. If you accept, you will "
+                        f"receive ${funded_amount:,.2f} now instead of ${invoice['amount']:,.2f} at maturity.",
+                        timestamp, 0, "Action", invoice['id'], 1, 0))
+                else:
+                    notifications.append((seller_user_id, "Invoice Funded",
+                        f"Invoice #{invoice['number']} has been funded successfully. "
+                        f"${funded_amount:,.2f} has been credited to your account.",
+                        timestamp, 0, "Success", invoice['id'], 0, 0))
+                notifications.append((seller_user_id, "Invoice Update",
+                    f"Funding completed! ${funded_amount:,.2f} has been credited to your account for invoice "
+                    f"{invoice['number']}. Discount rate: {final_rate:.2f}%",
+                    timestamp, 0, "Info", invoice['id'], 0, 0))
+            if buyer_user_id:
+                notifications.append((buyer_user_id, "Invoice Update",
+                    f"Invoice {invoice['number']} has been funded. You will need to pay ${invoice['amount']:,.2f} "
+                    f"at maturity. Due date: {invoice['due_date'] or 'TBD'}",
+                    timestamp, 0, "Info", invoice['id'], 0, 0))
+
+        db.cursor.executemany("""
+            INSERT INTO Notifications (UserId, Title, Message, CreatedDate, IsRead, Type, InvoiceId, RequiresAction, ActionTaken)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, notifications)
+
+        return {invoice['id'] for invoice, _, _ in batch}
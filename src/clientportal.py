@@ -5,13 +5,18 @@ Python implementation of the client portal system
 import os
 import sys
 from datetime import datetime
+from types import SimpleNamespace
 from typing import Optional, List, Dict, Any
 
 # Add the parent directory to the path to import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import auth_service
-from database import Database
+from database import Database, to_minor, from_minor, format_date
+from invoice_ingest import ingest_invoices, find_duplicate_invoice
+import invoice_states
+from exposure_index import get_exposure_index, facility_type_name
+from transaction_service import TransactionService, StatementCache
 
 
 class ClientPortal:
@@ -19,6 +24,8 @@ class ClientPortal:
     
     def __init__(self):
         self.database = Database()
+        self.exposure = get_exposure_index()
+        self.statement_cache = StatementCache()
         self.current_user = None
         self.current_organization = None
     
@@ -107,6 +114,9 @@ class ClientPortal:
             if self.current_organization.get('is_buyer', False):
                 print("6. Make Payment")
             
+            if self.current_organization.get('is_seller', False) or self.current_organization.get('is_buyer', False):
+                print("7. Bulk Upload Invoices (CSV/JSONL file)")
+            
             print("0. Logout")
             
             choice = input("\nSelect an option: ").strip()
@@ -131,6 +141,11 @@ class ClientPortal:
                     self.make_payment()
                 else:
                     print("\nInvalid option. Please try again.")
+            elif choice == "7":
+                if self.current_organization.get('is_seller', False) or self.current_organization.get('is_buyer', False):
+                    self.bulk_upload_invoices()
+                else:
+                    print("\nInvalid option. Please try again.")
             elif choice == "0":
                 exit_menu = True
             else:
@@ -149,22 +164,29 @@ class ClientPortal:
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
             
-            # Status: 0=New, 1=Validated, 2=Approved, 3=Funded, 4=Paid, 5=Rejected, 6=Funding sent for Seller Approval, 7=Pending Seller approval, 8=Seller Approved
+            # Status codes are defined in invoice_states
             values = (
                 invoice_data['invoice_number'],
-                invoice_data['issue_date'].strftime('%d-%m-%Y') if hasattr(invoice_data['issue_date'], 'strftime') else invoice_data['issue_date'],
-                invoice_data['due_date'].strftime('%d-%m-%Y') if hasattr(invoice_data['due_date'], 'strftime') else invoice_data['due_date'],
-                str(invoice_data['amount']),  # Amount stored as TEXT in schema
+                format_date(invoice_data['issue_date']),
+                format_date(invoice_data['due_date']),
+                to_minor(invoice_data['amount']),  # Amount stored as integer cents
                 invoice_data['description'],
                 invoice_data['seller_id'],
                 invoice_data['buyer_id'],
                 invoice_data.get('counterparty_id', None),  # Set counterparty properly
                 'USD',  # Default currency
-                0,  # Status: New
+                invoice_states.NEW,  # Status
                 0,  # BuyerApproved: False
                 1   # SellerAccepted: True (seller uploaded it)
             )
             
+            # Refuse an invoice already on file (seek on the fingerprint index)
+            duplicate_id = find_duplicate_invoice(db, values[5], values[6], values[0], values[3], values[1])
+            if duplicate_id:
+                print(f"Duplicate invoice: {values[0]} was already uploaded for this seller and buyer (invoice #{duplicate_id}).")
+                db.close()
+                return False
+            
             db.cursor.execute(query, values)
             db.connection.commit()
             db.close()
@@ -189,7 +211,7 @@ class ClientPortal:
                 SELECT i.Id, i.InvoiceNumber, i.IssueDate, i.DueDate, i.Amount, 
                        i.Description, i.Status, i.Currency,
                        seller.Name as SellerName, buyer.Name as BuyerName,
-                       i.SellerId, i.BuyerId
+                       i.SellerId, i.BuyerId, i.FundedAmount, i.DiscountRate
                 FROM Invoices i
                 LEFT JOIN Organizations seller ON i.SellerId = seller.Id
                 LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
@@ -202,18 +224,6 @@ class ClientPortal:
             db.close()
             
             invoices = []
-            status_map = {
-                0: 'New',
-                1: 'Validated', 
-                2: 'Approved', 
-                3: 'Funded',
-                4: 'Paid', 
-                5: 'Rejected',
-                6: 'Matured',
-                7: 'Funding Sent for Seller Approval',
-                8: 'Pending Seller Approval',
-                9: 'Seller Approved'
-            }
             
             for row in results:
                 invoice = {
@@ -221,14 +231,17 @@ class ClientPortal:
                     'number': row[1],
                     'issue_date': row[2],
                     'due_date': row[3],
-                    'amount': float(row[4]) if row[4] else 0.0,
+                    'amount': from_minor(row[4]),
                     'description': row[5],
-                    'status': status_map.get(row[6], 'Unknown'),
+                    'status': invoice_states.status_name(row[6]),
+                    'status_code': row[6],
                     'currency': row[7],
                     'seller_name': row[8],
                     'buyer_name': row[9],
                     'seller_id': row[10],
-                    'buyer_id': row[11]
+                    'buyer_id': row[11],
+                    'funded_amount': from_minor(row[12]) if row[12] is not None else None,
+                    'discount_rate': row[13]
                 }
                 invoices.append(invoice)
             
@@ -461,6 +474,39 @@ class ClientPortal:
         
         input("\nPress Enter to continue...")
     
+    def bulk_upload_invoices(self):
+        """Upload many invoices from a CSV or JSON Lines file"""
+        self.clear_screen()
+        as_seller = self.current_organization.get('is_seller', False)
+        counterparty = "buyer" if as_seller else "seller"
+        print(f"BULK UPLOAD INVOICES (AS {'SELLER' if as_seller else 'BUYER'})")
+        print("========================================\n")
+        print("Accepted formats: .csv with a header row, or .jsonl with one invoice per line")
+        print(f"Fields: invoice_number, {counterparty} (organization name), amount, issue_date, due_date, description")
+        print("Dates: DD-MM-YYYY or YYYY-MM-DD\n")
+        
+        path = input("File path: ").strip().strip('"')
+        if not path:
+            return
+        if not os.path.isfile(path):
+            print(f"File not found: {path}")
+            input("\nPress Enter to continue...")
+            return
+        
+        rejects_path = f"{os.path.splitext(path)[0]}.rejects.csv"
+        try:
+            report = ingest_invoices(path, self.current_organization['id'], as_seller=as_seller,
+                                     rejects_path=rejects_path)
+            report.print_summary()
+            if report.rejected:
+                print(f"\nAll rejected rows were written to {rejects_path}")
+            elif os.path.exists(rejects_path):
+                os.remove(rejects_path)
+        except Exception as e:
+            print(f"Error during bulk upload: {e}")
+        
+        input("\nPress Enter to continue...")
+    
     def view_invoices(self):
         """View invoices for current organization"""
         self.clear_screen()
@@ -533,9 +579,9 @@ class ClientPortal:
         
         print()
         
-        # If user is the seller and invoice status is "Pending Seller Approval"
+        # If user is the seller and the bank's early payment offer is waiting for them
         if (invoice['seller_id'] == self.current_organization['id'] and 
-            invoice['status_code'] == 6):  # Pending Seller Approval
+            invoice_states.can_transition('seller_accept', invoice['status_code'])):
             
             print("This invoice has a pending early payment offer from the bank.")
             print(f"You can receive ${invoice['funded_amount']:,.2f} now instead of ${invoice['amount']:,.2f} on {invoice['due_date']}.")
@@ -555,15 +601,15 @@ class ClientPortal:
         try:
             db = Database()
             
-            # Update invoice status to "Seller Approved" (7)
-            db.cursor.execute("""
-                UPDATE Invoices 
-                SET Status = 7 
-                WHERE Id = ?
-            """, (invoice['id'],))
-            
+            # Offer -> Seller Approved (only while the offer is still open)
+            moved = invoice_states.transition(db, 'seller_accept', [invoice['id']])
             db.connection.commit()
             
+            if not moved:
+                print("This offer is no longer open.")
+                db.close()
+                return False
+            
             # Send notification to bank
             # In a real system, this would also notify the bank that the seller approved
             
@@ -585,16 +631,15 @@ class ClientPortal:
         try:
             db = Database()
             
-            # In a real system, we would set a different status for rejected offers
-            # For now, we'll just reset it to "Approved" (3) status
-            db.cursor.execute("""
-                UPDATE Invoices 
-                SET Status = 3
-                WHERE Id = ?
-            """, (invoice['id'],))
-            
+            # Offer -> back to Approved, clearing the offered terms
+            moved = invoice_states.transition(db, 'seller_decline', [invoice['id']])
             db.connection.commit()
             
+            if not moved:
+                print("This offer is no longer open.")
+                db.close()
+                return False
+            
             # Send notification to bank
             # In a real system, this would also notify the bank that the seller rejected
             
@@ -622,17 +667,8 @@ class ClientPortal:
                 input("\nPress Enter to continue...")
                 return
             
-            db = Database()
-            
-            # Get credit facilities for current organization
-            query = """
-                SELECT f.Type, f.TotalLimit, f.CurrentUtilization 
-                FROM Facilities f 
-                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
-                WHERE cl.OrganizationId = ?
-            """
-            db.cursor.execute(query, (org_id,))
-            facilities = db.cursor.fetchall()
+            # Credit facilities of the current organization, from the exposure index
+            facilities = self.exposure.facilities(org_id)
             
             print(f"Organization: {org_name}")
             print()
@@ -647,9 +683,9 @@ class ClientPortal:
                 print("-" * 85)
                 
                 for facility in facilities:
-                    facility_type = "Invoice Finance" if facility[0] == 0 else f"Type {facility[0]}"
-                    limit_amount = float(facility[1]) if facility[1] else 0.0
-                    utilized_amount = float(facility[2]) if facility[2] else 0.0
+                    facility_type = facility_type_name(facility['type'])
+                    limit_amount = from_minor(facility['limit'])
+                    utilized_amount = from_minor(facility['utilised'])
                     available_amount = limit_amount - utilized_amount
                     utilization_pct = (utilized_amount / limit_amount * 100) if limit_amount > 0 else 0
                     
@@ -664,8 +700,6 @@ class ClientPortal:
                     total_utilization_pct = (total_utilized / total_limit * 100) if total_limit > 0 else 0
                     print(f"{'TOTAL':<20} ${total_limit:<14,.0f} ${total_utilized:<14,.0f} ${total_available:<14,.0f} {total_utilization_pct:<11.1f}%")
             
-            db.close()
-            
         except Exception as e:
             print(f"Error fetching credit limits: {e}")
         
@@ -674,18 +708,22 @@ class ClientPortal:
     def view_account_statement(self):
         """View account statement"""
         self.clear_screen()
-        print("ACCOUNT STATEMENT")
-        print("=================\n")
         
         try:
-            print("Recent Transactions:")
-            print("Date       | Type     | Description      | Amount    | Balance")
-            print("-" * 65)
-            print("2024-01-15 | Credit   | Invoice Payment  | +$5,000   | $15,000")
-            print("2024-01-10 | Debit    | Service Fee      | -$25      | $10,000")
-            print("2024-01-05 | Credit   | Invoice Payment  | +$3,500   | $10,025")
-            print("-" * 65)
-            print("Current Balance: $15,000.00")
+            org_id = self.current_organization.get('id')
+            if not org_id:
+                print("No organization linked to this user.")
+            else:
+                # Month to date; ending the period with the day keeps repeat views in the statement cache
+                end_date = datetime.now().replace(hour=23, minute=59, second=59, microsecond=0)
+                start_date = end_date.replace(day=1, hour=0, minute=0, second=0)
+                service = TransactionService(statement_cache=self.statement_cache)
+                try:
+                    statement = service.generate_account_statement(org_id, start_date, end_date)
+                    statement.organization = SimpleNamespace(name=self.current_organization['name'])
+                    print(service.generate_statement_report(statement))
+                finally:
+                    service.db.close()
             
         except Exception as e:
             print(f"Error fetching account statement: {e}")
@@ -806,22 +844,29 @@ class ClientPortal:
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
             
-            # Status: 0=Pending, 1=Approved, 2=Funded, 3=Paid, 4=Rejected
+            # Status codes are defined in invoice_states
             values = (
                 invoice_data['invoice_number'],
-                invoice_data['issue_date'],
-                invoice_data['due_date'],
-                str(invoice_data['amount']),  # Amount stored as TEXT in schema
+                format_date(invoice_data['issue_date']),
+                format_date(invoice_data['due_date']),
+                to_minor(invoice_data['amount']),  # Amount stored as integer cents
                 invoice_data['description'],
                 invoice_data['seller_id'],
                 invoice_data.get('buyer_id', None),  # Optional buyer ID
                 invoice_data.get('counterparty_id', None),  # Optional counterparty ID
                 'USD',  # Default currency
-                0,  # Status: Pending
+                invoice_states.NEW,  # Status
                 0,  # BuyerApproved: False
                 1   # SellerAccepted: True (seller uploaded it)
             )
             
+            # Refuse an invoice already on file (seek on the fingerprint index)
+            duplicate_id = find_duplicate_invoice(db, values[5], values[6], values[0], values[3], values[1])
+            if duplicate_id:
+                print(f"Duplicate invoice: {values[0]} was already uploaded for this seller and buyer (invoice #{duplicate_id}).")
+                db.close()
+                return False
+            
             db.cursor.execute(query, values)
             db.connection.commit()
             db.close()
@@ -846,7 +891,7 @@ class ClientPortal:
                 SELECT i.Id, i.InvoiceNumber, i.IssueDate, i.DueDate, i.Amount, 
                        i.Description, i.Status, i.Currency,
                        seller.Name as SellerName, buyer.Name as BuyerName,
-                       i.SellerId, i.BuyerId
+                       i.SellerId, i.BuyerId, i.FundedAmount, i.DiscountRate
                 FROM Invoices i
                 LEFT JOIN Organizations seller ON i.SellerId = seller.Id
                 LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
@@ -859,18 +904,6 @@ class ClientPortal:
             db.close()
             
             invoices = []
-            status_map = {
-                0: 'New',
-                1: 'Validated', 
-                2: 'Approved', 
-                3: 'Funded',
-                4: 'Paid', 
-                5: 'Rejected',
-                6: 'Matured',
-                7: 'Funding Sent for Seller Approval',
-                8: 'Pending Seller Approval',
-                9: 'Seller Approved'
-            }
             
             for row in results:
                 invoice = {
@@ -878,14 +911,17 @@ class ClientPortal:
                     'number': row[1],
                     'issue_date': row[2],
                     'due_date': row[3],
-                    'amount': float(row[4]) if row[4] else 0.0,
+                    'amount': from_minor(row[4]),
                     'description': row[5],
-                    'status': status_map.get(row[6], 'Unknown'),
+                    'status': invoice_states.status_name(row[6]),
+                    'status_code': row[6],
                     'currency': row[7],
                     'seller_name': row[8],
                     'buyer_name': row[9],
                     'seller_id': row[10],
-                    'buyer_id': row[11]
+                    'buyer_id': row[11],
+                    'funded_amount': from_minor(row[12]) if row[12] is not None else None,
+                    'discount_rate': row[13]
                 }
                 invoices.append(invoice)
             
@@ -0,0 +1,223 @@
+"""
+Credit utilisation ledger for the Supply Chain Finance Management System
+
+Every change to a facility's utilisation is one conditional UPDATE of the
+Facilities row plus an append-only UtilizationLedger row, in one transaction.
+The limit is enforced inside the UPDATE's WHERE clause, so two bank users
+funding against the same organization at once cannot both pass a check and
+overshoot it: SQLite serialises the writes and the second UPDATE simply
+matches nothing.
+
+Facilities.CurrentUtilization holds funded exposure and Facilities.ReservedAmount
+headroom held for funding that is not final yet; both are the running totals of
+the ledger's UtilizationDelta / ReservedDelta columns (see verify_ledger). As
+everywhere else, an organization's first facility is the one used.
+
+Amounts are integer minor units (cents) and must be positive; the functions
+raise ValueError otherwise.
+"""
+
+if __package__:
+    from .database import format_timestamp
+else:
+    from database import format_timestamp
+
+
+# UtilizationLedger.Kind
+OPENING = 'opening'    # Utilisation carried over when the ledger was introduced
+RESERVE = 'reserve'    # Hold headroom
+RELEASE = 'release'    # Give a hold back
+CONSUME = 'consume'    # Funding drawn (from a hold or directly)
+REPAY = 'repay'        # Funding repaid
+
+INSERT_LEDGER_SQL = """
+    INSERT INTO UtilizationLedger (FacilityId, OrganizationId, InvoiceId, Kind,
+                                   UtilizationDelta, ReservedDelta, CreatedDate, UserId)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def facility_for(db, organization_id: int):
+    """Id of the organization's facility, or None"""
+    db.cursor.execute("""
+        SELECT f.Id
+        FROM Facilities f
+        JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
+        WHERE cl.OrganizationId = ?
+        ORDER BY f.Id
+        LIMIT 1
+    """, (organization_id,))
+    row = db.cursor.fetchone()
+    return row[0] if row else None
+
+
+def facility_position(db, organization_id: int):
+    """(facility_id, limit, utilised, reserved) of the organization's facility, or None"""
+    db.cursor.execute("""
+        SELECT f.Id, f.TotalLimit, f.CurrentUtilization, f.ReservedAmount
+        FROM Facilities f
+        JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
+        WHERE cl.OrganizationId = ?
+        ORDER BY f.Id
+        LIMIT 1
+    """, (organization_id,))
+    row = db.cursor.fetchone()
+    if not row:
+        return None
+    return row[0], row[1] or 0, row[2] or 0, row[3] or 0
+
+
+def available(db, organization_id: int):
+    """Headroom (limit - utilised - reserved) of the organization's facility, or None without one"""
+    position = facility_position(db, organization_id)
+    if position is None:
+        return None
+    _, limit_minor, utilised_minor, reserved_minor = position
+    return limit_minor - utilised_minor - reserved_minor
+
+
+def _check_amount(amount_minor: int):
+    # The kind gives the direction; a negative amount would move the other way unchecked
+    if amount_minor is None or amount_minor <= 0:
+        raise ValueError(f"Credit ledger amounts must be positive, got {amount_minor}")
+
+
+def _apply(db, organization_id: int, kind: str, update_sql: str, update_params: tuple,
+           utilization_delta: int, reserved_delta: int, invoice_id: int, user_id: int) -> bool:
+    """Run one guarded Facilities UPDATE and, if it matched, append the ledger row"""
+    facility_id = facility_for(db, organization_id)
+    if facility_id is None:
+        return False
+    with db.transaction():
+        db.cursor.execute(update_sql, (*update_params, facility_id))
+        if db.cursor.rowcount != 1:
+            return False
+        db.cursor.execute(INSERT_LEDGER_SQL, (
+            facility_id, organization_id, invoice_id, kind,
+            utilization_delta, reserved_delta, format_timestamp(), user_id
+        ))
+    return True
+
+
+def reserve(db, organization_id: int, amount_minor: int, invoice_id: int = None, user_id: int = None) -> bool:
+    """Hold headroom; False if the organization has no facility or not enough headroom"""
+    _check_amount(amount_minor)
+    return _apply(db, organization_id, RESERVE, """
+        UPDATE Facilities SET ReservedAmount = ReservedAmount + ?
+        WHERE CurrentUtilization + ReservedAmount + ? <= TotalLimit AND Id = ?
+    """, (amount_minor, amount_minor), 0, amount_minor, invoice_id, user_id)
+
+
+def release(db, organization_id: int, amount_minor: int, invoice_id: int = None, user_id: int = None) -> bool:
+    """Give back a hold; False if less than amount_minor is reserved"""
+    _check_amount(amount_minor)
+    return _apply(db, organization_id, RELEASE, """
+        UPDATE Facilities SET ReservedAmount = ReservedAmount - ?
+        WHERE ReservedAmount >= ? AND Id = ?
+    """, (amount_minor, amount_minor), 0, -amount_minor, invoice_id, user_id)
+
+
+def consume(db, organization_id: int, amount_minor: int, invoice_id: int = None, user_id: int = None,
+            reserved: bool = False) -> bool:
+    """
+    Draw funding against the facility.
+
+    With reserved=True an earlier reserve() of the same amount is turned into
+    utilisation; otherwise the limit is checked here. False if it does not fit.
+    """
+    _check_amount(amount_minor)
+    if reserved:
+        return _apply(db, organization_id, CONSUME, """
+            UPDATE Facilities SET ReservedAmount = ReservedAmount - ?, CurrentUtilization = CurrentUtilization + ?
+            WHERE ReservedAmount >= ? AND Id = ?
+        """, (amount_minor, amount_minor, amount_minor), amount_minor, -amount_minor, invoice_id, user_id)
+    return _apply(db, organization_id, CONSUME, """
+        UPDATE Facilities SET CurrentUtilization = CurrentUtilization + ?
+        WHERE CurrentUtilization + ReservedAmount + ? <= TotalLimit AND Id = ?
+    """, (amount_minor, amount_minor), amount_minor, 0, invoice_id, user_id)
+
+
+def repay(db, organization_id: int, amount_minor: int, invoice_id: int = None, user_id: int = None) -> bool:
+    """Reduce utilisation after a repayment (never below zero); False without a facility"""
+    _check_amount(amount_minor)
+    facility_id = facility_for(db, organization_id)
+    if facility_id is None:
+        return False
+    with db.transaction():
+        # Ledger row first, so it records the amount actually released
+        db.cursor.execute("""
+            INSERT INTO UtilizationLedger (FacilityId, OrganizationId, InvoiceId, Kind,
+                                           UtilizationDelta, ReservedDelta, CreatedDate, UserId)
+            SELECT Id, ?, ?, ?, -MIN(?, CurrentUtilization), 0, ?, ?
+            FROM Facilities WHERE Id = ?
+        """, (organization_id, invoice_id, REPAY, amount_minor, format_timestamp(), user_id, facility_id))
+        db.cursor.execute("""
+            UPDATE Facilities SET CurrentUtilization = CurrentUtilization - MIN(?, CurrentUtilization)
+            WHERE Id = ?
+        """, (amount_minor, facility_id))
+    return True
+
+
+def consume_many(db, draws, user_id: int = None) -> list:
+    """
+    Draw funding for many invoices: draws is [(organization_id, amount_minor, invoice_id)].
+
+    One guarded UPDATE per facility for the summed amount and one executemany
+    of ledger rows. Returns the organization ids that had no facility or not
+    enough headroom; nothing is written unless that list is empty.
+    """
+    draws = list(draws)
+    totals = {}
+    for organization_id, amount_minor, _ in draws:
+        _check_amount(amount_minor)
+        totals[organization_id] = totals.get(organization_id, 0) + amount_minor
+
+    facilities = {organization_id: facility_for(db, organization_id) for organization_id in totals}
+    failed = [organization_id for organization_id, facility_id in facilities.items() if facility_id is None]
+    if failed:
+        return failed
+
+    try:
+        with db.transaction():
+            for organization_id, amount_minor in totals.items():
+                db.cursor.execute("""
+                    UPDATE Facilities SET CurrentUtilization = CurrentUtilization + ?
+                    WHERE CurrentUtilization + ReservedAmount + ? <= TotalLimit AND Id = ?
+                """, (amount_minor, amount_minor, facilities[organization_id]))
+                if db.cursor.rowcount != 1:
+                    failed.append(organization_id)
+            if failed:
+                raise _Rollback()
+            timestamp = format_timestamp()
+            db.cursor.executemany(INSERT_LEDGER_SQL, [
+                (facilities[organization_id], organization_id, invoice_id, CONSUME, amount_minor, 0, timestamp, user_id)
+                for organization_id, amount_minor, invoice_id in draws
+            ])
+    except _Rollback:
+        pass
+    return failed
+
+
+class _Rollback(Exception):
+    """Undo consume_many's savepoint without surfacing an error"""
+
+
+def verify_ledger(db) -> list:
+    """
+    Compare each facility with the running totals of its ledger rows.
+
+    Returns [(facility_id, utilised, ledger_utilised, reserved, ledger_reserved)]
+    for the facilities that disagree; empty when everything balances.
+    """
+    db.cursor.execute("""
+        SELECT f.Id, f.CurrentUtilization, COALESCE(l.Utilised, 0), f.ReservedAmount, COALESCE(l.Reserved, 0)
+        FROM Facilities f
+        LEFT JOIN (
+            SELECT FacilityId, SUM(UtilizationDelta) AS Utilised, SUM(ReservedDelta) AS Reserved
+            FROM UtilizationLedger
+            GROUP BY FacilityId
+        ) l ON l.FacilityId = f.Id
+        WHERE f.CurrentUtilization != COALESCE(l.Utilised, 0) OR f.ReservedAmount != COALESCE(l.Reserved, 0)
+        ORDER BY f.Id
+    """)
+    return db.cursor.fetchall()
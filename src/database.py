@@ -1,5 +1,13 @@
 import sqlite3
 import datetime
+import os
+import threading
+import time
+import atexit
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from pathlib import Path
 
 # Define adapter for datetime objects to fix the deprecation warning
 def adapt_datetime(dt):
@@ -18,42 +26,516 @@ def convert_datetime(s):
 sqlite3.register_adapter(datetime.datetime, adapt_datetime)
 sqlite3.register_converter("datetime", convert_datetime)
 
+# Money columns are stored as INTEGER minor units (cents) from schema version 1 on
+MINOR_UNITS_PER_UNIT = 100
+
+
+def to_minor(amount):
+    """Convert a money amount (float, int, Decimal or numeric text) to integer minor units"""
+    if amount is None or amount == '':
+        return None
+    return int((Decimal(str(amount)) * MINOR_UNITS_PER_UNIT).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_minor(value) -> float:
+    """Convert integer minor units read from the database to an amount (NULL reads as 0.0)"""
+    if value is None or value == '':
+        return 0.0
+    return int(value) / MINOR_UNITS_PER_UNIT
+
+
+# Dates are stored as ISO-8601 text from schema version 2 on, so they sort and
+# range-scan correctly: calendar dates as YYYY-MM-DD, timestamps as YYYY-MM-DD HH:MM:SS
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Formats written by older versions of the portals; only tried when ISO parsing fails
+LEGACY_DATE_FORMATS = ('%d-%m-%Y %H:%M:%S', '%d-%m-%Y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y')
+
+
+def parse_date(value):
+    """
+    Parse a stored or user-entered date into a datetime.
+
+    Accepts datetime/date objects, ISO-8601 text (including .NET-style 7-digit
+    fractions) and the legacy DD-MM-YYYY formats. Returns None for NULL/empty.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    text = value.decode('utf-8') if isinstance(value, bytes) else str(value).strip()
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    # Plain DD-MM-YYYY is what users type; avoid strptime for it (bulk uploads parse millions)
+    if len(text) == 10 and text[2] == text[5] and text[2] in '-/' and text[:2].isdigit() \
+            and text[3:5].isdigit() and text[6:].isdigit():
+        return datetime.datetime(int(text[6:]), int(text[3:5]), int(text[:2]))
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {value!r}")
+
+
+def format_date(value=None):
+    """Format a date as stored in calendar-date columns (YYYY-MM-DD); defaults to today"""
+    if value is None:
+        return datetime.date.today().isoformat()
+    parsed = parse_date(value)
+    # isoformat() zero-pads the year, strftime('%Y') does not on every platform
+    return parsed.date().isoformat() if parsed else None
+
+
+def format_timestamp(value=None):
+    """Format a timestamp as stored in timestamp columns (YYYY-MM-DD HH:MM:SS); defaults to now"""
+    if value is None:
+        return datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+    parsed = parse_date(value)
+    return parsed.replace(microsecond=0, tzinfo=None).isoformat(sep=' ') if parsed else None
+
+
+# Connection pool settings. Defaults can be overridden with environment variables
+# or at runtime with configure_pool().
+POOL_SETTINGS = {
+    'max_size': int(os.environ.get('SCF_DB_POOL_SIZE', '8')),                          # Connections per database file
+    'idle_timeout': float(os.environ.get('SCF_DB_POOL_IDLE_TIMEOUT', '300')),          # Seconds before an idle connection is closed
+    'health_check_interval': float(os.environ.get('SCF_DB_POOL_HEALTH_CHECK', '30')),  # Seconds between liveness checks
+    'acquire_timeout': float(os.environ.get('SCF_DB_POOL_ACQUIRE_TIMEOUT', '30')),     # Seconds to wait for a free connection
+}
+
+# Apply pending schema migrations (see migrations.py) the first time a process opens a database file
+AUTO_MIGRATE = os.environ.get('SCF_DB_AUTO_MIGRATE', '1') != '0'
+
+# SQLite storage profiles, applied as PRAGMAs whenever a pooled connection opens.
+# "oltp" lets the bank and client portals read while the other one writes;
+# "bulk_load" trades durability of the last few commits for insert throughput.
+STORAGE_PROFILES = {
+    'oltp': {
+        'journal_mode': 'WAL',       # Readers no longer block behind writers
+        'synchronous': 'NORMAL',     # Safe with WAL, one fsync per checkpoint instead of per commit
+        'cache_size': -16000,        # Negative values are KiB (about 16 MB)
+        'mmap_size': 134217728,      # 128 MB memory-mapped reads
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,        # Milliseconds to wait on a lock before "database is locked"
+    },
+    'bulk_load': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,       # About 256 MB
+        'mmap_size': 268435456,      # 256 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+}
+
+# Active profile and per-PRAGMA overrides (SCF_DB_PROFILE or configure_storage())
+STORAGE_SETTINGS = {
+    'profile': os.environ.get('SCF_DB_PROFILE', 'oltp'),
+    'overrides': {},
+}
+
+# Applied in this order; journal_mode goes first because it needs an idle connection
+_PRAGMA_ORDER = ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+
+
+def configure_storage(profile: str = None, **overrides):
+    """
+    Select the storage profile and optionally override individual PRAGMAs.
+
+    Applies to connections opened afterwards; use Database.storage_profile()
+    to switch an open connection temporarily.
+    """
+    if profile is not None:
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        STORAGE_SETTINGS['profile'] = profile
+    unknown = set(overrides) - set(_PRAGMA_ORDER)
+    if unknown:
+        raise ValueError(f"Unknown storage settings: {', '.join(sorted(unknown))}")
+    STORAGE_SETTINGS['overrides'].update(overrides)
+
+
+def storage_pragmas(profile: str = None) -> dict:
+    """Return the PRAGMA values for a profile (default: the configured one) with overrides applied"""
+    name = profile or STORAGE_SETTINGS['profile']
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {name}")
+    pragmas = dict(STORAGE_PROFILES[name])
+    pragmas.update(STORAGE_SETTINGS['overrides'])
+    return pragmas
+
+
+def apply_storage_profile(connection: sqlite3.Connection, profile: str = None, include_journal_mode: bool = True):
+    """Apply a storage profile's PRAGMAs to a connection"""
+    pragmas = storage_pragmas(profile)
+    for name in _PRAGMA_ORDER:
+        if name not in pragmas or (name == 'journal_mode' and not include_journal_mode):
+            continue
+        try:
+            connection.execute(f"PRAGMA {name} = {pragmas[name]}")
+        except sqlite3.OperationalError as e:
+            # journal_mode cannot change while another connection holds a lock;
+            # WAL is persistent, so a later connection will pick it up
+            if name != 'journal_mode':
+                raise
+            print(f"Warning: could not set journal_mode={pragmas[name]}: {e}")
+
+
+class PooledConnection:
+    """A pooled SQLite connection and its bookkeeping"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        now = time.monotonic()
+        self.connection = connection
+        self.created = now
+        self.last_used = now
+        self.last_checked = now
+        self.leases = 0      # Number of open Database objects sharing this connection
+        self.owner = None    # Thread ident currently holding the connection
+        self.tx_depth = 0    # Nesting level of Database.transaction() blocks
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections for one database file.
+
+    A thread that already holds a connection gets the same connection back on
+    every nested acquire, so helpers that each create a Database() reuse one
+    connection instead of opening a new one per call.
+    """
+
+    def __init__(self, db_path: str, max_size: int = 8, idle_timeout: float = 300.0,
+                 health_check_interval: float = 30.0, acquire_timeout: float = 30.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._condition = threading.Condition()
+        self._idle = []       # Idle connections, most recently used last
+        self._held = {}       # Thread ident -> PooledConnection
+        self._open_count = 0
+        self._schema_checked = not AUTO_MIGRATE
+        self._schema_lock = threading.Lock()
+
+    def _connect(self) -> PooledConnection:
+        """Open a new connection to the database file"""
+        connection = sqlite3.connect(
+            self.db_path,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False  # The pool guarantees one thread at a time
+        )
+        try:
+            apply_storage_profile(connection)
+            if not self._schema_checked:
+                self._ensure_schema(connection)
+        except Exception:
+            # e.g. a failing migration: do not leak the handle (the caller gives back the slot)
+            connection.close()
+            raise
+        return PooledConnection(connection)
+
+    def _ensure_schema(self, connection: sqlite3.Connection):
+        """Bring the database file up to the latest schema version once per pool"""
+        with self._schema_lock:
+            if self._schema_checked:
+                return
+            if __package__:
+                from .migrations import migrate
+            else:
+                from migrations import migrate
+            migrate(connection)
+            self._schema_checked = True
+
+    def _close_quietly(self, pooled: PooledConnection):
+        """Close a connection, ignoring errors from an already broken handle"""
+        try:
+            pooled.connection.close()
+        except sqlite3.Error:
+            pass
+
+    def _is_healthy(self, pooled: PooledConnection) -> bool:
+        """Run a liveness check on a connection that has not been checked recently"""
+        now = time.monotonic()
+        if now - pooled.last_checked < self.health_check_interval:
+            return True
+        try:
+            pooled.connection.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        pooled.last_checked = now
+        return True
+
+    def _evict_idle(self, now: float) -> list:
+        """Remove connections idle past the timeout (caller holds the lock)"""
+        expired = [p for p in self._idle if now - p.last_used > self.idle_timeout]
+        if expired:
+            self._idle = [p for p in self._idle if now - p.last_used <= self.idle_timeout]
+            self._open_count -= len(expired)
+            self._condition.notify_all()
+        return expired
+
+    def acquire(self) -> PooledConnection:
+        """Hand out the calling thread's connection, reusing or opening one as needed"""
+        thread_id = threading.get_ident()
+
+        with self._condition:
+            held = self._held.get(thread_id)
+            if held is not None:
+                held.leases += 1
+                return held
+
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            pooled = None
+            with self._condition:
+                while True:
+                    expired = self._evict_idle(time.monotonic())
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if self._open_count < self.max_size:
+                        self._open_count += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError(
+                            f"Connection pool exhausted for {self.db_path} "
+                            f"({self.max_size} connections in use)"
+                        )
+                    self._condition.wait(remaining)
+
+            for stale in expired:
+                self._close_quietly(stale)
+
+            if pooled is None:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._open_count -= 1
+                        self._condition.notify()
+                    raise
+            elif not self._is_healthy(pooled):
+                self._close_quietly(pooled)
+                with self._condition:
+                    self._open_count -= 1
+                    self._condition.notify()
+                continue
+
+            with self._condition:
+                pooled.leases = 1
+                pooled.owner = thread_id
+                self._held[thread_id] = pooled
+            return pooled
+
+    def release(self, pooled: PooledConnection):
+        """Give back one lease; the connection returns to the pool when the last lease ends"""
+        with self._condition:
+            pooled.leases -= 1
+            if pooled.leases > 0:
+                return
+            if self._held.get(pooled.owner) is pooled:
+                del self._held[pooled.owner]
+            pooled.owner = None
+
+        # Anything still uncommitted belongs to nobody now, so discard it
+        try:
+            if pooled.connection.in_transaction:
+                pooled.connection.rollback()
+        except sqlite3.Error:
+            self._close_quietly(pooled)
+            with self._condition:
+                self._open_count -= 1
+                self._condition.notify()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._condition:
+            self._idle.append(pooled)
+            expired = self._evict_idle(pooled.last_used)
+            self._condition.notify()
+        for stale in expired:
+            self._close_quietly(stale)
+
+    def close_idle(self):
+        """Close every idle connection (connections in use are left alone)"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open_count -= len(idle)
+            self._condition.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self) -> dict:
+        """Return current pool usage counters"""
+        with self._condition:
+            return {
+                'db_path': self.db_path,
+                'open': self._open_count,
+                'idle': len(self._idle),
+                'in_use': len(self._held),
+                'max_size': self.max_size
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def configure_pool(**settings):
+    """
+    Change pool settings (max_size, idle_timeout, health_check_interval, acquire_timeout).
+
+    New settings apply to pools created afterwards and are pushed to existing pools.
+    """
+    unknown = set(settings) - set(POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown pool settings: {', '.join(sorted(unknown))}")
+    POOL_SETTINGS.update(settings)
+    with _pools_lock:
+        for pool in _pools.values():
+            for name, value in settings.items():
+                setattr(pool, name, value)
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Return the shared pool for a database file, creating it on first use"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path, **POOL_SETTINGS)
+                _pools[db_path] = pool
+    return pool
+
+
+def close_all_pools():
+    """Close idle connections in every pool (called automatically at exit)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_idle()
+
+
+atexit.register(close_all_pools)
+
+
+@lru_cache(maxsize=None)
+def resolve_db_path(db_name: str) -> str:
+    """Resolve a database name against the src directory (cached per name)"""
+    # Get the src directory path
+    src_path = Path(os.path.dirname(os.path.abspath(__file__)))
+
+    # Create the full path to the database
+    db_path = src_path / db_name
+
+    # Ensure database file exists
+    if not db_path.exists():
+        print(f"Warning: Database file not found at {db_path}")
+        print(f"Creating connection anyway, which will create the file if operations are performed.")
+
+    return str(db_path)
+
+
 class Database:
     def __init__(self, db_name="supply_chain_finance.db"):
         """
         Initialize database connection, ensuring we always use the database in the src directory.
-        
+
+        Connections come from a per-file pool; nested Database objects created by the
+        same thread share one connection.
+
         Args:
             db_name: Name of the database file (default: "supply_chain_finance.db")
         """
-        import os
-        from pathlib import Path
-        
-        # Get the src directory path
-        src_path = Path(os.path.dirname(os.path.abspath(__file__)))
-        
-        # Create the full path to the database
-        db_path = src_path / db_name
-        
-        # Ensure database file exists
-        if not db_path.exists():
-            print(f"Warning: Database file not found at {db_path}")
-            print(f"Creating connection anyway, which will create the file if operations are performed.")
-        
-        # Create the connection
-        self.connection = sqlite3.connect(str(db_path), detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+        self._pool = get_pool(resolve_db_path(db_name))
+        self._lease = self._pool.acquire()
+        self.connection = self._lease.connection
         self.cursor = self.connection.cursor()
+        # Remember whether an outer Database already had work pending, so close()
+        # only discards uncommitted changes made through this object
+        self._started_clean = not self.connection.in_transaction
         # Don't create tables - use existing database structure
 
     def close(self):
-        """Close the database connection"""
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-    
+        """Release the connection back to the pool, discarding uncommitted changes"""
+        lease = getattr(self, '_lease', None)
+        if lease is None:
+            return
+        self._lease = None
+        try:
+            if self._started_clean and self.connection.in_transaction and lease.tx_depth == 0:
+                self.connection.rollback()
+            self.cursor.close()
+        except sqlite3.Error:
+            pass
+        finally:
+            self._pool.release(lease)
+
     def commit(self):
-        """Commit changes to the database"""
+        """Commit changes to the database (deferred while a transaction() block is open)"""
+        if self._lease is not None and self._lease.tx_depth > 0:
+            return
         self.connection.commit()
-        
+
+    @property
+    def in_unit_of_work(self) -> bool:
+        """True while a transaction() block is open on this thread's connection"""
+        return self._lease is not None and self._lease.tx_depth > 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block as one unit of work on this thread's connection.
+
+        Every Database() opened by the same thread inside the block shares the
+        connection, and their commit() calls are deferred, so the whole block
+        commits once when it ends or rolls back if it raises. Nested blocks
+        become savepoints.
+
+        Example:
+            with db.transaction():
+                update_invoice_status(...)
+                record_funding(...)
+        """
+        lease = self._lease
+        if lease is None:
+            raise sqlite3.ProgrammingError("Cannot start a transaction on a closed Database")
+
+        if lease.tx_depth == 0:
+            if not self.connection.in_transaction:
+                self.connection.execute("BEGIN IMMEDIATE")
+            lease.tx_depth = 1
+            try:
+                yield self
+            except BaseException:
+                lease.tx_depth = 0
+                self.connection.rollback()
+                raise
+            lease.tx_depth = 0
+            self.connection.commit()
+            return
+
+        savepoint = f"uow_{lease.tx_depth}"
+        self.connection.execute(f"SAVEPOINT {savepoint}")
+        lease.tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            lease.tx_depth -= 1
+            self.connection.execute(f"ROLLBACK TO {savepoint}")
+            self.connection.execute(f"RELEASE {savepoint}")
+            raise
+        lease.tx_depth -= 1
+        self.connection.execute(f"RELEASE {savepoint}")
+
     def execute(self, query, params=None):
         """Execute a query with optional parameters"""
         if params:
@@ -61,32 +543,79 @@ class Database:
         else:
             self.cursor.execute(query)
         return self.cursor
-    
+
     def fetchone(self):
         """Fetch one row from the last query"""
         return self.cursor.fetchone()
-    
+
     def fetchall(self):
         """Fetch all rows from the last query"""
         return self.cursor.fetchall()
-    
+
+    def change_versions(self) -> dict:
+        """
+        Return the ChangeVersions counters (name -> version).
+
+        Triggers bump these whenever the data behind a cache changes, in any
+        process, so caches compare a snapshot instead of re-reading their data.
+        """
+        try:
+            rows = self.connection.execute("SELECT Name, Version FROM ChangeVersions").fetchall()
+        except sqlite3.OperationalError:
+            # Schema older than migration 004
+            return {}
+        return dict(rows)
+
+    def next_id(self, table: str) -> int:
+        """
+        Return the next AUTOINCREMENT id of a table.
+
+        Only stable while this connection holds the write lock (inside
+        transaction()), which lets bulk inserts assign ids up front and insert
+        parent and child rows with executemany.
+        """
+        row = self.connection.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        sequence = row[0] if row else 0
+        highest = self.connection.execute(f'SELECT COALESCE(MAX(Id), 0) FROM "{table}"').fetchone()[0]
+        return max(sequence, highest) + 1
+
+    @contextmanager
+    def storage_profile(self, profile: str):
+        """
+        Temporarily switch this connection to another storage profile, e.g. "bulk_load".
+
+        journal_mode is left as is because it is shared by every connection to the file.
+        """
+        apply_storage_profile(self.connection, profile, include_journal_mode=False)
+        try:
+            yield self
+        finally:
+            apply_storage_profile(self.connection, include_journal_mode=False)
+
     def __enter__(self):
         """Enable context manager pattern with 'with' statement"""
         return self
-    
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Auto-close when exiting context manager"""
         self.close()
 
+    def __del__(self):
+        """Return the connection to the pool if close() was never called"""
+        try:
+            self.close()
+        except Exception:
+            pass
+
 # Example usage
 if __name__ == "__main__":
     db = Database()
     print("Connected to existing database successfully.")
-    
+
     # Example using the context manager pattern
     with Database() as db:
         db.execute("SELECT sqlite_version()")
         version = db.fetchone()[0]
         print(f"SQLite version: {version}")
-    
+
     # The connection is automatically closed after the with block
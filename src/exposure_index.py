@@ -0,0 +1,258 @@
+"""
+In-memory credit exposure index for the Supply Chain Finance Management System
+
+Keeps every credit facility with its organization's master limit in memory,
+keyed by organization and facility type, so limit checks read dicts instead
+of joining Facilities / CreditLimits per call. Each lookup first refreshes
+the index: it reads the ChangeVersions counters and applies any new ledger
+rows, which is two small indexed queries. Inside operation() only the first
+lookup refreshes, and the rest are plain dict reads, so callers that make
+several lookups (the funding list, credit checks for both parties) wrap them
+in one operation().
+
+The index is loaded once per process and kept current incrementally:
+
+- Utilisation and reservations must only change through credit_ledger, which
+  appends a UtilizationLedger row for each change. A refresh applies the
+  ledger rows written since the last one (one grouped query over the new ids).
+  A direct UPDATE of Facilities.CurrentUtilization or ReservedAmount (e.g. a
+  manual correction) is invisible to the index: call invalidate() after it.
+- Inserting or deleting facilities, credit limits or organizations, and
+  updates to the columns in migrations.LIMITS_VERSION_TRIGGERS (facility
+  type and limit, master limits, organization names), bump the 'Limits'
+  ChangeVersions counter (migration 008); when it moves the index is
+  reloaded with a single query.
+
+Figures are advisory: the guarded UPDATEs in credit_ledger still enforce the
+limit when funding is written.
+
+Amounts are integer minor units (cents).
+"""
+
+import threading
+from contextlib import contextmanager
+
+if __package__:
+    from .database import Database, resolve_db_path
+else:
+    from database import Database, resolve_db_path
+
+# ChangeVersions counter bumped by structural changes to limits and facilities
+LIMITS_VERSION = 'Limits'
+
+_LOAD_SQL = """
+    WITH Tail AS (SELECT COALESCE(MAX(Id), 0) AS LedgerId FROM UtilizationLedger)
+    SELECT t.LedgerId, x.*
+    FROM Tail t
+    LEFT JOIN (
+        SELECT f.Id, cl.OrganizationId, o.Name, f.Type, f.TotalLimit, f.CurrentUtilization,
+               f.ReservedAmount, cl.MasterLimit, cl.LastReviewDate
+        FROM Facilities f
+        JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
+        LEFT JOIN Organizations o ON cl.OrganizationId = o.Id
+    ) x ON 1
+"""
+
+# "+FacilityId" keeps the planner on the rowid range instead of walking the FacilityId index
+_TAIL_SQL = """
+    SELECT FacilityId, SUM(UtilizationDelta), SUM(ReservedDelta), MAX(Id)
+    FROM UtilizationLedger
+    WHERE Id > ?
+    GROUP BY +FacilityId
+"""
+
+
+# Facilities.Type (0-based), as grant_facility_to_customer creates them
+FACILITY_TYPE_NAMES = ("Invoice Finance", "Trade Finance", "Working Capital", "Supply Chain Finance")
+
+
+def facility_type_name(facility_type) -> str:
+    if isinstance(facility_type, int) and 0 <= facility_type < len(FACILITY_TYPE_NAMES):
+        return FACILITY_TYPE_NAMES[facility_type]
+    return f"Type {facility_type}"
+
+
+class ExposureIndex:
+    """Process-wide organization -> facilities exposure index"""
+
+    def __init__(self, db_name: str = "supply_chain_finance.db"):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._versions = None    # ChangeVersions snapshot the index was loaded under
+        self._ledger_id = 0      # Last UtilizationLedger row applied
+        self._facilities = {}    # facility_id -> facility dict
+        self._by_org = {}        # org_id -> {'master_limit', 'facilities': [facility_id, ...] ordered by Id}
+        self._local = threading.local()
+
+    @contextmanager
+    def operation(self):
+        """
+        Scope one business operation (e.g. a funding loop).
+
+        The index is refreshed on the first lookup only; later lookups in the
+        block are plain dict reads. Operations may nest.
+        """
+        if getattr(self._local, 'active', False):
+            yield self
+            return
+        self._local.active = True
+        self._local.fresh = False
+        try:
+            yield self
+        finally:
+            self._local.active = False
+            self._local.fresh = False
+
+    def invalidate(self):
+        """Force a full reload on the next lookup"""
+        with self._lock:
+            self._versions = None
+        self._local.fresh = False
+
+    # Lookups
+
+    def facilities(self, organization_id: int, facility_type: int = None) -> list:
+        """The organization's facilities ordered by Id, optionally of one type"""
+        self._refresh()
+        with self._lock:
+            entry = self._by_org.get(organization_id)
+            if entry is None:
+                return []
+            return [self._row(self._facilities[facility_id]) for facility_id in entry['facilities']
+                    if facility_type is None or self._facilities[facility_id]['type'] == facility_type]
+
+    def facility(self, organization_id: int, facility_type: int = None):
+        """The organization's first facility (of facility_type, if given), or None"""
+        facilities = self.facilities(organization_id, facility_type)
+        return facilities[0] if facilities else None
+
+    def available(self, organization_id: int, facility_type: int = None):
+        """Headroom (limit - utilised - reserved) of the first facility, or None without one"""
+        facility = self.facility(organization_id, facility_type)
+        return facility['available'] if facility else None
+
+    def has_facilities(self, organization_id: int) -> bool:
+        self._refresh()
+        with self._lock:
+            return organization_id in self._by_org
+
+    def master_limit(self, organization_id: int):
+        """CreditLimits.MasterLimit of the organization, or None without facilities"""
+        self._refresh()
+        with self._lock:
+            entry = self._by_org.get(organization_id)
+            return entry['master_limit'] if entry else None
+
+    def all_facilities(self) -> list:
+        """Every facility, ordered by organization name and facility type"""
+        self._refresh()
+        with self._lock:
+            rows = [self._row(facility) for facility in self._facilities.values()]
+        rows.sort(key=lambda row: (row['organization_name'] or '', row['type'] or 0, row['facility_id']))
+        return rows
+
+    def utilisation_snapshot(self, org_ids) -> dict:
+        """
+        {org_id: {'facility_id', 'limit', 'used'}} for the first facility of each
+        organization; 'used' counts reservations as well as utilisation.
+        """
+        snapshot = {}
+        with self.operation():
+            for org_id in set(org_ids):
+                facility = self.facility(org_id) if org_id else None
+                if facility is not None:
+                    snapshot[org_id] = {'facility_id': facility['facility_id'], 'limit': facility['limit'],
+                                        'used': facility['utilised'] + facility['reserved']}
+        return snapshot
+
+    @staticmethod
+    def _row(facility: dict) -> dict:
+        row = dict(facility)
+        row['available'] = row['limit'] - row['utilised'] - row['reserved']
+        return row
+
+    # Maintenance
+
+    def _refresh(self):
+        """Bring the index up to date: reload on a structural change, else apply the ledger tail"""
+        if getattr(self._local, 'fresh', False):
+            return
+        with Database(self.db_name) as db:
+            if db.connection.in_transaction and self._versions is not None:
+                # Rows written by an open transaction may still be rolled back;
+                # answer from the last committed view
+                return
+            versions = db.change_versions()
+            with self._lock:
+                stale = (self._versions is None or LIMITS_VERSION not in versions
+                         or versions[LIMITS_VERSION] != self._versions.get(LIMITS_VERSION))
+                ledger_id = self._ledger_id
+            if stale or not self._apply_tail(db, ledger_id):
+                self._load(db, versions)
+        if getattr(self._local, 'active', False):
+            self._local.fresh = True
+
+    def _load(self, db: Database, versions: dict):
+        """Reload every facility and the ledger position with one query"""
+        db.cursor.execute(_LOAD_SQL)
+        facilities, by_org, ledger_id = {}, {}, 0
+        for (ledger_id, facility_id, org_id, org_name, facility_type, limit_minor, utilised_minor,
+             reserved_minor, master_limit, last_review_date) in db.cursor.fetchall():
+            if facility_id is None:
+                continue
+            facilities[facility_id] = {
+                'facility_id': facility_id,
+                'organization_id': org_id,
+                'organization_name': org_name,
+                'type': facility_type,
+                'limit': limit_minor or 0,
+                'utilised': utilised_minor or 0,
+                'reserved': reserved_minor or 0,
+                'master_limit': master_limit or 0,
+                'last_review_date': last_review_date,
+            }
+            entry = by_org.setdefault(org_id, {'master_limit': master_limit or 0, 'facilities': []})
+            entry['facilities'].append(facility_id)
+        for entry in by_org.values():
+            entry['facilities'].sort()
+        with self._lock:
+            self._facilities = facilities
+            self._by_org = by_org
+            self._ledger_id = ledger_id
+            self._versions = versions
+
+    def _apply_tail(self, db: Database, ledger_id: int) -> bool:
+        """Apply ledger rows after ledger_id; False if one names a facility the index does not know"""
+        db.cursor.execute(_TAIL_SQL, (ledger_id,))
+        rows = db.cursor.fetchall()
+        if not rows:
+            return True
+        with self._lock:
+            if self._ledger_id != ledger_id:
+                # Another thread applied the tail meanwhile
+                return True
+            if any(facility_id not in self._facilities for facility_id, _, _, _ in rows):
+                return False
+            for facility_id, utilisation_delta, reserved_delta, last_id in rows:
+                facility = self._facilities[facility_id]
+                facility['utilised'] += utilisation_delta
+                facility['reserved'] += reserved_delta
+                self._ledger_id = max(self._ledger_id, last_id)
+        return True
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_exposure_index(db_name: str = "supply_chain_finance.db") -> ExposureIndex:
+    """Return the process-wide index for a database file, creating it on first use"""
+    db_path = resolve_db_path(db_name)
+    index = _indexes.get(db_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(db_path)
+            if index is None:
+                index = ExposureIndex(db_name)
+                _indexes[db_path] = index
+    return index
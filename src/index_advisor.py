@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Index advisor for the portal query set.
+
+Runs EXPLAIN QUERY PLAN over the hot queries issued by the portals and the
+modules behind them (see 'source' in QUERY_CATALOG), and flags every full
+table scan that is not an intentional full listing. Missing indexes are
+created by schema migration 003 (see migrations.PORTAL_INDEXES); run
+check_database.py --advise to see the report, or --create-indexes to apply
+the migration and re-check.
+"""
+
+import re
+import sqlite3
+
+if __package__:
+    from .migrations import PORTAL_INDEXES
+else:
+    from migrations import PORTAL_INDEXES
+
+
+# Catalogued queries. Keep these in step with the SQL in the modules they come from.
+# 'expected_scans' lists tables that are read in full on purpose (listings, reports).
+QUERY_CATALOG = [
+    {
+        'name': 'authenticate',
+        'source': 'auth_service.py',
+        'sql': """
+            SELECT u.Id, u.Username, u.Name, u.Role, u.OrganizationId, o.Name
+            FROM Users u
+            LEFT JOIN Organizations o ON u.OrganizationId = o.Id
+            WHERE u.Username = ?
+        """,
+        'params': ('admin',),
+        'expected_scans': [],
+    },
+    {
+        'name': 'get_real_invoices_by_status',
+        'source': 'bankportal.py',
+        'sql': """
+            SELECT i.Id, i.InvoiceNumber, i.Amount, i.Description, i.IssueDate, i.DueDate,
+                   seller.Name, buyer.Name, i.Status, i.SellerId, i.BuyerId,
+                   i.CounterpartyId, counterparty.Name,
+                   EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                           WHERE cl.OrganizationId = i.SellerId),
+                   EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                           WHERE cl.OrganizationId = i.BuyerId)
+            FROM Invoices i
+            LEFT JOIN Organizations seller ON i.SellerId = seller.Id
+            LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
+            LEFT JOIN Organizations counterparty ON i.CounterpartyId = counterparty.Id
+            WHERE i.Status = ?
+            ORDER BY i.IssueDate DESC
+        """,
+        'params': (3,),
+        'expected_scans': [],
+    },
+    {
+        'name': 'resolve_invoice_parties',
+        'source': 'stakeholders.py',
+        'sql': """
+            SELECT Id, SellerId, BuyerId, InvoiceNumber FROM Invoices WHERE Id IN (?, ?)
+        """,
+        'params': (1, 2),
+        'expected_scans': [],
+    },
+    {
+        'name': 'resolve_primary_users',
+        'source': 'stakeholders.py',
+        'sql': """
+            SELECT OrganizationId, Id, Name
+            FROM Users
+            WHERE OrganizationId IN (?, ?) AND Role = ?
+            ORDER BY OrganizationId, Id
+        """,
+        'params': (2, 3, 2),
+        'expected_scans': [],
+    },
+    {
+        'name': 'get_organizations',
+        'source': 'bankportal.py',
+        'sql': """
+            SELECT o.Id, o.Name, o.IsBuyer, o.IsSeller,
+                   EXISTS (SELECT 1 FROM CreditLimits cl JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+                           WHERE cl.OrganizationId = o.Id)
+            FROM Organizations o
+            WHERE o.IsBank = 0
+        """,
+        'params': (),
+        'expected_scans': ['Organizations'],
+    },
+    {
+        'name': 'facility_position',
+        'source': 'credit_ledger.py',
+        'sql': """
+            SELECT f.Id, f.TotalLimit, f.CurrentUtilization, f.ReservedAmount
+            FROM Facilities f
+            JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
+            WHERE cl.OrganizationId = ?
+            ORDER BY f.Id
+            LIMIT 1
+        """,
+        'params': (2,),
+        'expected_scans': [],
+    },
+    {
+        'name': 'get_user_invoices',
+        'source': 'clientportal.py',
+        'sql': """
+            SELECT i.Id, i.InvoiceNumber, i.IssueDate, i.DueDate, i.Amount,
+                   i.Description, i.Status, seller.Name, buyer.Name
+            FROM Invoices i
+            LEFT JOIN Organizations seller ON i.SellerId = seller.Id
+            LEFT JOIN Organizations buyer ON i.BuyerId = buyer.Id
+            WHERE i.SellerId = ? OR i.BuyerId = ?
+            ORDER BY i.IssueDate DESC
+        """,
+        'params': (3, 3),
+        'expected_scans': [],
+    },
+    {
+        'name': 'find_duplicate_invoices',
+        'source': 'invoice_ingest.py',
+        'sql': """
+            WITH f (SellerId, BuyerId, InvoiceNumber, Amount, IssueDate) AS (VALUES (?, ?, ?, ?, ?), (?, ?, ?, ?, ?))
+            SELECT f.SellerId, f.BuyerId, f.InvoiceNumber, f.Amount, f.IssueDate, MIN(i.Id)
+            FROM f
+            JOIN Invoices i ON i.SellerId IS f.SellerId AND i.BuyerId IS f.BuyerId
+                           AND i.InvoiceNumber = f.InvoiceNumber AND i.Amount = f.Amount
+                           AND i.IssueDate = f.IssueDate
+            GROUP BY f.SellerId, f.BuyerId, f.InvoiceNumber, f.Amount, f.IssueDate
+        """,
+        'params': (3, 2, 'INV-2025-001', 13000000, '2025-06-12', 3, 2, 'X', 1, '2025-01-01'),
+        'expected_scans': ['f'],
+    },
+    {
+        'name': 'get_transactions',
+        'source': 'transaction_service.py',
+        'sql': """
+            SELECT Id, Type, FacilityType, OrganizationId, InvoiceId, Description, Amount,
+                   TransactionDate, MaturityDate, IsPaid, PaymentDate, InterestOrDiscountRate
+            FROM Transactions
+            WHERE OrganizationId = ?
+            ORDER BY TransactionDate DESC
+        """,
+        'params': (3,),
+        'expected_scans': [],
+    },
+    {
+        'name': 'statement_opening_balance',
+        'source': 'transaction_service.py',
+        'sql': """
+            SELECT COALESCE((SELECT Balance FROM BalanceSnapshots WHERE OrganizationId = ? AND AsOfDate = ?), 0)
+                 + COALESCE((SELECT SUM(CASE WHEN Type IN (1, 3) THEN -Amount WHEN Type = 2 THEN Amount ELSE 0 END)
+                             FROM Transactions
+                             WHERE OrganizationId = ? AND TransactionDate >= ? AND TransactionDate < ?), 0)
+        """,
+        'params': (3, '2025-06-01', 3, '2025-06-01', '2025-06-15 00:00:00'),
+        'expected_scans': [],
+    },
+    {
+        'name': 'statement_run_opening_balances',
+        'source': 'transaction_service.py',
+        'sql': """
+            SELECT OrganizationId, SUM(CASE WHEN Type IN (1, 3) THEN -Amount WHEN Type = 2 THEN Amount ELSE 0 END)
+            FROM Transactions
+            WHERE TransactionDate >= ? AND TransactionDate < ?
+            GROUP BY OrganizationId
+        """,
+        'params': ('2025-06-01', '2025-06-15 00:00:00'),
+        'expected_scans': [],
+    },
+    {
+        'name': 'balance_snapshot_rows',
+        'source': 'balance_snapshots.py',
+        'sql': """
+            SELECT OrganizationId, Balance FROM BalanceSnapshots WHERE AsOfDate = ?
+        """,
+        'params': ('2025-06-01',),
+        'expected_scans': [],
+    },
+    {
+        'name': 'statement_cache_version',
+        'source': 'transaction_service.py',
+        'sql': "SELECT Version FROM TransactionVersions WHERE OrganizationId = ?",
+        'params': (3,),
+        'expected_scans': [],
+    },
+    {
+        'name': 'statement_transactions',
+        'source': 'transaction_service.py',
+        'sql': """
+            SELECT Id, Type, FacilityType, OrganizationId, InvoiceId, Description, Amount,
+                   TransactionDate, MaturityDate, IsPaid, PaymentDate, InterestOrDiscountRate,
+                   CASE WHEN Type IN (1, 3) THEN -Amount WHEN Type = 2 THEN Amount ELSE 0 END
+            FROM Transactions
+            WHERE OrganizationId = ? AND TransactionDate >= ? AND TransactionDate <= ?
+            ORDER BY TransactionDate, Id
+        """,
+        'params': (3, '2025-06-01 00:00:00', '2025-07-31 00:00:00'),
+        'expected_scans': [],
+    },
+    {
+        'name': 'journal_entry_lines',
+        'source': 'accounting_report.py',
+        'sql': """
+            SELECT je.Id, je.TransactionReference, acc.AccountCode, acc.AccountName,
+                   jel.DebitAmount, jel.CreditAmount, jel.Description,
+                   SUM(jel.DebitAmount) OVER entry, SUM(jel.CreditAmount) OVER entry
+            FROM JournalEntries je
+            LEFT JOIN JournalEntryLines jel ON jel.JournalEntryId = je.Id
+            LEFT JOIN Accounts acc ON acc.Id = jel.AccountId
+            WINDOW entry AS (PARTITION BY je.Id ORDER BY jel.Id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+            ORDER BY je.Id, jel.Id
+        """,
+        'params': (),
+        'expected_scans': ['JournalEntries'],
+    },
+    {
+        'name': 'journal_entries',
+        'source': 'accounting_report.py',
+        'sql': """
+            SELECT je.Id, je.TransactionReference, je.TransactionDate, je.Description, i.InvoiceNumber
+            FROM JournalEntries je
+            LEFT JOIN Invoices i ON je.InvoiceId = i.Id
+            ORDER BY je.Id
+        """,
+        'params': (),
+        'expected_scans': ['JournalEntries'],
+    },
+    {
+        'name': 'account_balances',
+        'source': 'accounting_report.py',
+        'sql': """
+            SELECT AccountCode, AccountName, Type, Balance
+            FROM Accounts
+            ORDER BY AccountCode
+        """,
+        'params': (),
+        'expected_scans': ['Accounts'],
+    },
+    {
+        'name': 'transaction_listing',
+        'source': 'accounting_report.py',
+        'sql': """
+            SELECT t.Id, i.InvoiceNumber, t.Amount, t.TransactionDate, t.Type, t.Description
+            FROM Transactions t
+            LEFT JOIN Invoices i ON t.InvoiceId = i.Id
+            ORDER BY t.Id
+        """,
+        'params': (),
+        'expected_scans': ['Transactions'],
+    },
+    {
+        'name': 'exposure_load',
+        'source': 'exposure_index.py',
+        'sql': """
+            WITH Tail AS (SELECT COALESCE(MAX(Id), 0) AS LedgerId FROM UtilizationLedger)
+            SELECT t.LedgerId, x.*
+            FROM Tail t
+            LEFT JOIN (
+                SELECT f.Id, cl.OrganizationId, o.Name, f.Type, f.TotalLimit, f.CurrentUtilization,
+                       f.ReservedAmount, cl.MasterLimit, cl.LastReviewDate
+                FROM Facilities f
+                JOIN CreditLimits cl ON f.CreditLimitInfoId = cl.Id
+                LEFT JOIN Organizations o ON cl.OrganizationId = o.Id
+            ) x ON 1
+        """,
+        'params': (),
+        'expected_scans': ['Facilities', 'CreditLimits', 'Tail', 'x'],
+    },
+    {
+        'name': 'trial_balance_roll_forward',
+        'source': 'trial_balance.py',
+        'sql': """
+            SELECT l.AccountId, SUM(l.DebitAmount) - SUM(l.CreditAmount), MAX(l.Id)
+            FROM JournalEntryLines l
+            JOIN JournalEntries je ON je.Id = l.JournalEntryId
+            WHERE l.Id > ? AND je.Status = ?
+            GROUP BY +l.AccountId
+        """,
+        'params': (0, 1),
+        'expected_scans': [],
+    },
+    {
+        'name': 'limit_tree',
+        'source': 'limit_tree.py',
+        'sql': """
+            SELECT o.Id, o.Name, o.IsBuyer, o.IsSeller,
+                   cl.Id, cl.MasterLimit, cl.NextReviewDate,
+                   f.Id, f.Type, f.TotalLimit, f.CurrentUtilization, f.ReservedAmount,
+                   f.ReviewEndDate, f.GracePeriodDays, rp.Name
+            FROM Organizations o
+            LEFT JOIN CreditLimits cl ON cl.OrganizationId = o.Id
+            LEFT JOIN Facilities f ON f.CreditLimitInfoId = cl.Id
+            LEFT JOIN Organizations rp ON rp.Id = f.RelatedPartyId
+            WHERE o.IsBank = 0 OR ?
+            ORDER BY o.IsSeller DESC, o.Name, o.Id, cl.Id, f.Type, f.Id
+        """,
+        'params': (0,),
+        'expected_scans': ['Organizations'],
+    },
+    {
+        'name': 'exposure_ledger_tail',
+        'source': 'exposure_index.py',
+        'sql': """
+            SELECT FacilityId, SUM(UtilizationDelta), SUM(ReservedDelta), MAX(Id)
+            FROM UtilizationLedger
+            WHERE Id > ?
+            GROUP BY +FacilityId
+        """,
+        'params': (0,),
+        'expected_scans': [],
+    },
+    {
+        'name': 'ledger_export_journal_lines',
+        'source': 'ledger_export.py',
+        'sql': """
+            SELECT jel.Id, je.Id, je.TransactionReference, je.TransactionDate, i.InvoiceNumber,
+                   COALESCE(jel.OrganizationId, je.OrganizationId), acc.AccountCode, acc.AccountName,
+                   jel.DebitAmount, jel.CreditAmount, jel.Description
+            FROM JournalEntryLines jel
+            JOIN JournalEntries je ON je.Id = jel.JournalEntryId
+            LEFT JOIN Accounts acc ON acc.Id = jel.AccountId
+            LEFT JOIN Invoices i ON i.Id = je.InvoiceId
+            WHERE jel.Id > ? ORDER BY jel.Id LIMIT ?
+        """,
+        'params': (0, 5000),
+        'expected_scans': [],
+    },
+    {
+        'name': 'ledger_export_transactions',
+        'source': 'ledger_export.py',
+        'sql': """
+            SELECT t.Id, t.TransactionDate, i.InvoiceNumber, t.OrganizationId, t.Type, t.Amount,
+                   t.MaturityDate, t.IsPaid, t.Description
+            FROM Transactions t
+            LEFT JOIN Invoices i ON i.Id = t.InvoiceId
+            WHERE t.Id > ? AND t.OrganizationId = ? ORDER BY t.Id LIMIT ?
+        """,
+        'params': (0, 1, 5000),
+        'expected_scans': [],
+    },
+]
+
+# EXPLAIN QUERY PLAN detail for a full scan: "SCAN Invoices AS i" (older SQLite: "SCAN TABLE Invoices AS i").
+# "SCAN i USING INDEX ..." still visits every row, only in index order, so it counts too.
+_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(?: AS \w+)?(?: USING .*)?$')
+
+# Newer SQLite reports the alias rather than the table, so aliases are resolved from the SQL
+_TABLE_REF_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_SQL_KEYWORDS = {'WHERE', 'ON', 'LEFT', 'INNER', 'JOIN', 'ORDER', 'GROUP', 'LIMIT', 'CROSS', 'USING', 'HAVING'}
+
+
+def table_aliases(sql: str) -> dict:
+    """Map every alias (and table name) in FROM/JOIN clauses to its table"""
+    aliases = {}
+    for table, alias in _TABLE_REF_PATTERN.findall(sql):
+        aliases[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def explain(connection: sqlite3.Connection, sql: str, params: tuple = ()) -> list:
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    return [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def analyse_query(connection: sqlite3.Connection, entry: dict) -> dict:
+    """Explain one catalogued query and list the unexpected full table scans"""
+    try:
+        plan = explain(connection, entry['sql'], entry['params'])
+    except sqlite3.OperationalError as e:
+        # Schema older than the migration that adds the query's tables or columns
+        return {'name': entry['name'], 'source': entry['source'], 'plan': [], 'sql': entry['sql'],
+                'table_scans': [], 'temp_sort': False, 'error': str(e)}
+    aliases = table_aliases(entry['sql'])
+    scans = []
+    for detail in plan:
+        match = _SCAN_PATTERN.match(detail.strip())
+        if not match:
+            continue
+        table = aliases.get(match.group(1), match.group(1))
+        if table not in entry['expected_scans']:
+            scans.append(table)
+    return {
+        'name': entry['name'],
+        'source': entry['source'],
+        'plan': plan,
+        'sql': entry['sql'],
+        'table_scans': scans,
+        'temp_sort': any('USE TEMP B-TREE' in detail for detail in plan),
+        'error': None,
+    }
+
+
+def suggested_indexes(table: str, sql: str) -> list:
+    """Return the migration-managed indexes on a table whose leading column the query uses"""
+    return [(name, columns) for name, index_table, columns in PORTAL_INDEXES
+            if index_table == table and re.search(rf'\b{columns[0]}\b', sql)]
+
+
+def advise(connection: sqlite3.Connection) -> list:
+    """Analyse the whole catalogue; returns one result per query"""
+    return [analyse_query(connection, entry) for entry in QUERY_CATALOG]
+
+
+def missing_indexes(connection: sqlite3.Connection) -> list:
+    """Return the migration-managed indexes that do not exist in this database"""
+    existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [(name, table, columns) for name, table, columns in PORTAL_INDEXES if name not in existing]
+
+
+def print_report(connection: sqlite3.Connection, verbose: bool = False) -> int:
+    """Print the advisor report; returns the number of queries with unexpected table scans"""
+    results = advise(connection)
+    flagged = 0
+    unavailable = 0
+
+    print("\nIndex advisor")
+    print("=" * 60)
+    for result in results:
+        if result['error']:
+            unavailable += 1
+            print(f"  [{'n/a':9}] {result['source']}: {result['name']} ({result['error']})")
+            continue
+        status = "FULL SCAN" if result['table_scans'] else "ok"
+        print(f"  [{status:9}] {result['source']}: {result['name']}")
+        if result['table_scans']:
+            flagged += 1
+            for table in result['table_scans']:
+                suggestions = suggested_indexes(table, result['sql'])
+                if suggestions:
+                    for name, columns in suggestions:
+                        print(f"              scan of {table}; migration index {name} ({', '.join(columns)})")
+                else:
+                    print(f"              scan of {table}; no catalogued index")
+        if result['temp_sort'] and verbose:
+            print("              sorts with a temporary b-tree")
+        if verbose or result['table_scans']:
+            for detail in result['plan']:
+                print(f"                {detail}")
+
+    missing = missing_indexes(connection)
+    print()
+    if missing:
+        print(f"{len(missing)} recommended index(es) missing: {', '.join(name for name, _, _ in missing)}")
+        print("Run 'python check_database.py --create-indexes' (or 'make db-migrate') to create them.")
+    else:
+        print("All recommended indexes are present.")
+    if unavailable:
+        print(f"{unavailable} catalogued query(ies) need pending migrations and were not analysed.")
+    print(f"{flagged} of {len(results)} catalogued queries use an unexpected full table scan.")
+    return flagged
@@ -0,0 +1,363 @@
+"""
+Bulk invoice ingestion for the Client Portal
+
+Streams invoices from CSV or JSON Lines files, validates them, resolves
+counterparty names against Organizations in batch and inserts them with
+executemany, one transaction per chunk. Only one chunk is held in memory at a
+time, so memory use does not grow with the file size.
+
+Expected fields (CSV header or JSON keys):
+    invoice_number, amount, issue_date, due_date, description (optional),
+    and the counterparty: buyer (when a seller uploads) or seller (when a
+    buyer uploads), given by organization name.
+Dates may be DD-MM-YYYY or ISO-8601 (YYYY-MM-DD).
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+if __package__:
+    from .database import Database, to_minor, format_date, parse_date
+    from .invoice_states import NEW
+else:
+    from database import Database, to_minor, format_date, parse_date
+    from invoice_states import NEW
+
+
+INGEST_CHUNK_SIZE = 1000     # Rows per executemany / transaction
+MAX_REPORTED_REJECTS = 20    # Rejects kept in memory for display; all of them go to the rejects file
+FINGERPRINT_BATCH = 150      # Rows per duplicate lookup (5 parameters each, under SQLite's 999 default)
+
+INSERT_INVOICE_SQL = """
+    INSERT INTO Invoices (
+        InvoiceNumber, IssueDate, DueDate, Amount, Description,
+        SellerId, BuyerId, CounterpartyId, Currency, Status, BuyerApproved, SellerAccepted
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class IngestReport:
+    """Counters and rejects for one ingest run"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows_read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.rejects = []  # First MAX_REPORTED_REJECTS as (line, invoice_number, reason)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def reject(self, line: int, invoice_number: str, reason: str, writer=None):
+        """Record a rejected row"""
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append((line, invoice_number, reason))
+        if writer is not None:
+            writer.writerow([line, invoice_number, reason])
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def print_summary(self):
+        """Print throughput and the first rejects"""
+        print(f"\nIngest of {os.path.basename(self.path)} finished in {self.elapsed:.2f}s")
+        print(f"  Rows read:  {self.rows_read:,}")
+        print(f"  Inserted:   {self.inserted:,}")
+        print(f"  Rejected:   {self.rejected:,}")
+        print(f"  Throughput: {self.rows_per_second:,.0f} rows/s in {self.chunks:,} chunk(s)")
+        if self.rejects:
+            print("\nRejected rows:")
+            for line, invoice_number, reason in self.rejects:
+                print(f"  line {line}: {invoice_number or '(no number)'} - {reason}")
+            if self.rejected > len(self.rejects):
+                print(f"  ... and {self.rejected - len(self.rejects):,} more")
+
+
+def read_invoice_rows(path: str):
+    """Yield (line_number, row dict) from a CSV or JSON Lines file without loading it whole"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if extension in ('.jsonl', '.ndjson', '.json'):
+            for line_number, line in enumerate(handle, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {'_error': f"Invalid JSON: {e.msg}"}
+                    continue
+                yield line_number, row if isinstance(row, dict) else {'_error': "Expected a JSON object"}
+        else:
+            reader = csv.DictReader(handle)
+            for row in reader:
+                # Header is line 1; reader.line_num is the line the row ended on
+                yield reader.line_num, {key.strip().lower(): value for key, value in row.items() if key}
+
+
+def chunked(iterable, size: int):
+    """Yield lists of up to size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(row: dict, key: str) -> str:
+    value = row.get(key)
+    return str(value).strip() if value is not None else ''
+
+
+def validate_row(row: dict, counterparty_field: str):
+    """
+    Normalise one input row.
+
+    Returns:
+        (values, None) with the cleaned fields, or (None, reason) if the row is invalid
+    """
+    if '_error' in row:
+        return None, row['_error']
+
+    invoice_number = _text(row, 'invoice_number')
+    if not invoice_number:
+        return None, "Invoice number is required"
+
+    counterparty = _text(row, counterparty_field)
+    if not counterparty:
+        return None, f"{counterparty_field.title()} is required"
+
+    try:
+        amount = to_minor(_text(row, 'amount').replace(',', '').lstrip('$'))
+    except ArithmeticError:
+        amount = None
+    if amount is None or amount <= 0:
+        return None, f"Invalid amount: {_text(row, 'amount') or '(empty)'}"
+
+    try:
+        issue_date = parse_date(_text(row, 'issue_date'))
+        due_date = parse_date(_text(row, 'due_date'))
+    except ValueError as e:
+        return None, str(e)
+    if issue_date is None or due_date is None:
+        return None, "Issue date and due date are required"
+    if due_date <= issue_date:
+        return None, "Due date must be after issue date"
+
+    return {
+        'invoice_number': invoice_number,
+        'counterparty': counterparty,
+        'amount': amount,
+        'issue_date': format_date(issue_date),
+        'due_date': format_date(due_date),
+        'description': _text(row, 'description'),
+    }, None
+
+
+def resolve_organizations(db: Database, names, as_buyer: bool, cache: dict) -> dict:
+    """Resolve organization names (case-insensitive) to ids in one query, filling cache"""
+    wanted = {name.lower() for name in names} - set(cache)
+    if wanted:
+        role_column = "IsBuyer" if as_buyer else "IsSeller"
+        wanted = list(wanted)
+        placeholders = ",".join("?" * len(wanted))
+        db.cursor.execute(
+            f"SELECT lower(Name), MIN(Id) FROM Organizations "
+            f"WHERE lower(Name) IN ({placeholders}) AND {role_column} = 1 AND IsBank = 0 "
+            f"GROUP BY lower(Name)",
+            wanted
+        )
+        found = dict(db.cursor.fetchall())
+        for name in wanted:
+            cache[name] = found.get(name)
+    return cache
+
+
+def find_duplicate_invoices(db: Database, fingerprints) -> dict:
+    """
+    Look up invoices that already exist with the same fingerprint.
+
+    A fingerprint is (SellerId, BuyerId, InvoiceNumber, Amount in cents, IssueDate as
+    YYYY-MM-DD). Each probe is a seek on IX_Invoices_Fingerprint.
+
+    Returns:
+        {fingerprint: existing invoice Id} for the fingerprints that are taken
+    """
+    fingerprints = list(dict.fromkeys(fingerprints))
+    found = {}
+    for start in range(0, len(fingerprints), FINGERPRINT_BATCH):
+        batch = fingerprints[start:start + FINGERPRINT_BATCH]
+        values = ", ".join("(?, ?, ?, ?, ?)" for _ in batch)
+        db.cursor.execute(
+            f"""
+            WITH f (SellerId, BuyerId, InvoiceNumber, Amount, IssueDate) AS (VALUES {values})
+            SELECT f.SellerId, f.BuyerId, f.InvoiceNumber, f.Amount, f.IssueDate, MIN(i.Id)
+            FROM f
+            JOIN Invoices i ON i.SellerId IS f.SellerId AND i.BuyerId IS f.BuyerId
+                           AND i.InvoiceNumber = f.InvoiceNumber AND i.Amount = f.Amount
+                           AND i.IssueDate = f.IssueDate
+            GROUP BY f.SellerId, f.BuyerId, f.InvoiceNumber, f.Amount, f.IssueDate
+            """,
+            [value for fingerprint in batch for value in fingerprint]
+        )
+        for row in db.cursor.fetchall():
+            found[tuple(row[:5])] = row[5]
+    return found
+
+
+def find_duplicate_invoice(db: Database, seller_id: int, buyer_id: int, invoice_number: str,
+                           amount_minor: int, issue_date: str):
+    """Return the Id of an existing invoice with the same fingerprint, or None"""
+    fingerprint = (seller_id, buyer_id, invoice_number, amount_minor, issue_date)
+    return find_duplicate_invoices(db, [fingerprint]).get(fingerprint)
+
+
+def _invoice_values(values: dict, uploader_org_id: int, counterparty_id: int, as_seller: bool) -> tuple:
+    """Build the INSERT parameters, mirroring ClientPortal.save_invoice_to_database"""
+    seller_id, buyer_id = (uploader_org_id, counterparty_id) if as_seller else (counterparty_id, uploader_org_id)
+    return (
+        values['invoice_number'],
+        values['issue_date'],
+        values['due_date'],
+        values['amount'],
+        values['description'],
+        seller_id,
+        buyer_id,
+        counterparty_id,
+        'USD',  # Default currency
+        NEW,  # Status
+        0,  # BuyerApproved: False
+        1   # SellerAccepted: True
+    )
+
+
+def ingest_invoices(path: str, uploader_org_id: int, as_seller: bool = True,
+                    chunk_size: int = INGEST_CHUNK_SIZE, rejects_path: str = None,
+                    db_name: str = "supply_chain_finance.db", verbose: bool = True) -> IngestReport:
+    """
+    Stream a CSV/JSONL file of invoices into the Invoices table.
+
+    Args:
+        path: CSV or JSON Lines file
+        uploader_org_id: Organization uploading the invoices
+        as_seller: True if the uploader is the seller (rows name the buyer),
+            False if the uploader is the buyer (rows name the seller)
+        chunk_size: Rows validated, resolved and inserted per transaction
+        rejects_path: Optional CSV file receiving every rejected row with its reason
+        verbose: Print progress after each chunk
+
+    Returns:
+        IngestReport with counts, throughput and the first rejects
+    """
+    report = IngestReport(path)
+    counterparty_field = 'buyer' if as_seller else 'seller'
+    org_cache = {}
+    rejects_file = open(rejects_path, 'w', newline='', encoding='utf-8') if rejects_path else None
+    rejects_writer = None
+    if rejects_file:
+        rejects_writer = csv.writer(rejects_file)
+        rejects_writer.writerow(['line', 'invoice_number', 'reason'])
+
+    try:
+        with Database(db_name) as db, db.storage_profile('bulk_load'):
+            for chunk in chunked(read_invoice_rows(path), chunk_size):
+                report.rows_read += len(chunk)
+                report.chunks += 1
+
+                valid = []
+                for line, row in chunk:
+                    values, reason = validate_row(row, counterparty_field)
+                    if reason:
+                        report.reject(line, _text(row, 'invoice_number'), reason, rejects_writer)
+                    else:
+                        valid.append((line, values))
+
+                resolve_organizations(db, (v['counterparty'] for _, v in valid), as_seller, org_cache)
+
+                rows = []
+                seen = set()
+                for line, values in valid:
+                    counterparty_id = org_cache.get(values['counterparty'].lower())
+                    if counterparty_id is None:
+                        report.reject(line, values['invoice_number'],
+                                      f"Unknown {counterparty_field}: {values['counterparty']}", rejects_writer)
+                    elif counterparty_id == uploader_org_id:
+                        report.reject(line, values['invoice_number'],
+                                      "Seller and buyer must be different organizations", rejects_writer)
+                    else:
+                        params = _invoice_values(values, uploader_org_id, counterparty_id, as_seller)
+                        fingerprint = _fingerprint(params)
+                        if fingerprint in seen:
+                            report.reject(line, values['invoice_number'], "Duplicate of an earlier row in this file",
+                                          rejects_writer)
+                            continue
+                        seen.add(fingerprint)
+                        rows.append((line, values['invoice_number'], params))
+
+                # Duplicates of invoices already on file (earlier chunks included) are refused up front
+                existing = find_duplicate_invoices(db, (_fingerprint(params) for _, _, params in rows))
+                if existing:
+                    kept = []
+                    for line, invoice_number, params in rows:
+                        duplicate_id = existing.get(_fingerprint(params))
+                        if duplicate_id is None:
+                            kept.append((line, invoice_number, params))
+                        else:
+                            report.reject(line, invoice_number, f"Duplicate of invoice #{duplicate_id}", rejects_writer)
+                    rows = kept
+
+                report.inserted += _insert_chunk(db, rows, report, rejects_writer)
+
+                if verbose:
+                    elapsed = time.perf_counter() - report.started
+                    rate = report.rows_read / elapsed if elapsed > 0 else 0.0
+                    print(f"  {report.rows_read:,} rows read, {report.inserted:,} inserted, "
+                          f"{report.rejected:,} rejected ({rate:,.0f} rows/s)")
+    finally:
+        if rejects_file:
+            rejects_file.close()
+        report.finish()
+
+    return report
+
+
+def _fingerprint(params: tuple) -> tuple:
+    """(SellerId, BuyerId, InvoiceNumber, Amount, IssueDate) from INSERT_INVOICE_SQL parameters"""
+    return (params[5], params[6], params[0], params[3], params[1])
+
+
+def _insert_chunk(db: Database, rows: list, report: IngestReport, rejects_writer) -> int:
+    """Insert one chunk in a single transaction; isolate failing rows if the batch is refused"""
+    if not rows:
+        return 0
+    try:
+        with db.transaction():
+            db.cursor.executemany(INSERT_INVOICE_SQL, [params for _, _, params in rows])
+        return len(rows)
+    except Exception:
+        pass
+
+    # Something in the batch was refused: retry row by row so only the bad rows are rejected
+    inserted = 0
+    with db.transaction():
+        for line, invoice_number, params in rows:
+            try:
+                with db.transaction():
+                    db.cursor.execute(INSERT_INVOICE_SQL, params)
+                inserted += 1
+            except sqlite3.IntegrityError as e:
+                report.reject(line, invoice_number, str(e), rejects_writer)
+            except Exception as e:
+                report.reject(line, invoice_number, f"Database error: {e}", rejects_writer)
+    return inserted
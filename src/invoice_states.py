@@ -0,0 +1,180 @@
+"""
+Invoice state machine for the Supply Chain Finance Management System
+
+One set of status codes for both portals, the legal transitions between them
+and the columns each transition stamps. Every transition compiles to a single
+conditional UPDATE:
+
+    UPDATE Invoices SET Status = <to>, <stamps> WHERE Id IN (...) AND Status IN (<from>)
+
+so a bulk transition is one statement per chunk of ids, and an invoice that
+another user has already moved on (e.g. funded twice at the same time) simply
+does not match and is reported back instead of being overwritten.
+"""
+
+import sqlite3
+from functools import lru_cache
+
+if __package__:
+    from .database import format_timestamp
+else:
+    from database import format_timestamp
+
+
+# Status codes (Invoices.Status); migration 006 moved older data onto these
+NEW = 1                        # Uploaded by the seller or the buyer
+VALIDATED = 2                  # Checked by the bank
+APPROVED = 3                   # Approved for funding
+FUNDED = 4                     # Seller uploaded invoice funded
+FUNDING_OFFERED = 5            # Buyer uploaded invoice: funding sent for seller approval
+PENDING_SELLER_APPROVAL = 6    # Buyer uploaded invoice: waiting for the seller
+SELLER_APPROVED = 7            # Buyer uploaded invoice: seller accepted early payment
+DISCOUNTED = 8                 # Discounted invoice paid out
+DUE = 9                        # Due on maturity date
+SETTLED = 10                   # Fully settled (paid by the buyer)
+REJECTED = 11                  # Rejected by the bank
+
+STATUS_NAMES = {
+    NEW: 'New',
+    VALIDATED: 'Validated',
+    APPROVED: 'Approved',
+    FUNDED: 'Funded',
+    FUNDING_OFFERED: 'Funding Sent for Seller Approval',
+    PENDING_SELLER_APPROVAL: 'Pending Seller Approval',
+    SELLER_APPROVED: 'Seller Approved',
+    DISCOUNTED: 'Discounted',
+    DUE: 'Due',
+    SETTLED: 'Settled',
+    REJECTED: 'Rejected'
+}
+
+# Stand-in for "the transition's timestamp" in TRANSITIONS' set values
+NOW = object()
+
+# name -> from statuses, target status and the columns the transition sets.
+# Columns listed under 'params' are supplied per call (e.g. FundedAmount).
+TRANSITIONS = {
+    'validate':       {'from': (NEW,), 'to': VALIDATED, 'set': {}},
+    'approve':        {'from': (VALIDATED,), 'to': APPROVED,
+                       'set': {'BuyerApproved': 1, 'BuyerApprovalDate': NOW}},
+    'reject':         {'from': (NEW, VALIDATED), 'to': REJECTED, 'set': {},
+                       'params': ('RejectionReason',)},
+    'fund':           {'from': (APPROVED,), 'to': FUNDED, 'set': {'FundingDate': NOW},
+                       'params': ('FundedAmount', 'DiscountRate')},
+    'offer_funding':  {'from': (APPROVED,), 'to': FUNDING_OFFERED, 'set': {'FundingOfferDate': NOW},
+                       'params': ('FundedAmount', 'DiscountRate')},
+    'seller_accept':  {'from': (FUNDING_OFFERED, PENDING_SELLER_APPROVAL), 'to': SELLER_APPROVED,
+                       'set': {'SellerAccepted': 1, 'SellerAcceptanceDate': NOW}},
+    'seller_decline': {'from': (FUNDING_OFFERED, PENDING_SELLER_APPROVAL), 'to': APPROVED,
+                       'set': {'FundedAmount': None, 'DiscountRate': None, 'FundingOfferDate': None}},
+    'settle':         {'from': (FUNDED, SELLER_APPROVED, DISCOUNTED, DUE), 'to': SETTLED,
+                       'set': {'PaymentDate': NOW}},
+}
+
+# Ids per IN (...) list, well below SQLite's host parameter limit
+TRANSITION_CHUNK_SIZE = 500
+
+# UPDATE ... RETURNING needs SQLite 3.35
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+class IllegalTransition(ValueError):
+    """Raised for an unknown transition or missing/unknown per-call columns"""
+
+
+def status_name(status) -> str:
+    return STATUS_NAMES.get(status, 'Unknown')
+
+
+def can_transition(name: str, status: int) -> bool:
+    """True if an invoice in status may take the named transition"""
+    transition = TRANSITIONS.get(name)
+    return transition is not None and status in transition['from']
+
+
+def _transition(name: str) -> dict:
+    transition = TRANSITIONS.get(name)
+    if transition is None:
+        raise IllegalTransition(f"Unknown invoice transition: {name}")
+    return transition
+
+
+@lru_cache(maxsize=None)
+def compile_transition(name: str, id_count: int = 1, returning: bool = False) -> str:
+    """
+    SQL for one transition over id_count invoices.
+
+    Parameters, in order: the NOW timestamp (once per NOW column), the
+    transition's 'params' columns, then the invoice ids.
+    """
+    transition = _transition(name)
+    assignments = [f"Status = {int(transition['to'])}"]
+    for column, value in transition['set'].items():
+        if value is NOW:
+            assignments.append(f"{column} = ?")
+        elif value is None:
+            assignments.append(f"{column} = NULL")
+        else:
+            assignments.append(f"{column} = {int(value)}")
+    assignments.extend(f"{column} = ?" for column in transition.get('params', ()))
+
+    ids = "Id = ?" if id_count == 1 else f"Id IN ({','.join('?' * id_count)})"
+    expected = ', '.join(str(int(status)) for status in transition['from'])
+    sql = f"UPDATE Invoices SET {', '.join(assignments)} WHERE {ids} AND Status IN ({expected})"
+    return sql + " RETURNING Id" if returning else sql
+
+
+def _parameters(name: str, timestamp: str, values: dict) -> tuple:
+    transition = _transition(name)
+    params = transition.get('params', ())
+    unknown = set(values) - set(params)
+    if unknown:
+        raise IllegalTransition(f"Transition {name} does not set {', '.join(sorted(unknown))}")
+    stamps = tuple(timestamp for value in transition['set'].values() if value is NOW)
+    return stamps + tuple(values.get(column) for column in params)
+
+
+def transition(db, name: str, invoice_ids, timestamp: str = None, **values) -> set:
+    """
+    Move invoices through the named transition, sharing values for its 'params' columns.
+
+    Returns the ids that moved; invoices not in one of the transition's from
+    statuses (or not found) are left untouched. Run inside db.transaction()
+    when the caller writes anything else that depends on the result.
+    """
+    ids = [invoice_id for invoice_id in dict.fromkeys(invoice_ids) if invoice_id is not None]
+    shared = _parameters(name, timestamp or format_timestamp(), values)
+    moved = set()
+    for start in range(0, len(ids), TRANSITION_CHUNK_SIZE):
+        chunk = ids[start:start + TRANSITION_CHUNK_SIZE]
+        if _HAS_RETURNING:
+            db.cursor.execute(compile_transition(name, len(chunk), True), (*shared, *chunk))
+            moved.update(row[0] for row in db.cursor.fetchall())
+        else:
+            # Pick the matching rows first; the caller's transaction keeps them from changing
+            transition_from = _transition(name)['from']
+            db.cursor.execute(
+                f"SELECT Id FROM Invoices WHERE Id IN ({','.join('?' * len(chunk))}) "
+                f"AND Status IN ({', '.join(str(int(s)) for s in transition_from)})",
+                chunk
+            )
+            matched = [row[0] for row in db.cursor.fetchall()]
+            if matched:
+                db.cursor.execute(compile_transition(name, len(matched)), (*shared, *matched))
+                moved.update(matched)
+    return moved
+
+
+def transition_each(db, name: str, rows, timestamp: str = None) -> int:
+    """
+    Move invoices through the named transition with per-invoice values.
+
+    rows is an iterable of (invoice_id, {param column: value}). Runs one
+    executemany of the single-invoice statement; returns how many invoices moved.
+    """
+    timestamp = timestamp or format_timestamp()
+    db.cursor.executemany(
+        compile_transition(name),
+        [(*_parameters(name, timestamp, values), invoice_id) for invoice_id, values in rows]
+    )
+    return db.cursor.rowcount
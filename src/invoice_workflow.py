@@ -0,0 +1,223 @@
+"""
+Bulk invoice review for the Bank Portal
+
+Moves many invoices through the review queue at once: New -> Validated ->
+Approved, or Rejected with a reason per invoice. Each call is one transaction:
+the status changes with the state machine's conditional UPDATE (one statement
+per chunk of ids, see invoice_states), and the notifications and memo journal
+lines are inserted with executemany. Invoices that are not in a status the
+transition starts from are left alone and reported as skipped.
+
+Notification texts and journal memos are the ones validate_invoice,
+approve_invoice and reject_invoice produce for a single invoice.
+"""
+
+import time
+from datetime import datetime
+
+from src import invoice_states
+from src.database import Database, format_timestamp
+from src.stakeholders import StakeholderResolver, QUERY_CHUNK_SIZE
+
+
+def _chunks(items: list, size: int = QUERY_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ReviewReport:
+    """Invoices moved and skipped by one bulk review action"""
+
+    def __init__(self, action: str):
+        self.action = action
+        self.moved = []      # Invoice ids whose status changed
+        self.skipped = {}    # invoice_id -> reason
+        self.notifications = 0
+        self.journal_entries = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def print_summary(self):
+        """Print counts and the skipped invoices"""
+        print(f"\n{self.action}: {len(self.moved):,} invoice(s) updated in {self.elapsed:.2f}s")
+        print(f"  Notifications sent:  {self.notifications:,}")
+        print(f"  Journal memos:       {self.journal_entries:,}")
+        if self.skipped:
+            print(f"  Skipped:             {len(self.skipped):,}")
+            for invoice_id, reason in list(self.skipped.items())[:20]:
+                print(f"    invoice {invoice_id}: {reason}")
+            if len(self.skipped) > 20:
+                print(f"    ... and {len(self.skipped) - 20:,} more")
+
+
+class InvoiceReviewService:
+    """Set-based validate / approve / reject of review-queue invoices"""
+
+    def __init__(self, db_name: str = "supply_chain_finance.db", stakeholders: StakeholderResolver = None):
+        self.db_name = db_name
+        self.stakeholders = stakeholders or StakeholderResolver(db_name)
+
+    def validate_invoices(self, invoice_ids, user_id: int = None) -> ReviewReport:
+        """New -> Validated; notifies the seller and asks the buyer for approval"""
+        def notifications(invoice, parties, timestamp):
+            rows = []
+            if parties.get('seller_user_id'):
+                rows.append((parties['seller_user_id'], "Invoice Validated",
+                             f"Invoice {invoice['number']} has been validated by the bank and is ready for buyer approval.",
+                             timestamp, 0, "Success", invoice['id'], 0, 0))
+            if parties.get('buyer_user_id'):
+                rows.append((parties['buyer_user_id'], "Approval Required",
+                             f"Invoice {invoice['number']} from {parties.get('seller_name', 'Unknown')} requires your approval for financing.",
+                             timestamp, 0, "Action", invoice['id'], 1, 0))
+            return rows
+
+        # No accounting entry on validation: the business only books funded invoices
+        return self._transition("Validate", 'validate', invoice_ids, notifications, None, user_id)
+
+    def approve_invoices(self, invoice_ids, user_id: int) -> ReviewReport:
+        """Validated -> Approved; records the buyer approval, an APPROVAL memo and notifies both parties"""
+        def notifications(invoice, parties, timestamp):
+            rows = []
+            if parties.get('seller_user_id'):
+                rows.append((parties['seller_user_id'], "Invoice Approved",
+                             f"Great news! Invoice {invoice['number']} has been approved for funding by the bank.",
+                             timestamp, 0, "Success", invoice['id'], 0, 0))
+            if parties.get('buyer_user_id'):
+                rows.append((parties['buyer_user_id'], "Invoice Approved",
+                             f"Invoice {invoice['number']} has been approved for funding. You will be notified when payment is due.",
+                             timestamp, 0, "Info", invoice['id'], 0, 0))
+            return rows
+
+        return self._transition("Approve", 'approve', invoice_ids, notifications,
+                                ("APPROVAL", lambda invoice: f"Invoice approved for funding - {invoice['number']}"),
+                                user_id)
+
+    def reject_invoices(self, reasons: dict, user_id: int) -> ReviewReport:
+        """New or Validated -> Rejected; reasons is {invoice_id: reason}, invoices without one are skipped"""
+        missing = [invoice_id for invoice_id, reason in reasons.items() if not (reason and reason.strip())]
+        reasons = {invoice_id: reason.strip() for invoice_id, reason in reasons.items() if reason and reason.strip()}
+
+        def notifications(invoice, parties, timestamp):
+            rows = []
+            if parties.get('seller_user_id'):
+                rows.append((parties['seller_user_id'], "Invoice Update",
+                             f"Invoice {invoice['number']} has been rejected by the bank. Reason: {reasons[invoice['id']]}",
+                             timestamp, 0, "Info", invoice['id'], 0, 0))
+            if parties.get('buyer_user_id'):
+                rows.append((parties['buyer_user_id'], "Invoice Update",
+                             f"Invoice {invoice['number']} has been rejected by the bank and will not require payment.",
+                             timestamp, 0, "Info", invoice['id'], 0, 0))
+            return rows
+
+        report = self._transition("Reject", 'reject', list(reasons), notifications,
+                                  ("REJECTION", lambda invoice: f"Invoice rejected - {invoice['number']} - Reason: {reasons[invoice['id']]}"),
+                                  user_id, reasons)
+        for invoice_id in missing:
+            report.skipped[invoice_id] = "no rejection reason"
+        return report
+
+    def _transition(self, action: str, name: str, invoice_ids, notifications, memo, user_id: int,
+                    reasons: dict = None) -> ReviewReport:
+        """
+        Move invoices through the named state machine transition in one transaction.
+
+        memo is (transaction type, description(invoice)) or None; reasons, if
+        given, are written to RejectionReason with one UPDATE per distinct reason.
+        """
+        report = ReviewReport(action)
+        eligible = []
+        wanted = [invoice_id for invoice_id in dict.fromkeys(invoice_ids) if invoice_id is not None]
+        if not wanted:
+            report.finish()
+            return report
+
+        try:
+            with self.stakeholders.operation():
+                with Database(self.db_name) as db:
+                    with db.transaction():
+                        invoices = self._load(db, wanted)
+                        timestamp = format_timestamp()
+                        if reasons:
+                            by_reason = {}
+                            for invoice_id in wanted:
+                                by_reason.setdefault(reasons[invoice_id], []).append(invoice_id)
+                            moved = set()
+                            for reason, ids in by_reason.items():
+                                moved |= invoice_states.transition(db, name, ids, timestamp, RejectionReason=reason)
+                        else:
+                            moved = invoice_states.transition(db, name, wanted, timestamp)
+
+                        for invoice_id in wanted:
+                            if invoice_id not in invoices:
+                                report.skipped[invoice_id] = "not found"
+                            elif invoice_id not in moved:
+                                status = invoice_states.status_name(invoices[invoice_id]['status'])
+                                report.skipped[invoice_id] = f"status is {status}"
+                        eligible = [invoices[i] for i in wanted if i in moved]
+                        if not eligible:
+                            report.finish()
+                            return report
+
+                        stakeholders = self.stakeholders.resolve_many([invoice['id'] for invoice in eligible])
+
+                        if memo is not None:
+                            report.journal_entries = self._post_memos(db, eligible, stakeholders, memo, timestamp, user_id)
+
+                        rows = []
+                        for invoice in eligible:
+                            rows.extend(notifications(invoice, stakeholders.get(invoice['id'], {}), timestamp))
+                        db.cursor.executemany("""
+                            INSERT INTO Notifications (UserId, Title, Message, CreatedDate, IsRead, Type, InvoiceId, RequiresAction, ActionTaken)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, rows)
+                        report.notifications = len(rows)
+                        report.moved = [invoice['id'] for invoice in eligible]
+        except Exception as e:
+            print(f"Error during bulk {action.lower()}: {e}")
+            print("No changes were saved.")
+            report.skipped.update({invoice['id']: "not saved" for invoice in eligible})
+            report.moved = []
+            report.notifications = 0
+            report.journal_entries = 0
+
+        report.finish()
+        return report
+
+    def _load(self, db: Database, invoice_ids: list) -> dict:
+        """{invoice_id: {'id', 'number', 'status'}} for the invoices that exist"""
+        invoices = {}
+        for chunk in _chunks(invoice_ids):
+            db.cursor.execute(
+                f"SELECT Id, InvoiceNumber, Status FROM Invoices WHERE Id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for invoice_id, number, status in db.cursor.fetchall():
+                invoices[invoice_id] = {'id': invoice_id, 'number': number, 'status': status}
+        return invoices
+
+    def _post_memos(self, db: Database, invoices: list, stakeholders: dict, memo: tuple,
+                    timestamp: str, user_id: int) -> int:
+        """Insert one memo journal entry (header and zero line) per invoice; returns the count"""
+        transaction_type, describe = memo
+        reference = f"{transaction_type}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        entry_id = db.next_id('JournalEntries')
+        entries, lines = [], []
+        for invoice in invoices:
+            description = describe(invoice)
+            seller_org_id = stakeholders.get(invoice['id'], {}).get('seller_org_id')
+            entries.append((entry_id, reference, timestamp, description, 1, invoice['id'], 1, timestamp, user_id))
+            lines.append((entry_id, 1, 0, 0, f"Memo: {description}", seller_org_id))
+            entry_id += 1
+        db.cursor.executemany("""
+            INSERT INTO JournalEntries (Id, TransactionReference, TransactionDate, Description,
+                                        OrganizationId, InvoiceId, Status, PostedDate, PostedByUserId)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, entries)
+        db.cursor.executemany("""
+            INSERT INTO JournalEntryLines (JournalEntryId, AccountId, DebitAmount, CreditAmount, Description, OrganizationId)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, lines)
+        return len(entries)
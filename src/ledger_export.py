@@ -0,0 +1,290 @@
+"""
+Ledger export for the Supply Chain Finance Management System
+
+Paged, filtered reads of the journal and transaction history for auditors.
+Each dataset is read with keyset pagination (WHERE Id > last id ORDER BY Id
+LIMIT n), so every page is a short indexed range read however deep the
+export goes, and no read transaction is held open between pages. Writers
+consume the page generator and write as they go, so memory stays at one
+page whatever the size of the ledger.
+
+Formats:
+
+- text: fixed-width columns, amounts in currency units
+- csv: amounts as exact decimal strings in currency units
+- jsonl: one JSON object per line, amounts in integer minor units (cents)
+- parquet: columnar, one row group per page, amounts in minor units; needs
+  the optional pyarrow package
+
+Filters: date_from / date_to (inclusive, on the transaction date),
+invoice_number and organization_id.
+"""
+
+import csv
+import json
+from datetime import timedelta
+
+if __package__:
+    from .database import Database, parse_date, format_date, MINOR_UNITS_PER_UNIT
+else:
+    from database import Database, parse_date, format_date, MINOR_UNITS_PER_UNIT
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+
+# Rows read per keyset page
+PAGE_SIZE = 5000
+
+# Column kinds: 'id' integer, 'text', 'money' integer minor units
+DATASETS = {
+    'journal_lines': {
+        'title': 'JOURNAL ENTRY LINES',
+        'key': 'jel.Id',
+        'sql': """
+            SELECT jel.Id, je.Id, je.TransactionReference, je.TransactionDate, i.InvoiceNumber,
+                   COALESCE(jel.OrganizationId, je.OrganizationId), acc.AccountCode, acc.AccountName,
+                   jel.DebitAmount, jel.CreditAmount, jel.Description
+            FROM JournalEntryLines jel
+            JOIN JournalEntries je ON je.Id = jel.JournalEntryId
+            LEFT JOIN Accounts acc ON acc.Id = jel.AccountId
+            LEFT JOIN Invoices i ON i.Id = je.InvoiceId
+        """,
+        'date': 'je.TransactionDate',
+        'organization': 'COALESCE(jel.OrganizationId, je.OrganizationId)',
+        'columns': [('line_id', 'id', 8), ('entry_id', 'id', 8), ('reference', 'text', 32),
+                    ('date', 'text', 19), ('invoice', 'text', 16), ('organization_id', 'id', 6),
+                    ('account_code', 'text', 8), ('account_name', 'text', 28), ('debit', 'money', 16),
+                    ('credit', 'money', 16), ('description', 'text', 0)],
+    },
+    'journal_entries': {
+        'title': 'JOURNAL ENTRIES',
+        'key': 'je.Id',
+        'sql': """
+            SELECT je.Id, je.TransactionReference, je.TransactionDate, i.InvoiceNumber, je.OrganizationId,
+                   je.Status, je.Description
+            FROM JournalEntries je
+            LEFT JOIN Invoices i ON i.Id = je.InvoiceId
+        """,
+        'date': 'je.TransactionDate',
+        'organization': 'je.OrganizationId',
+        'columns': [('entry_id', 'id', 8), ('reference', 'text', 32), ('date', 'text', 19),
+                    ('invoice', 'text', 16), ('organization_id', 'id', 6), ('status', 'id', 6),
+                    ('description', 'text', 0)],
+    },
+    'transactions': {
+        'title': 'TRANSACTIONS',
+        'key': 't.Id',
+        'sql': """
+            SELECT t.Id, t.TransactionDate, i.InvoiceNumber, t.OrganizationId, t.Type, t.Amount,
+                   t.MaturityDate, t.IsPaid, t.Description
+            FROM Transactions t
+            LEFT JOIN Invoices i ON i.Id = t.InvoiceId
+        """,
+        'date': 't.TransactionDate',
+        'organization': 't.OrganizationId',
+        'columns': [('transaction_id', 'id', 8), ('date', 'text', 19), ('invoice', 'text', 16),
+                    ('organization_id', 'id', 6), ('type', 'id', 4), ('amount', 'money', 16),
+                    ('maturity_date', 'text', 10), ('is_paid', 'id', 4), ('description', 'text', 0)],
+    },
+}
+
+
+def _dataset(name: str) -> dict:
+    spec = DATASETS.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown ledger dataset: {name}")
+    return spec
+
+
+def columns(dataset: str) -> list:
+    """Column names of a dataset, in row order"""
+    return [name for name, _, _ in _dataset(dataset)['columns']]
+
+
+def _filters(spec: dict, date_from=None, date_to=None, invoice_number=None, organization_id=None) -> tuple:
+    """(WHERE conditions, parameters) for the filters that are set"""
+    conditions, params = [], []
+    if date_from:
+        conditions.append(f"{spec['date']} >= ?")
+        params.append(format_date(date_from))
+    if date_to:
+        # Dates compare as text; everything before the next day is on or before date_to
+        conditions.append(f"{spec['date']} < ?")
+        params.append(format_date(parse_date(date_to) + timedelta(days=1)))
+    if invoice_number:
+        conditions.append("i.InvoiceNumber = ?")
+        params.append(invoice_number)
+    if organization_id is not None:
+        conditions.append(f"{spec['organization']} = ?")
+        params.append(organization_id)
+    return conditions, params
+
+
+def page_sql(dataset: str, **filters) -> tuple:
+    """(SQL, parameters) of one keyset page; the last two parameters are the previous key and the page size"""
+    spec = _dataset(dataset)
+    conditions, params = _filters(spec, **filters)
+    where = " AND ".join([f"{spec['key']} > ?"] + conditions)
+    sql = f"{spec['sql']} WHERE {where} ORDER BY {spec['key']} LIMIT ?"
+    return sql, params
+
+
+def iter_pages(db: Database, dataset: str, page_size: int = PAGE_SIZE, after: int = 0, **filters):
+    """Generator of the dataset one page (a list of row tuples) at a time, from the key after 'after'"""
+    # Built here rather than in the generator so bad filters fail before a writer starts
+    sql, params = page_sql(dataset, **filters)
+    return _pages(db, sql, params, page_size, after)
+
+
+def _pages(db: Database, sql: str, params: list, page_size: int, after: int):
+    while True:
+        db.cursor.execute(sql, (after, *params, page_size))
+        rows = db.cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1][0]
+
+
+def fetch_page(db: Database, dataset: str, after: int = 0, limit: int = PAGE_SIZE, **filters) -> dict:
+    """
+    One page of a dataset as {'rows': [dict], 'next_after'}.
+
+    Pass next_after back as 'after' for the following page; it is None on the last page.
+    """
+    names = columns(dataset)
+    rows = next(iter_pages(db, dataset, limit, after, **filters), [])
+    return {'rows': [dict(zip(names, row)) for row in rows],
+            'next_after': rows[-1][0] if len(rows) == limit else None}
+
+
+def _decimal(value_minor) -> str:
+    """Exact currency-unit text of minor units (no float rounding)"""
+    if value_minor is None:
+        return ''
+    sign = '-' if value_minor < 0 else ''
+    whole, cents = divmod(abs(int(value_minor)), MINOR_UNITS_PER_UNIT)
+    return f"{sign}{whole}.{cents:02d}"
+
+
+def write_text(spec: dict, pages, out) -> int:
+    """Fixed-width columns; returns the rows written"""
+    layout = [(name, kind, max(width, len(name)) if width else 0) for name, kind, width in spec['columns']]
+    header = " ".join(f"{name:>{width}}" if kind == 'money' else f"{name:<{width}}"
+                      for name, kind, width in layout)
+    out.write(spec['title'] + "\n")
+    out.write(header.rstrip() + "\n")
+    out.write("-" * len(header.rstrip()) + "\n")
+    count = 0
+    for rows in pages:
+        lines = []
+        for row in rows:
+            fields = []
+            for value, (_, kind, width) in zip(row, layout):
+                if kind == 'money':
+                    fields.append(f"{(value or 0) / MINOR_UNITS_PER_UNIT:>{width},.2f}")
+                else:
+                    fields.append(f"{'' if value is None else value!s:<{width}}")
+            lines.append(" ".join(fields).rstrip() + "\n")
+        out.write("".join(lines))
+        count += len(rows)
+    return count
+
+
+def write_csv(spec: dict, pages, out) -> int:
+    """CSV with a header row, amounts in currency units; returns the rows written"""
+    writer = csv.writer(out)
+    writer.writerow([name for name, _, _ in spec['columns']])
+    money = [i for i, (_, kind, _) in enumerate(spec['columns']) if kind == 'money']
+    count = 0
+    for rows in pages:
+        if money:
+            rows = [[_decimal(value) if i in money else value for i, value in enumerate(row)] for row in rows]
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def write_jsonl(spec: dict, pages, out) -> int:
+    """One JSON object per row, amounts in minor units; returns the rows written"""
+    names = [name for name, _, _ in spec['columns']]
+    count = 0
+    for rows in pages:
+        out.write("".join(json.dumps(dict(zip(names, row))) + "\n" for row in rows))
+        count += len(rows)
+    return count
+
+
+def write_parquet(spec: dict, pages, out) -> int:
+    """Parquet with one row group per page, amounts in minor units; out is a path or binary file"""
+    if pyarrow is None:
+        raise ValueError("Parquet export needs the pyarrow package (pip install pyarrow)")
+    schema = pyarrow.schema([(name, pyarrow.string() if kind == 'text' else pyarrow.int64())
+                             for name, kind, _ in spec['columns']])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(out, schema) as writer:
+        for rows in pages:
+            data = {name: list(values) for name, values in zip(schema.names, zip(*rows))}
+            writer.write_table(pyarrow.Table.from_pydict(data, schema=schema))
+            count += len(rows)
+    return count
+
+
+WRITERS = {'text': write_text, 'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+
+# Formats written as bytes rather than text
+BINARY_FORMATS = ('parquet',)
+
+
+def export_ledger(out, dataset: str = 'journal_lines', fmt: str = 'csv', db_name: str = "supply_chain_finance.db",
+                  page_size: int = PAGE_SIZE, **filters) -> int:
+    """Stream a dataset to out in the given format; returns the rows written"""
+    spec = _dataset(dataset)
+    write = WRITERS.get(fmt)
+    if write is None:
+        raise ValueError(f"Unknown ledger export format: {fmt}")
+    with Database(db_name) as db:
+        return write(spec, iter_pages(db, dataset, page_size, **filters), out)
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Export the ledger for audit")
+    parser.add_argument("dataset", nargs="?", default="journal_lines", choices=sorted(DATASETS))
+    parser.add_argument("--format", default="csv", choices=sorted(WRITERS))
+    parser.add_argument("--from", dest="date_from", help="first transaction date (YYYY-MM-DD or DD-MM-YYYY)")
+    parser.add_argument("--to", dest="date_to", help="last transaction date, inclusive")
+    parser.add_argument("--invoice", dest="invoice_number", help="invoice number")
+    parser.add_argument("--organization", dest="organization_id", type=int, help="organization id")
+    parser.add_argument("--output", help="output file (default: standard output)")
+    parser.add_argument("--db", default="supply_chain_finance.db", help="database file")
+    args = parser.parse_args(argv)
+
+    filters = {'date_from': args.date_from, 'date_to': args.date_to,
+               'invoice_number': args.invoice_number, 'organization_id': args.organization_id}
+    binary = args.format in BINARY_FORMATS
+    if args.output:
+        out = open(args.output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8', newline=None if binary else '')
+    else:
+        out = sys.stdout.buffer if binary else sys.stdout
+    try:
+        count = export_ledger(out, args.dataset, args.format, args.db, **filters)
+    except ValueError as e:
+        print(f"Error exporting ledger: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.output:
+            out.close()
+    print(f"{count:,} row(s) exported", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
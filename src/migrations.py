@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the Supply Chain Finance database.
+
+The schema version is kept in SQLite's PRAGMA user_version. Each migration
+runs in its own transaction together with the version bump, so a failed
+migration leaves the database at the previous version. Database() applies
+pending migrations automatically the first time a process opens the file;
+run this module directly to apply them by hand and print the status.
+"""
+
+import re
+import sqlite3
+
+if __package__:
+    from .database import format_date, format_timestamp
+else:
+    from database import format_date, format_timestamp
+
+
+# Money columns converted from TEXT dollars to INTEGER minor units (cents)
+MONEY_COLUMNS = {
+    'Invoices': ['Amount', 'FundedAmount', 'PaidAmount'],
+    'Facilities': ['TotalLimit', 'CurrentUtilization', 'AllocatedLimit'],
+    'CreditLimits': ['MasterLimit'],
+    'JournalEntryLines': ['DebitAmount', 'CreditAmount'],
+    'Transactions': ['Amount'],
+    'Accounts': ['Balance'],
+    'AccountStatements': ['OpeningBalance', 'ClosingBalance'],
+    'TrialBalanceLines': ['DebitBalance', 'CreditBalance'],
+}
+
+# Date columns normalised to ISO-8601 text. Calendar dates are stored as YYYY-MM-DD,
+# everything else as YYYY-MM-DD HH:MM:SS (sub-second precision is dropped)
+DATE_COLUMNS = {
+    'Invoices': {'IssueDate': 'date', 'DueDate': 'date', 'FundingDate': 'timestamp',
+                 'PaymentDate': 'timestamp', 'BuyerApprovalDate': 'timestamp',
+                 'SellerAcceptanceDate': 'timestamp', 'FundingOfferDate': 'timestamp'},
+    'Transactions': {'TransactionDate': 'timestamp', 'MaturityDate': 'date', 'PaymentDate': 'timestamp'},
+    'JournalEntries': {'TransactionDate': 'timestamp', 'PostedDate': 'timestamp'},
+    'CreditLimits': {'LastReviewDate': 'timestamp', 'NextReviewDate': 'timestamp'},
+    'Facilities': {'ReviewEndDate': 'timestamp'},
+    'Accounts': {'CreatedDate': 'timestamp'},
+    'Notifications': {'CreatedDate': 'timestamp', 'ActionDate': 'timestamp'},
+    'AccountStatements': {'StartDate': 'timestamp', 'EndDate': 'timestamp', 'GenerationDate': 'timestamp'},
+    'AccountingPeriods': {'StartDate': 'date', 'EndDate': 'date', 'ClosedDate': 'timestamp'},
+    'TrialBalances': {'GeneratedDate': 'timestamp', 'AsOfDate': 'date'},
+}
+
+# Indexes for the catalogued portal queries (see index_advisor.py): (name, table, columns)
+PORTAL_INDEXES = [
+    ('IX_Users_Username', 'Users', ('Username',)),
+    ('IX_Users_OrganizationId_Role', 'Users', ('OrganizationId', 'Role')),
+    ('IX_Invoices_Status_IssueDate', 'Invoices', ('Status', 'IssueDate')),
+    ('IX_Facilities_CreditLimitInfoId_Limits', 'Facilities', ('CreditLimitInfoId', 'TotalLimit', 'CurrentUtilization')),
+]
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    """Return the schema version stored in the database file"""
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def table_exists(connection: sqlite3.Connection, table: str) -> bool:
+    """Check whether a table exists"""
+    row = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def rebuild_table(connection: sqlite3.Connection, table: str, column_types: dict, column_exprs: dict = None):
+    """
+    Rebuild a table with new declared column types, keeping its data, keys and indexes.
+
+    SQLite cannot change a column's type in place, so this follows the documented
+    create-copy-drop-rename procedure.
+
+    Args:
+        connection: Open connection (inside the migration transaction)
+        table: Table to rebuild
+        column_types: Column name -> new declared type
+        column_exprs: Column name -> SQL expression over the old table used to fill
+            the new column (defaults to the column itself)
+    """
+    column_exprs = column_exprs or {}
+    create_sql = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    dependents = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+
+    new_table = f"{table}__rebuild"
+    new_sql = re.sub(rf'^CREATE TABLE (IF NOT EXISTS )?"?{table}"?', f'CREATE TABLE "{new_table}"', create_sql)
+    for column, new_type in column_types.items():
+        new_sql, count = re.subn(
+            rf'((?<![A-Za-z0-9_])"?{column}"?\s+)[A-Za-z]+(\s+(?:NOT\s+)?NULL)',
+            rf'\g<1>{new_type}\g<2>',
+            new_sql
+        )
+        if count != 1:
+            raise sqlite3.OperationalError(f"Could not find column {table}.{column} to change its type")
+
+    columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    select_list = ", ".join(column_exprs.get(c, f'"{c}"') for c in columns)
+
+    connection.execute(new_sql)
+    connection.execute(f'INSERT INTO "{new_table}" ({column_list}) SELECT {select_list} FROM "{table}"')
+    connection.execute(f'DROP TABLE "{table}"')
+    connection.execute(f'ALTER TABLE "{new_table}" RENAME TO "{table}"')
+    for (sql,) in dependents:
+        connection.execute(sql)
+
+
+def _migration_001_money_minor_units(connection: sqlite3.Connection):
+    """Store money as INTEGER cents instead of TEXT dollars"""
+    for table, columns in MONEY_COLUMNS.items():
+        if not table_exists(connection, table):
+            continue
+        rebuild_table(
+            connection,
+            table,
+            {column: 'INTEGER' for column in columns},
+            {column: f'CAST(ROUND(CAST("{column}" AS REAL) * 100) AS INTEGER)' for column in columns}
+        )
+
+    # Aggregates over money columns can now use indexes instead of CAST scans
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Accounts_AccountCode" ON "Accounts" ("AccountCode")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_JournalEntryLines_AccountId_Amounts" '
+                       'ON "JournalEntryLines" ("AccountId", "DebitAmount", "CreditAmount")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Invoices_Status_Amount" ON "Invoices" ("Status", "Amount")')
+
+
+def _normalise_date(value, kind):
+    """SQL function used by migration 002; leaves values it cannot parse untouched"""
+    try:
+        normalised = format_date(value) if kind == 'date' else format_timestamp(value)
+    except ValueError:
+        return value
+    return normalised if normalised is not None else value
+
+
+def _migration_002_iso_dates(connection: sqlite3.Connection):
+    """Rewrite every date column as ISO-8601 text and index the range-scanned ones"""
+    connection.create_function("scf_normalise_date", 2, _normalise_date, deterministic=True)
+    for table, columns in DATE_COLUMNS.items():
+        if not table_exists(connection, table):
+            continue
+        existing = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+        for column, kind in columns.items():
+            if column not in existing:
+                continue
+            connection.execute(
+                f'UPDATE "{table}" SET "{column}" = scf_normalise_date("{column}", ?) '
+                f'WHERE "{column}" IS NOT NULL AND "{column}" != scf_normalise_date("{column}", ?)',
+                (kind, kind)
+            )
+
+    # Maturity, ageing and statement queries filter on these ranges
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Invoices_IssueDate" ON "Invoices" ("IssueDate")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Invoices_DueDate" ON "Invoices" ("DueDate")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Transactions_OrganizationId_TransactionDate" '
+                       'ON "Transactions" ("OrganizationId", "TransactionDate")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Transactions_MaturityDate" ON "Transactions" ("MaturityDate")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_JournalEntries_TransactionDate" '
+                       'ON "JournalEntries" ("TransactionDate")')
+
+
+def _migration_003_portal_indexes(connection: sqlite3.Connection):
+    """Create the indexes recommended by the index advisor for the portal queries"""
+    for name, table, columns in PORTAL_INDEXES:
+        if not table_exists(connection, table):
+            continue
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})')
+
+
+# Cache invalidation counters bumped by triggers: name -> [(table, event)]
+CHANGE_VERSION_TRIGGERS = {
+    'Users': [('Users', 'INSERT'), ('Users', 'DELETE'), ('Users', 'UPDATE OF OrganizationId, Role, Name')],
+    'InvoiceParties': [('Invoices', 'DELETE'), ('Invoices', 'UPDATE OF SellerId, BuyerId')],
+}
+
+# Structural changes behind the exposure index (utilisation is followed through UtilizationLedger)
+LIMITS_VERSION_TRIGGERS = {
+    'Limits': [('Facilities', 'INSERT'), ('Facilities', 'DELETE'),
+               ('Facilities', 'UPDATE OF CreditLimitInfoId, Type, TotalLimit'),
+               ('CreditLimits', 'INSERT'), ('CreditLimits', 'DELETE'),
+               ('CreditLimits', 'UPDATE OF OrganizationId, MasterLimit, LastReviewDate'),
+               ('Organizations', 'DELETE'), ('Organizations', 'UPDATE OF Name')],
+}
+
+
+def _migration_004_change_versions(connection: sqlite3.Connection):
+    """Add the ChangeVersions table and the triggers that bump it"""
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS "ChangeVersions" (
+            "Name" TEXT NOT NULL CONSTRAINT "PK_ChangeVersions" PRIMARY KEY,
+            "Version" INTEGER NOT NULL
+        )
+    """)
+    _create_change_version_triggers(connection, CHANGE_VERSION_TRIGGERS)
+
+
+def _create_change_version_triggers(connection: sqlite3.Connection, counters: dict):
+    """Add ChangeVersions counters and the AFTER triggers that bump them"""
+    for name, events in counters.items():
+        connection.execute('INSERT OR IGNORE INTO "ChangeVersions" ("Name", "Version") VALUES (?, 0)', (name,))
+        for table, event in events:
+            trigger = f"TR_{table}_{event.split()[0].title()}_{name}"
+            connection.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS "{trigger}" AFTER {event} ON "{table}"
+                BEGIN
+                    UPDATE "ChangeVersions" SET "Version" = "Version" + 1 WHERE "Name" = '{name}';
+                END
+            """)
+
+
+def _migration_005_invoice_fingerprint(connection: sqlite3.Connection):
+    """Index invoice fingerprints and refuse exact duplicates on insert"""
+    # Not UNIQUE: databases in the field may already hold duplicates, and those must stay readable
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Invoices_Fingerprint" '
+                       'ON "Invoices" ("SellerId", "BuyerId", "InvoiceNumber", "Amount", "IssueDate")')
+    connection.execute("""
+        CREATE TRIGGER IF NOT EXISTS "TR_Invoices_Insert_RejectDuplicate" BEFORE INSERT ON "Invoices"
+        WHEN EXISTS (
+            SELECT 1 FROM "Invoices"
+            WHERE "SellerId" IS NEW."SellerId" AND "BuyerId" IS NEW."BuyerId"
+              AND "InvoiceNumber" = NEW."InvoiceNumber" AND "Amount" = NEW."Amount"
+              AND "IssueDate" = NEW."IssueDate"
+        )
+        BEGIN
+            SELECT RAISE(ABORT, 'Duplicate invoice: same seller, buyer, number, amount and issue date');
+        END
+    """)
+
+
+def _migration_006_invoice_status_codes(connection: sqlite3.Connection):
+    """Move invoices onto the invoice_states status codes"""
+    # The client portal stored New as 0
+    connection.execute('UPDATE "Invoices" SET "Status" = 1 WHERE "Status" = 0')
+    # The bank portal stored rejections as 5, which is also "Funding sent for seller
+    # approval"; only rejected invoices carry a reason and were never offered funding
+    connection.execute('UPDATE "Invoices" SET "Status" = 11 '
+                       'WHERE "Status" = 5 AND "RejectionReason" IS NOT NULL AND "FundingOfferDate" IS NULL')
+
+
+def _migration_007_utilization_ledger(connection: sqlite3.Connection):
+    """Append-only credit utilisation ledger and facility reservations"""
+    connection.execute('ALTER TABLE "Facilities" ADD COLUMN "ReservedAmount" INTEGER NOT NULL DEFAULT 0')
+    connection.execute("""
+        CREATE TABLE "UtilizationLedger" (
+            "Id" INTEGER NOT NULL CONSTRAINT "PK_UtilizationLedger" PRIMARY KEY AUTOINCREMENT,
+            "FacilityId" INTEGER NOT NULL,
+            "OrganizationId" INTEGER NOT NULL,
+            "InvoiceId" INTEGER NULL,
+            "Kind" TEXT NOT NULL,
+            "UtilizationDelta" INTEGER NOT NULL,
+            "ReservedDelta" INTEGER NOT NULL,
+            "CreatedDate" TEXT NOT NULL,
+            "UserId" INTEGER NULL,
+            CONSTRAINT "FK_UtilizationLedger_Facilities_FacilityId" FOREIGN KEY ("FacilityId") REFERENCES "Facilities" ("Id"),
+            CONSTRAINT "FK_UtilizationLedger_Invoices_InvoiceId" FOREIGN KEY ("InvoiceId") REFERENCES "Invoices" ("Id")
+        )
+    """)
+    connection.execute('CREATE INDEX "IX_UtilizationLedger_FacilityId" ON "UtilizationLedger" ("FacilityId")')
+    connection.execute('CREATE INDEX "IX_UtilizationLedger_InvoiceId" ON "UtilizationLedger" ("InvoiceId")')
+    for event in ('UPDATE', 'DELETE'):
+        connection.execute(f"""
+            CREATE TRIGGER "TR_UtilizationLedger_{event.title()}_AppendOnly" BEFORE {event} ON "UtilizationLedger"
+            BEGIN
+                SELECT RAISE(ABORT, 'UtilizationLedger is append-only');
+            END
+        """)
+    # Carry today's utilisation over, so the ledger totals match the facilities from the start
+    connection.execute("""
+        INSERT INTO "UtilizationLedger" ("FacilityId", "OrganizationId", "InvoiceId", "Kind",
+                                         "UtilizationDelta", "ReservedDelta", "CreatedDate", "UserId")
+        SELECT f."Id", COALESCE(cl."OrganizationId", 0), NULL, 'opening', f."CurrentUtilization", 0, ?, NULL
+        FROM "Facilities" f
+        LEFT JOIN "CreditLimits" cl ON f."CreditLimitInfoId" = cl."Id"
+        WHERE f."CurrentUtilization" != 0
+    """, (format_timestamp(),))
+
+
+def _migration_008_limits_version(connection: sqlite3.Connection):
+    """ChangeVersions counter for the in-memory exposure index"""
+    _create_change_version_triggers(connection, LIMITS_VERSION_TRIGGERS)
+
+
+def _migration_009_trial_balance_watermark(connection: sqlite3.Connection):
+    """Record the last journal line each trial balance snapshot includes"""
+    # NULL for trial balances written before: they cannot be rolled forward
+    connection.execute('ALTER TABLE "TrialBalances" ADD COLUMN "LastJournalLineId" INTEGER NULL')
+
+
+# Accounts.Balance is signed by the account's normal side: debits increase assets (Type 0)
+# and expenses (Type 4), credits increase everything else
+_NORMAL_SIGN = 'CASE WHEN "Type" IN (0, 4) THEN 1 ELSE -1 END'
+
+
+def _migration_010_account_running_balances(connection: sqlite3.Connection):
+    """Keep Accounts.Balance current with triggers on posted journal lines"""
+    posted_new = '(SELECT "Status" FROM "JournalEntries" WHERE "Id" = NEW."JournalEntryId") = 1'
+    posted_old = '(SELECT "Status" FROM "JournalEntries" WHERE "Id" = OLD."JournalEntryId") = 1'
+    apply_new = (f'UPDATE "Accounts" SET "Balance" = "Balance" + {_NORMAL_SIGN} * (NEW."DebitAmount" - NEW."CreditAmount") '
+                 f'WHERE "Id" = NEW."AccountId"')
+    reverse_old = (f'UPDATE "Accounts" SET "Balance" = "Balance" - {_NORMAL_SIGN} * (OLD."DebitAmount" - OLD."CreditAmount") '
+                   f'WHERE "Id" = OLD."AccountId"')
+
+    # Existing balances were never maintained; start from the posted lines
+    connection.execute(f"""
+        UPDATE "Accounts" SET "Balance" = {_NORMAL_SIGN} * COALESCE((
+            SELECT SUM(l."DebitAmount" - l."CreditAmount")
+            FROM "JournalEntryLines" l
+            JOIN "JournalEntries" je ON je."Id" = l."JournalEntryId"
+            WHERE l."AccountId" = "Accounts"."Id" AND je."Status" = 1
+        ), 0)
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER "TR_JournalEntryLines_Insert_Balance" AFTER INSERT ON "JournalEntryLines"
+        WHEN {posted_new}
+        BEGIN
+            {apply_new};
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER "TR_JournalEntryLines_Delete_Balance" AFTER DELETE ON "JournalEntryLines"
+        WHEN {posted_old}
+        BEGIN
+            {reverse_old};
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER "TR_JournalEntryLines_Update_Balance"
+        AFTER UPDATE OF "JournalEntryId", "AccountId", "DebitAmount", "CreditAmount" ON "JournalEntryLines"
+        BEGIN
+            {reverse_old} AND {posted_old};
+            {apply_new} AND {posted_new};
+        END
+    """)
+    # Posting or un-posting a whole entry moves all of its lines at once
+    for event, row, sign, when in (
+            ('UPDATE OF "Status"', 'NEW', '(CASE WHEN NEW."Status" = 1 THEN 1 ELSE -1 END)',
+             '(OLD."Status" = 1) != (NEW."Status" = 1)'),
+            ('DELETE', 'OLD', '-1', 'OLD."Status" = 1')):
+        connection.execute(f"""
+            CREATE TRIGGER "TR_JournalEntries_{event.split()[0].title()}_Balance" AFTER {event} ON "JournalEntries"
+            WHEN {when}
+            BEGIN
+                UPDATE "Accounts" SET "Balance" = "Balance" + {sign} * {_NORMAL_SIGN} * (
+                    SELECT COALESCE(SUM("DebitAmount" - "CreditAmount"), 0)
+                    FROM "JournalEntryLines"
+                    WHERE "JournalEntryId" = {row}."Id" AND "AccountId" = "Accounts"."Id"
+                )
+                WHERE "Id" IN (SELECT "AccountId" FROM "JournalEntryLines" WHERE "JournalEntryId" = {row}."Id");
+            END
+        """)
+
+
+# Statement effect of a transaction (as transaction_service.SIGNED_AMOUNT_SQL):
+# funding (1) and fees (3) are debits, payments (2) credits
+def _statement_amount(row: str) -> str:
+    return (f'(CASE WHEN {row}."Type" IN (1, 3) THEN -{row}."Amount" '
+            f'WHEN {row}."Type" = 2 THEN {row}."Amount" ELSE 0 END)')
+
+
+def _migration_011_balance_snapshots(connection: sqlite3.Connection):
+    """Per-organization statement balance snapshots kept correct by triggers on Transactions"""
+    # A snapshot date D is complete for every organization: its balance is the sum of the
+    # transactions dated before D, and an organization without a row at D has balance 0
+    connection.execute("""
+        CREATE TABLE "BalanceSnapshotDates" (
+            "AsOfDate" TEXT NOT NULL CONSTRAINT "PK_BalanceSnapshotDates" PRIMARY KEY,
+            "Period" TEXT NOT NULL,
+            "CreatedDate" TEXT NOT NULL
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE "BalanceSnapshots" (
+            "OrganizationId" INTEGER NOT NULL,
+            "AsOfDate" TEXT NOT NULL,
+            "Balance" INTEGER NOT NULL,
+            CONSTRAINT "PK_BalanceSnapshots" PRIMARY KEY ("OrganizationId", "AsOfDate")
+        ) WITHOUT ROWID
+    """)
+    connection.execute('CREATE INDEX "IX_BalanceSnapshots_AsOfDate" ON "BalanceSnapshots" ("AsOfDate")')
+    # Snapshot jobs and bank-wide statement runs sum the transactions since the last snapshot
+    connection.execute('CREATE INDEX IF NOT EXISTS "IX_Transactions_TransactionDate" ON "Transactions" ("TransactionDate")')
+
+    # A transaction dated before existing snapshots (back-dated, corrected or deleted)
+    # moves the balance of every later snapshot of its organization. Dates compare as
+    # text: '2025-06-01' sorts before '2025-06-01 00:00:00', so "AsOfDate > TransactionDate"
+    # selects the snapshots the transaction falls before.
+    add_new = f"""
+        INSERT INTO "BalanceSnapshots" ("OrganizationId", "AsOfDate", "Balance")
+        SELECT NEW."OrganizationId", d."AsOfDate", {_statement_amount('NEW')}
+        FROM "BalanceSnapshotDates" d
+        WHERE d."AsOfDate" > NEW."TransactionDate"
+        ON CONFLICT ("OrganizationId", "AsOfDate") DO UPDATE SET "Balance" = "Balance" + excluded."Balance"
+    """
+    remove_old = f"""
+        UPDATE "BalanceSnapshots" SET "Balance" = "Balance" - {_statement_amount('OLD')}
+        WHERE "OrganizationId" = OLD."OrganizationId" AND "AsOfDate" > OLD."TransactionDate"
+    """
+    connection.execute(f"""
+        CREATE TRIGGER "TR_Transactions_Insert_BalanceSnapshots" AFTER INSERT ON "Transactions"
+        BEGIN
+            {add_new};
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER "TR_Transactions_Delete_BalanceSnapshots" AFTER DELETE ON "Transactions"
+        BEGIN
+            {remove_old};
+        END
+    """)
+    connection.execute(f"""
+        CREATE TRIGGER "TR_Transactions_Update_BalanceSnapshots"
+        AFTER UPDATE OF "Type", "Amount", "OrganizationId", "TransactionDate" ON "Transactions"
+        BEGIN
+            {remove_old};
+            {add_new};
+        END
+    """)
+
+
+def _migration_012_transaction_versions(connection: sqlite3.Connection):
+    """Per-organization change counters on Transactions for the statement cache"""
+    # An organization without a row has version 0
+    connection.execute("""
+        CREATE TABLE "TransactionVersions" (
+            "OrganizationId" INTEGER NOT NULL CONSTRAINT "PK_TransactionVersions" PRIMARY KEY,
+            "Version" INTEGER NOT NULL
+        )
+    """)
+
+    def bump(row: str) -> str:
+        return f"""
+            INSERT INTO "TransactionVersions" ("OrganizationId", "Version") VALUES ({row}."OrganizationId", 1)
+            ON CONFLICT ("OrganizationId") DO UPDATE SET "Version" = "Version" + 1
+        """
+
+    # Any column can appear on a statement, so every update counts
+    for event, statements in (('INSERT', [bump('NEW')]), ('DELETE', [bump('OLD')]),
+                              ('UPDATE', [bump('OLD'), bump('NEW')])):
+        body = "".join(f"{statement};" for statement in statements)
+        connection.execute(f"""
+            CREATE TRIGGER "TR_Transactions_{event.title()}_TransactionVersions" AFTER {event} ON "Transactions"
+            BEGIN
+                {body}
+            END
+        """)
+
+
+# (version, description, function) in the order they must run
+MIGRATIONS = [
+    (1, "Money columns as INTEGER minor units", _migration_001_money_minor_units),
+    (2, "Dates as ISO-8601 text with range indexes", _migration_002_iso_dates),
+    (3, "Indexes for the catalogued portal queries", _migration_003_portal_indexes),
+    (4, "ChangeVersions counters for cache invalidation", _migration_004_change_versions),
+    (5, "Invoice fingerprint index and duplicate guard", _migration_005_invoice_fingerprint),
+    (6, "Invoice status codes shared by both portals", _migration_006_invoice_status_codes),
+    (7, "Credit utilisation ledger with reservations", _migration_007_utilization_ledger),
+    (8, "Limits change counter for the exposure index", _migration_008_limits_version),
+    (9, "Journal line watermark on trial balance snapshots", _migration_009_trial_balance_watermark),
+    (10, "Running account balances maintained on journal posting", _migration_010_account_running_balances),
+    (11, "Statement balance snapshots per organization", _migration_011_balance_snapshots),
+    (12, "Transaction change counters per organization", _migration_012_transaction_versions),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(connection: sqlite3.Connection, target_version: int = None, verbose: bool = False) -> int:
+    """
+    Apply pending migrations up to target_version (default: latest).
+
+    Returns:
+        The schema version after migrating
+    """
+    target_version = LATEST_VERSION if target_version is None else target_version
+    current = get_schema_version(connection)
+
+    for version, description, apply in MIGRATIONS:
+        if version <= current or version > target_version:
+            continue
+        if connection.in_transaction:
+            connection.commit()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if get_schema_version(connection) >= version:
+                connection.rollback()
+                current = get_schema_version(connection)
+                continue
+            apply(connection)
+            connection.execute(f"PRAGMA user_version = {version}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        current = version
+        if verbose:
+            print(f"Applied migration {version:03d}: {description}")
+
+    return current
+
+
+def migration_status(connection: sqlite3.Connection) -> list:
+    """Return (version, description, applied) for every known migration"""
+    current = get_schema_version(connection)
+    return [(version, description, version <= current) for version, description, _ in MIGRATIONS]
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    # Add the parent directory to the path to import our modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from src.database import resolve_db_path
+
+    connection = sqlite3.connect(resolve_db_path("supply_chain_finance.db"))
+    print(f"Schema version before: {get_schema_version(connection)}")
+    version = migrate(connection, verbose=True)
+    print(f"Schema version now: {version} (latest {LATEST_VERSION})")
+    for version, description, applied in migration_status(connection):
+        print(f"  {version:03d} {'applied' if applied else 'pending'}  {description}")
+    connection.close()
@@ -0,0 +1,175 @@
+"""
+Invoice stakeholder resolution for the Supply Chain Finance Management System
+
+Resolves the seller/buyer organizations of an invoice and each organization's
+primary user (the first Role = 2 user), which the portals notify about invoice
+events. Results are cached across calls and checked against the ChangeVersions
+counters, so a change to Users or to an invoice's parties in any process is
+picked up on the next lookup. Inside operation() each invoice is resolved at
+most once, however many steps of the operation ask for it.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from src.database import Database
+
+# Users.Role of the user who receives an organization's invoice notifications
+PRIMARY_USER_ROLE = 2
+
+# Ids per IN (...) list, well below SQLite's host parameter limit
+QUERY_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = QUERY_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class StakeholderResolver:
+    """Cached invoice -> stakeholders lookups"""
+
+    def __init__(self, db_name: str = "supply_chain_finance.db", max_invoices: int = 10000):
+        self.db_name = db_name
+        self.max_invoices = max_invoices
+        self._lock = threading.Lock()
+        self._versions = None                # ChangeVersions snapshot the caches were filled under
+        self._org_users = {}                 # org_id -> (user_id, user_name) or None
+        self._invoice_parties = OrderedDict()  # invoice_id -> (seller_org_id, buyer_org_id, invoice_number), LRU
+        self._local = threading.local()      # per-thread operation memo
+
+    @contextmanager
+    def operation(self):
+        """
+        Scope one business operation (e.g. funding an invoice).
+
+        Stakeholders are resolved at most once per invoice inside the block and
+        the change counters are read only once. Operations may nest.
+        """
+        memo = getattr(self._local, 'memo', None)
+        if memo is not None:
+            yield self
+            return
+        self._local.memo = {}
+        try:
+            yield self
+        finally:
+            self._local.memo = None
+
+    def invalidate(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._versions = None
+            self._org_users.clear()
+            self._invoice_parties.clear()
+        memo = getattr(self._local, 'memo', None)
+        if memo is not None:
+            memo.clear()
+
+    def resolve(self, invoice_id: int) -> dict:
+        """Return the stakeholders of one invoice ({} if the invoice does not exist)"""
+        return self.resolve_many([invoice_id]).get(invoice_id, {})
+
+    def resolve_many(self, invoice_ids) -> dict:
+        """Return {invoice_id: stakeholders} for several invoices using at most two queries"""
+        memo = getattr(self._local, 'memo', None)
+        wanted = [i for i in dict.fromkeys(invoice_ids) if i is not None]
+        if memo is not None:
+            missing = [i for i in wanted if i not in memo]
+            if missing:
+                memo.update(self._load(missing))
+            return {i: memo[i] for i in wanted if memo[i]}
+        return {i: result for i, result in self._load(wanted).items() if result}
+
+    def _load(self, invoice_ids: list) -> dict:
+        """Resolve invoices through the shared caches, refreshing them if the database changed"""
+        if not invoice_ids:
+            return {}
+        with Database(self.db_name) as db:
+            self._check_versions(db)
+
+            with self._lock:
+                parties = {i: self._invoice_parties.get(i) for i in invoice_ids}
+                for invoice_id, value in parties.items():
+                    if value is not None:
+                        self._invoice_parties.move_to_end(invoice_id)
+            missing = [i for i, value in parties.items() if value is None]
+            if missing:
+                loaded = {}
+                for chunk in _chunks(missing):
+                    db.cursor.execute(
+                        f"SELECT Id, SellerId, BuyerId, InvoiceNumber FROM Invoices WHERE Id IN ({','.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    loaded.update((row[0], (row[1], row[2], row[3])) for row in db.cursor.fetchall())
+                with self._lock:
+                    for invoice_id, value in loaded.items():
+                        self._invoice_parties[invoice_id] = value
+                    while len(self._invoice_parties) > self.max_invoices:
+                        self._invoice_parties.popitem(last=False)
+                parties.update(loaded)
+
+            org_ids = {org_id for value in parties.values() if value for org_id in value[:2] if org_id}
+            users = self._primary_users(db, org_ids)
+
+        results = {}
+        for invoice_id in invoice_ids:
+            value = parties.get(invoice_id)
+            if not value:
+                results[invoice_id] = {}
+                continue
+            seller_org_id, buyer_org_id, invoice_number = value
+            seller_user = users.get(seller_org_id) or (None, None)
+            buyer_user = users.get(buyer_org_id) or (None, None)
+            results[invoice_id] = {
+                'seller_org_id': seller_org_id,
+                'buyer_org_id': buyer_org_id,
+                'invoice_number': invoice_number,
+                'seller_user_id': seller_user[0],
+                'buyer_user_id': buyer_user[0],
+                'seller_name': seller_user[1],
+                'buyer_name': buyer_user[1]
+            }
+        return results
+
+    def _primary_users(self, db: Database, org_ids: set) -> dict:
+        """Return {org_id: (user_id, name) or None}, loading uncached organizations in one query"""
+        with self._lock:
+            missing = [org_id for org_id in org_ids if org_id not in self._org_users]
+        if missing:
+            loaded = dict.fromkeys(missing)
+            for chunk in _chunks(missing):
+                db.cursor.execute(
+                    f"""
+                    SELECT OrganizationId, Id, Name
+                    FROM Users
+                    WHERE OrganizationId IN ({','.join('?' * len(chunk))}) AND Role = ?
+                    ORDER BY OrganizationId, Id
+                    """,
+                    (*chunk, PRIMARY_USER_ROLE)
+                )
+                for org_id, user_id, name in db.cursor.fetchall():
+                    if loaded[org_id] is None:
+                        loaded[org_id] = (user_id, name)
+            with self._lock:
+                self._org_users.update(loaded)
+        with self._lock:
+            return {org_id: self._org_users.get(org_id) for org_id in org_ids}
+
+    def _check_versions(self, db: Database):
+        """Clear the caches whose ChangeVersions counter moved since they were filled"""
+        versions = db.change_versions()
+        with self._lock:
+            previous = self._versions
+            self._versions = versions
+            if previous is None or not versions:
+                # First use, or a schema without change counters: nothing can be trusted
+                self._org_users.clear()
+                self._invoice_parties.clear()
+                return
+            if versions.get('Users') != previous.get('Users'):
+                self._org_users.clear()
+            if versions.get('InvoiceParties') != previous.get('InvoiceParties'):
+                self._invoice_parties.clear()
+
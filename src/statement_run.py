@@ -0,0 +1,192 @@
+"""
+Bank-wide statement run for the Supply Chain Finance Management System
+
+Generates the account statement of every customer organization for one
+period and writes one text file per organization:
+
+- Opening balances for all organizations come from the nearest balance
+  snapshot plus one grouped query in the parent
+  (TransactionService.balances_before), so workers only read their
+  organizations' transactions for the period.
+- Organizations are sent in chunks to a process pool; each worker keeps its
+  own TransactionService (and database connection) for the whole run.
+- Each file is written to a temporary name and renamed, and completed
+  organizations are appended to a checkpoint file as chunks finish. Running
+  the same period again skips what is already done, so an interrupted run
+  restarts where it stopped; pass restart=True (--restart) to start over.
+
+Workers are started with "spawn" so none inherits the parent's pooled SQLite
+connections.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+if __package__:
+    from .database import parse_date
+    from .transaction_service import TransactionService
+else:
+    from database import parse_date
+    from transaction_service import TransactionService
+
+# Default output directory, relative to the working directory
+STATEMENT_DIR = "statements"
+
+# Organizations per pool task
+CHUNK_SIZE = 50
+
+
+def statement_path(out_dir: str, organization_id: int, start_date: datetime, end_date: datetime) -> str:
+    return os.path.join(out_dir, f"statement_{organization_id:06d}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.txt")
+
+
+def checkpoint_path(out_dir: str, start_date: datetime, end_date: datetime) -> str:
+    return os.path.join(out_dir, f"statement_run_{start_date:%Y%m%d}_{end_date:%Y%m%d}.checkpoint")
+
+
+def load_checkpoint(path: str) -> set:
+    """Organization ids already written for the period"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {int(line) for line in f if line.strip().isdigit()}
+
+
+def previous_month() -> tuple:
+    """(first day 00:00, last day 23:59:59) of last month"""
+    first_of_this_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end = first_of_this_month - timedelta(seconds=1)
+    return end.replace(day=1, hour=0, minute=0, second=0), end
+
+
+# Worker process state, set by _init_worker
+_service = None
+
+
+def _init_worker(db_name: str):
+    global _service
+    _service = TransactionService(db_name=db_name)
+
+
+def _run_chunk(chunk: list, start_date: datetime, end_date: datetime, out_dir: str) -> tuple:
+    """Write the statements of one chunk: returns (pid, written ids, [(id, error)], transactions, seconds)"""
+    started = time.perf_counter()
+    written, failed, transactions = [], [], 0
+    for organization_id, name, opening_minor in chunk:
+        try:
+            statement = _service.generate_account_statement(organization_id, start_date, end_date,
+                                                            opening_balance_minor=opening_minor)
+            statement.organization = SimpleNamespace(id=organization_id, name=name)
+            path = statement_path(out_dir, organization_id, start_date, end_date)
+            with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(_service.generate_statement_report(statement) + "\n")
+            os.replace(path + ".tmp", path)
+            written.append(organization_id)
+            transactions += len(statement.transactions)
+        except Exception as e:
+            failed.append((organization_id, str(e)))
+    return os.getpid(), written, failed, transactions, time.perf_counter() - started
+
+
+def run_statements(start_date, end_date, out_dir: str = STATEMENT_DIR, workers: int = None,
+                   db_name: str = "supply_chain_finance.db", chunk_size: int = CHUNK_SIZE,
+                   restart: bool = False) -> dict:
+    """
+    Write the statements of every customer organization for a period.
+
+    Returns {'organizations', 'skipped', 'written', 'failed': [(id, error)],
+    'transactions', 'seconds', 'workers': {pid: {'statements', 'transactions',
+    'seconds'}}}; 'skipped' counts organizations done by an earlier run.
+    """
+    start_date, end_date = parse_date(start_date), parse_date(end_date)
+    if start_date is None or end_date is None or end_date < start_date:
+        raise ValueError("A statement run needs a start date on or before its end date")
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = checkpoint_path(out_dir, start_date, end_date)
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_checkpoint(checkpoint)
+
+    service = TransactionService(db_name=db_name)
+    try:
+        service.db.cursor.execute("SELECT Id, Name FROM Organizations WHERE IsBank = 0 ORDER BY Id")
+        organizations = service.db.cursor.fetchall()
+        openings = service.balances_before(start_date)
+    finally:
+        service.db.close()
+
+    pending = [(organization_id, name, openings.get(organization_id, 0))
+               for organization_id, name in organizations if organization_id not in done]
+    result = {'organizations': len(organizations), 'skipped': len(organizations) - len(pending),
+              'written': 0, 'failed': [], 'transactions': 0, 'seconds': 0.0, 'workers': {}}
+    if not pending:
+        return result
+
+    started = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, -(-len(pending) // chunk_size)))
+    with open(checkpoint, 'a', encoding='utf-8') as log, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                initializer=_init_worker, initargs=(db_name,)) as pool:
+        futures = [pool.submit(_run_chunk, pending[i:i + chunk_size], start_date, end_date, out_dir)
+                   for i in range(0, len(pending), chunk_size)]
+        for future in as_completed(futures):
+            pid, written, failed, transactions, seconds = future.result()
+            log.write("".join(f"{organization_id}\n" for organization_id in written))
+            log.flush()
+            stats = result['workers'].setdefault(pid, {'statements': 0, 'transactions': 0, 'seconds': 0.0})
+            stats['statements'] += len(written)
+            stats['transactions'] += transactions
+            stats['seconds'] += seconds
+            result['written'] += len(written)
+            result['transactions'] += transactions
+            result['failed'].extend(failed)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def print_summary(result: dict):
+    print(f"Organizations: {result['organizations']:,} ({result['skipped']:,} already done)")
+    print(f"Statements written: {result['written']:,} with {result['transactions']:,} transactions "
+          f"in {result['seconds']:.2f}s")
+    for pid, stats in sorted(result['workers'].items()):
+        rate = stats['statements'] / stats['seconds'] if stats['seconds'] else 0.0
+        print(f"  worker {pid}: {stats['statements']:,} statements, {stats['transactions']:,} transactions, "
+              f"{stats['seconds']:.2f}s busy, {rate:,.1f} statements/s")
+    for organization_id, error in result['failed']:
+        print(f"  Error for organization {organization_id}: {error}")
+
+
+def main(argv=None):
+    import argparse
+
+    default_start, default_end = previous_month()
+    parser = argparse.ArgumentParser(description="Generate account statements for every customer organization")
+    parser.add_argument("--from", dest="start", default=default_start.strftime('%Y-%m-%d'),
+                        help="period start (default: first day of last month)")
+    parser.add_argument("--to", dest="end", default=default_end.strftime('%Y-%m-%d %H:%M:%S'),
+                        help="period end, inclusive (default: end of last month)")
+    parser.add_argument("--output", default=STATEMENT_DIR, help="output directory")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and regenerate everything")
+    parser.add_argument("--db", default="supply_chain_finance.db", help="database file")
+    args = parser.parse_args(argv)
+
+    try:
+        end = parse_date(args.end)
+        if len(args.end.strip()) == 10:
+            # A plain date ends the period at the end of that day
+            end = end.replace(hour=23, minute=59, second=59)
+        result = run_statements(args.start, end, args.output, args.workers, args.db, restart=args.restart)
+    except ValueError as e:
+        print(f"Error running statements: {e}")
+        return 1
+    print_summary(result)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
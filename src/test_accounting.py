@@ -4,7 +4,8 @@ Test script to verify accounting entries are being created properly
 """
 
 import sqlite3
-from database import Database
+from database import Database, from_minor
+import invoice_states
 
 def test_accounting_entries():
     """Test if accounting entries are being created"""
@@ -55,7 +56,7 @@ def test_accounting_entries():
         db.cursor.execute("""
             SELECT AccountCode, AccountName, Balance 
             FROM Accounts 
-            WHERE CAST(Balance AS REAL) != 0 
+            WHERE Balance != 0 
             ORDER BY AccountCode
         """)
         accounts_with_balance = db.cursor.fetchall()
@@ -63,7 +64,7 @@ def test_accounting_entries():
         if accounts_with_balance:
             print("   Accounts with Non-Zero Balances:")
             for account in accounts_with_balance:
-                balance = float(account[2]) if account[2] else 0.0
+                balance = from_minor(account[2])
                 print(f"   {account[0]} - {account[1]}: ${balance:,.2f}")
         else:
             print("   No accounts with non-zero balances found.")
@@ -85,7 +86,7 @@ def test_accounting_entries():
             for txn in recent_txns:
                 type_names = {1: "Funding", 2: "Payment", 3: "Fee", 4: "Interest"}
                 txn_type = type_names.get(txn[4], f"Type {txn[4]}")
-                print(f"   ID: {txn[0]}, Invoice: {txn[1]}, Amount: ${float(txn[2]):,.2f}, Type: {txn_type}")
+                print(f"   ID: {txn[0]}, Invoice: {txn[1]}, Amount: ${from_minor(txn[2]):,.2f}, Type: {txn_type}")
         
         # Check invoices by status
         print("\n5. Invoice Status Summary:")
@@ -97,20 +98,9 @@ def test_accounting_entries():
         """)
         status_summary = db.cursor.fetchall()
         
-        status_names = {
-            0: "Uploaded",
-            1: "Validated", 
-            2: "Approved",
-            3: "Funded",
-            4: "Paid",
-            5: "Rejected",
-            6: "Matured",
-            7: "Discount_Approved"
-        }
-        
         for status, count in status_summary:
-            status_name = status_names.get(status, f"Unknown ({status})")
-            print(f"   {status_name}: {count}")
+            name = invoice_states.STATUS_NAMES.get(status, f"Unknown ({status})")
+            print(f"   {name}: {count}")
         
         db.close()
         
@@ -134,7 +124,7 @@ def simulate_invoice_validation():
         app.current_organization = {'id': 1, 'name': 'Supply Chain Finance Bank'}
         
         # Get an uploaded invoice to validate
-        uploaded_invoices = app.get_real_invoices_by_status(0)  # Status 0 = Uploaded
+        uploaded_invoices = app.get_real_invoices_by_status(invoice_states.NEW)
         
         if uploaded_invoices:
             invoice = uploaded_invoices[0]
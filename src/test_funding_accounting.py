@@ -3,8 +3,9 @@
 Test funding accounting entries
 """
 
-from database import Database
+from database import Database, from_minor
 from bankportal import BankApplication
+import invoice_states
 
 def test_funding_accounting():
     """Test funding accounting entry creation"""
@@ -19,16 +20,16 @@ def test_funding_accounting():
         app.current_user = {'id': 1, 'name': 'Bank Admin'}
         app.current_organization = {'id': 1, 'name': 'Supply Chain Finance Bank'}
 
-        # First try to get a validated invoice to fund (Status 1 = Validated)
-        validated_invoices = app.get_real_invoices_by_status(1)
+        # First try to get a validated invoice to fund
+        validated_invoices = app.get_real_invoices_by_status(invoice_states.VALIDATED)
         
         # Initialize invoice
         invoice = None
         
         if not validated_invoices:
             print("No validated invoices found, trying to use a non-validated invoice...")
-            # Try to use a new invoice (Status 0 = New) and validate it first
-            new_invoices = app.get_real_invoices_by_status(0)
+            # Try to use a new invoice and validate it first
+            new_invoices = app.get_real_invoices_by_status(invoice_states.NEW)
             
             if not new_invoices:
                 print("No invoices found to test with.")
@@ -39,10 +40,10 @@ def test_funding_accounting():
             
             # Validate the invoice first
             print("Validating invoice before funding...")
-            if app.update_invoice_status(invoice['id'], 1):
+            if app.update_invoice_status(invoice['id'], 'validate'):
                 print(f"Successfully validated invoice {invoice['number']}")
                 # Refresh invoice data to ensure we have the updated status
-                validated_invoices = app.get_real_invoices_by_status(1)
+                validated_invoices = app.get_real_invoices_by_status(invoice_states.VALIDATED)
                 for inv in validated_invoices:
                     if inv['number'] == invoice['number']:
                         invoice = inv
@@ -108,14 +109,14 @@ def test_funding_accounting():
             db.cursor.execute("""
                 SELECT AccountCode, AccountName, Balance 
                 FROM Accounts 
-                WHERE CAST(Balance AS REAL) != 0 
+                WHERE Balance != 0 
                 ORDER BY AccountCode
             """)
             accounts = db.cursor.fetchall()
 
             print("\nUpdated Account Balances:")
             for account in accounts:
-                balance = float(account[2]) if account[2] else 0.0
+                balance = from_minor(account[2])
                 print(f"   {account[0]} - {account[1]}: ${balance:,.2f}")
         finally:
             db.close()
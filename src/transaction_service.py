@@ -1,9 +1,18 @@
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from collections import OrderedDict
+import sqlite3
+import sys
+import threading
+import time
 import uuid
-from database import Database
+
+if __package__:
+    from .database import Database, to_minor, from_minor, parse_date, format_date, format_timestamp
+else:
+    from database import Database, to_minor, from_minor, parse_date, format_date, format_timestamp
 
 class TransactionType(Enum):
     INVOICE_FUNDING = "invoice_funding"
@@ -12,12 +21,38 @@ class TransactionType(Enum):
     TREASURY_FUNDING = "treasury_funding"
     INVOICE_UPLOAD = "invoice_upload"
     LIMIT_ADJUSTMENT = "limit_adjustment"
+    INTEREST = "interest"
+    UNKNOWN = "unknown"  # A stored Type code outside TRANSACTION_TYPE_CODES
 
 class FacilityType(Enum):
     INVOICE_FINANCING = "invoice_financing"
     TRADE_FINANCE = "trade_finance"
     WORKING_CAPITAL = "working_capital"
     TERM_LOAN = "term_loan"
+    SUPPLY_CHAIN_FINANCE = "supply_chain_finance"
+    UNKNOWN = "unknown"  # A stored FacilityType code outside FACILITY_TYPE_CODES
+
+# Transactions.Type codes as the portals store them (1 Funding, 2 Payment, 3 Fee, 4 Interest)
+TRANSACTION_TYPE_CODES = {
+    TransactionType.INVOICE_FUNDING: 1,
+    TransactionType.PAYMENT: 2,
+    TransactionType.FEE_CHARGE: 3,
+    TransactionType.INTEREST: 4,
+    TransactionType.TREASURY_FUNDING: 5,
+    TransactionType.INVOICE_UPLOAD: 6,
+    TransactionType.LIMIT_ADJUSTMENT: 7,
+}
+TRANSACTION_TYPES = {code: transaction_type for transaction_type, code in TRANSACTION_TYPE_CODES.items()}
+
+# Transactions.FacilityType codes, as Facilities.Type (exposure_index.FACILITY_TYPE_NAMES);
+# term loans have no facility type, so they cannot be recorded
+FACILITY_TYPE_CODES = {
+    FacilityType.INVOICE_FINANCING: 0,
+    FacilityType.TRADE_FINANCE: 1,
+    FacilityType.WORKING_CAPITAL: 2,
+    FacilityType.SUPPLY_CHAIN_FINANCE: 3,
+}
+FACILITY_TYPES = {code: facility_type for facility_type, code in FACILITY_TYPE_CODES.items()}
 
 @dataclass
 class Transaction:
@@ -73,9 +108,120 @@ class ServiceResult:
     def failed(message: str):
         return ServiceResult(False, message)
 
+# Statement effect of a transaction in minor units: funding and fees are debits, payments credits
+# (the migration 011 balance snapshot triggers apply the same rule)
+SIGNED_AMOUNT_SQL = (
+    f"CASE WHEN Type IN ({TRANSACTION_TYPE_CODES[TransactionType.INVOICE_FUNDING]}, "
+    f"{TRANSACTION_TYPE_CODES[TransactionType.FEE_CHARGE]}) THEN -Amount "
+    f"WHEN Type = {TRANSACTION_TYPE_CODES[TransactionType.PAYMENT]} THEN Amount ELSE 0 END"
+)
+
+_TRANSACTION_COLUMNS = '''
+    Id, Type, FacilityType, OrganizationId, InvoiceId, Description, Amount,
+    TransactionDate, MaturityDate, IsPaid, PaymentDate, InterestOrDiscountRate
+'''
+
+_INSERT_TRANSACTION_SQL = '''
+    INSERT INTO Transactions (Id, Type, FacilityType, OrganizationId, InvoiceId, Description, Amount,
+                              InterestOrDiscountRate, TransactionDate, MaturityDate, IsPaid, PaymentDate)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Statement cache limits: entries, seconds an entry is served, estimated bytes held
+STATEMENT_CACHE_ENTRIES = 256
+STATEMENT_CACHE_TTL = 300
+STATEMENT_CACHE_BYTES = 32 * 1024 * 1024
+
+def _statement_size(statement: AccountStatement) -> int:
+    """Rough size in bytes of a statement and its transactions"""
+    size = sys.getsizeof(statement) + sys.getsizeof(vars(statement)) + sys.getsizeof(statement.transactions)
+    for transaction in statement.transactions:
+        size += sys.getsizeof(transaction) + sum(map(sys.getsizeof, vars(transaction).values()))
+    return size
+
+class StatementCache:
+    """
+    Generated statements keyed by (organization, start, end, data version)
+    
+    Least recently used entries are evicted beyond max_entries or max_bytes,
+    and entries older than ttl seconds are not served. The data version is the
+    organization's TransactionVersions counter, so a statement is never served
+    after its transactions change, in this process or another.
+    """
+    
+    def __init__(self, max_entries: int = STATEMENT_CACHE_ENTRIES, ttl: float = STATEMENT_CACHE_TTL,
+                 max_bytes: int = STATEMENT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, size, statement), LRU
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key: tuple) -> Optional[AccountStatement]:
+        """The cached statement for a key, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, key: tuple, statement: AccountStatement):
+        """Cache a statement, replacing those of the same period under older data versions"""
+        size = _statement_size(statement)
+        with self._lock:
+            for other in [k for k in self._entries if k[:3] == key[:3]]:
+                self._remove(other)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, size, statement)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def invalidate(self, organization_id: int = None):
+        """Drop the statements of one organization (default: all)"""
+        with self._lock:
+            for key in [k for k in self._entries if organization_id is None or k[0] == organization_id]:
+                self._remove(key)
+    
+    def _remove(self, key: tuple):
+        self.bytes -= self._entries.pop(key)[1]
+
 class TransactionService:
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, accounting_service=None, db_name: str = "supply_chain_finance.db",
+                 statement_cache: StatementCache = None):
+        self.db = Database(db_name)
+        self._accounting_service = accounting_service
+        # Pass one cache to several services to share statements between them
+        self._statements = statement_cache if statement_cache is not None else StatementCache()
+        self._statement_count = 0
+
+    @staticmethod
+    def _insert_row(transaction: Transaction) -> tuple:
+        """Transactions row of a transaction, in _INSERT_TRANSACTION_SQL column order"""
+        if transaction.type not in TRANSACTION_TYPE_CODES:
+            raise ValueError(f"Transaction type {transaction.type.value} has no Transactions.Type code")
+        if transaction.facility_type not in FACILITY_TYPE_CODES:
+            raise ValueError(f"Facility type {transaction.facility_type.value} has no Facilities.Type code")
+        rate = transaction.interest_or_discount_rate
+        return (transaction.id, TRANSACTION_TYPE_CODES[transaction.type], FACILITY_TYPE_CODES[transaction.facility_type],
+                transaction.organization_id, transaction.invoice_id, transaction.description,
+                to_minor(transaction.amount), str(rate) if rate is not None else None,
+                format_timestamp(transaction.transaction_date), format_date(transaction.maturity_date),
+                1 if transaction.is_paid else 0,
+                format_timestamp(transaction.payment_date) if transaction.payment_date else None)
 
     def record_transaction(self, transaction: Transaction) -> Transaction:
         """
@@ -86,18 +232,52 @@ class TransactionService:
             
         Returns:
             The recorded transaction with assigned ID
+            
+        Raises:
+            ValueError: if the transaction or facility type has no stored code
         """
-        # Assign ID if not present
-        if transaction.id is None:
-            transaction.id = len(self.db.cursor.execute('SELECT * FROM transactions').fetchall()) + 1
+        # Without an id, Transactions.Id (AUTOINCREMENT) assigns one
+        with self.db.transaction():
+            self.db.cursor.execute(_INSERT_TRANSACTION_SQL, self._insert_row(transaction))
+            transaction.id = self.db.cursor.lastrowid
+        self._statements.invalidate(transaction.organization_id)
         
-        # Add to storage
-        self.db.cursor.execute('''
-            INSERT INTO transactions (id, type, facility_type, organization_id, invoice_id, description, amount, transaction_date, maturity_date, is_paid, payment_date, interest_or_discount_rate) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (transaction.id, transaction.type.value, transaction.facility_type.value, transaction.organization_id, transaction.invoice_id, transaction.description, transaction.amount, transaction.transaction_date.strftime('%Y-%m-%d %H:%M:%S'), transaction.maturity_date.strftime('%Y-%m-%d %H:%M:%S'), transaction.is_paid, transaction.payment_date.strftime('%Y-%m-%d %H:%M:%S') if transaction.payment_date else None, transaction.interest_or_discount_rate))
-        self.db.connection.commit()
+        self._create_accounting_entry(transaction)
+        return transaction
+    
+    def record_transactions(self, transactions: List[Transaction]) -> List[Transaction]:
+        """
+        Record a batch of transactions with one executemany and a single commit
         
+        Ids are reserved as one block while the write lock is held, so they are
+        known before the insert and the accounting entries can follow.
+        
+        Args:
+            transactions: Transaction objects to record
+            
+        Returns:
+            The recorded transactions with assigned IDs
+        """
+        if not transactions:
+            return []
+        
+        with self.db.transaction():
+            next_id = self.db.next_id('Transactions')
+            for transaction in transactions:
+                if transaction.id is None:
+                    transaction.id = next_id
+                    next_id += 1
+            self.db.cursor.executemany(_INSERT_TRANSACTION_SQL, [self._insert_row(t) for t in transactions])
+        for organization_id in {t.organization_id for t in transactions}:
+            self._statements.invalidate(organization_id)
+        
+        if self._accounting_service:
+            for transaction in transactions:
+                self._create_accounting_entry(transaction)
+        return transactions
+    
+    def _create_accounting_entry(self, transaction: Transaction):
+        """Create (and post) the journal entry for a recorded transaction"""
         # Create accounting entries based on transaction type
         try:
             journal_entry = None
@@ -133,8 +313,6 @@ class TransactionService:
         except Exception as ex:
             # Log the error but don't fail the transaction
             print(f"Warning: Failed to create accounting entry for transaction {transaction.id}: {ex}")
-        
-        return transaction
     
     def get_transactions(self, organization_id: int) -> List[Transaction]:
         """
@@ -146,78 +324,137 @@ class TransactionService:
         Returns:
             List of transactions ordered by date (most recent first)
         """
-        self.db.cursor.execute('''
-            SELECT id, type, facility_type, organization_id, invoice_id, description, amount, transaction_date, maturity_date, is_paid, payment_date, interest_or_discount_rate FROM transactions
-            WHERE organization_id = ?
-            ORDER BY transaction_date DESC
+        self.db.cursor.execute(f'''
+            SELECT {_TRANSACTION_COLUMNS}
+            FROM Transactions
+            WHERE OrganizationId = ?
+            ORDER BY TransactionDate DESC
         ''', (organization_id,))
-        rows = self.db.cursor.fetchall()
-        transactions = []
-        for row in rows:
-            transactions.append(Transaction(
-                id=row[0],
-                type=TransactionType(row[1]),
-                facility_type=FacilityType(row[2]),
-                organization_id=row[3],
-                invoice_id=row[4],
-                description=row[5],
-                amount=row[6],
-                transaction_date=datetime.strptime(row[7], '%Y-%m-%d %H:%M:%S'),
-                maturity_date=datetime.strptime(row[8], '%Y-%m-%d %H:%M:%S'),
-                is_paid=row[9],
-                payment_date=datetime.strptime(row[10], '%Y-%m-%d %H:%M:%S') if row[10] else None,
-                interest_or_discount_rate=row[11]
-            ))
-        return transactions
+        return [self._transaction(row) for row in self.db.cursor.fetchall()]
+    
+    @staticmethod
+    def _transaction(row) -> Transaction:
+        """Transaction from a row selected with _TRANSACTION_COLUMNS"""
+        return Transaction(
+            id=row[0],
+            type=TRANSACTION_TYPES.get(row[1], TransactionType.UNKNOWN),
+            facility_type=FACILITY_TYPES.get(row[2], FacilityType.UNKNOWN),
+            organization_id=row[3],
+            invoice_id=row[4],
+            description=row[5],
+            amount=from_minor(row[6]),
+            transaction_date=parse_date(row[7]),
+            maturity_date=parse_date(row[8]),
+            is_paid=bool(row[9]),
+            payment_date=parse_date(row[10]),
+            interest_or_discount_rate=float(row[11]) if row[11] not in (None, '') else None
+        )
+    
+    def snapshot_date(self, before: datetime) -> Optional[str]:
+        """Latest balance snapshot date (BalanceSnapshotDates, migration 011) on or before 'before', or None"""
+        self.db.cursor.execute('''
+            SELECT MAX(AsOfDate) FROM BalanceSnapshotDates WHERE AsOfDate <= ?
+        ''', (format_timestamp(before),))
+        return self.db.cursor.fetchone()[0]
+    
+    def _balance_before(self, organization_id: int, before: datetime) -> int:
+        """
+        Statement balance in minor units of every transaction dated before 'before'
+        
+        The nearest snapshot plus the transactions dated since it, so the cost
+        follows the time since the last snapshot, not the organization's history.
+        """
+        snapshot_date = self.snapshot_date(before) or ''
+        self.db.cursor.execute(f'''
+            SELECT COALESCE((SELECT Balance FROM BalanceSnapshots WHERE OrganizationId = ? AND AsOfDate = ?), 0)
+                 + COALESCE((SELECT SUM({SIGNED_AMOUNT_SQL}) FROM Transactions
+                             WHERE OrganizationId = ? AND TransactionDate >= ? AND TransactionDate < ?), 0)
+        ''', (organization_id, snapshot_date, organization_id, snapshot_date, format_timestamp(before)))
+        return self.db.cursor.fetchone()[0]
+    
+    def balances_before(self, before: datetime) -> Dict[int, int]:
+        """Statement balance in minor units of every organization: the nearest snapshot plus one grouped query since it"""
+        snapshot_date = self.snapshot_date(before)
+        balances = {}
+        if snapshot_date:
+            self.db.cursor.execute('''
+                SELECT OrganizationId, Balance FROM BalanceSnapshots WHERE AsOfDate = ?
+            ''', (snapshot_date,))
+            balances = dict(self.db.cursor.fetchall())
+        self.db.cursor.execute(f'''
+            SELECT OrganizationId, SUM({SIGNED_AMOUNT_SQL})
+            FROM Transactions
+            WHERE TransactionDate >= ? AND TransactionDate < ?
+            GROUP BY OrganizationId
+        ''', (snapshot_date or '', format_timestamp(before)))
+        for organization_id, delta_minor in self.db.cursor.fetchall():
+            balances[organization_id] = balances.get(organization_id, 0) + (delta_minor or 0)
+        return balances
+    
+    def transaction_version(self, organization_id: int) -> Optional[int]:
+        """Change counter of an organization's transactions (TransactionVersions, migration 012); None before it"""
+        try:
+            self.db.cursor.execute('''
+                SELECT Version FROM TransactionVersions WHERE OrganizationId = ?
+            ''', (organization_id,))
+        except sqlite3.OperationalError:
+            return None
+        row = self.db.cursor.fetchone()
+        return row[0] if row else 0
     
     def generate_account_statement(self, organization_id: int, start_date: datetime, 
-                                 end_date: datetime) -> AccountStatement:
+                                 end_date: datetime, opening_balance_minor: int = None) -> AccountStatement:
         """
         Generate an account statement for a specific organization and date range
         
+        Repeat requests are served from the statement cache until the
+        organization's transactions change. Statements built from a given
+        opening balance (a statement run) are not cached.
+        
         Args:
             organization_id: ID of the organization
             start_date: Start date for the statement period
             end_date: End date for the statement period
+            opening_balance_minor: Opening balance in minor units when already known
+                (e.g. from balances_before() in a statement run)
             
         Returns:
             AccountStatement object with calculated balances
         """
-        # Get transactions in the date range
-        transactions = [
-            t for t in self.get_transactions(organization_id) 
-            if (t.organization_id == organization_id and 
-                start_date <= t.transaction_date <= end_date)
-        ]
-        transactions.sort(key=lambda x: x.transaction_date)
+        key = None
+        if opening_balance_minor is None:
+            # Read before the statement, so a change in between leaves the entry under an older version
+            version = self.transaction_version(organization_id)
+            if version is not None:
+                key = (organization_id, format_timestamp(start_date), format_timestamp(end_date), version)
+                cached = self._statements.get(key)
+                if cached is not None:
+                    # A copy, so callers setting e.g. .organization leave the cached statement alone
+                    return replace(cached)
         
-        # Calculate balances
-        opening_balance = 0.0
-        closing_balance = 0.0
+        opening_minor = opening_balance_minor
+        if opening_minor is None:
+            opening_minor = self._balance_before(organization_id, start_date)
         
-        # Get previous transactions to calculate opening balance
-        previous_transactions = [
-            t for t in self.get_transactions(organization_id) 
-            if (t.organization_id == organization_id and 
-                t.transaction_date < start_date)
-        ]
-        
-        for t in previous_transactions:
-            if t.type in [TransactionType.INVOICE_FUNDING, TransactionType.FEE_CHARGE]:
-                opening_balance -= t.amount
-            elif t.type == TransactionType.PAYMENT:
-                opening_balance += t.amount
-        
-        closing_balance = opening_balance
-        for t in transactions:
-            if t.type in [TransactionType.INVOICE_FUNDING, TransactionType.FEE_CHARGE]:
-                closing_balance -= t.amount
-            elif t.type == TransactionType.PAYMENT:
-                closing_balance += t.amount
+        # Transactions in the period, oldest first, read from the same index range
+        self.db.cursor.execute(f'''
+            SELECT {_TRANSACTION_COLUMNS}, {SIGNED_AMOUNT_SQL}
+            FROM Transactions
+            WHERE OrganizationId = ? AND TransactionDate >= ? AND TransactionDate <= ?
+            ORDER BY TransactionDate, Id
+        ''', (organization_id, format_timestamp(start_date), format_timestamp(end_date)))
+        transactions = []
+        period_minor = 0
+        for row in self.db.cursor:
+            transactions.append(self._transaction(row))
+            period_minor += row[12]
+        opening_balance = from_minor(opening_minor)
+        closing_balance = from_minor(opening_minor + period_minor)
         
         # Create statement
+        self._statement_count += 1
         statement = AccountStatement(
-            id=len(self._account_statements) + 1,
+            id=self._statement_count,
             organization_id=organization_id,
             start_date=start_date,
             end_date=end_date,
@@ -228,7 +465,9 @@ class TransactionService:
             statement_number=f"STMT-{datetime.now().year}-{datetime.now().month:02d}-{organization_id:04d}"
         )
         
-        self._account_statements.append(statement)
+        if key is not None:
+            self._statements.put(key, statement)
+            return replace(statement)
         return statement
     
     def generate_statement_report(self, statement: AccountStatement) -> str:
@@ -368,7 +607,7 @@ def main():
     )
     service.record_transaction(fee_transaction)
     
-    print(f"Recorded {len(service.db.cursor.execute('SELECT * FROM transactions').fetchall())} transactions")
+    print(f"Recorded {service.db.cursor.execute('SELECT COUNT(*) FROM Transactions').fetchone()[0]} transactions")
     
     # Get transactions for organization
     print("\n2. Retrieving transactions for organization 1...")
@@ -0,0 +1,189 @@
+"""
+Trial balance engine for the Supply Chain Finance Management System
+
+Account balances are the net (debits - credits) of the posted journal lines
+per account, computed with one GROUP BY. Snapshots are stored as ordinary
+TrialBalances / TrialBalanceLines rows together with the last journal line
+they include (TrialBalances.LastJournalLineId, migration 009), so the current
+trial balance is the latest snapshot plus a GROUP BY over the lines written
+since: the cost grows with the new lines, not with the ledger.
+
+Accounts.Balance is the running balance of each account, signed by its normal
+side and kept current by triggers on journal posting (migration 010);
+verify_account_balances() checks it against the lines.
+
+Journal entries are posted when they are created (Status 1). A snapshot only
+rolls forward over new line ids, so after back-posting an older draft take a
+snapshot with rebuild=True.
+
+Amounts are integer minor units (cents).
+"""
+
+from src.database import Database, format_date, format_timestamp
+
+# Accounts.Type
+ACCOUNT_TYPES = {0: "Asset", 1: "Liability", 2: "Equity", 3: "Revenue", 4: "Expense"}
+
+# Types whose normal balance is a debit; the others carry credit balances
+DEBIT_NORMAL_TYPES = (0, 4)
+
+# JournalEntries.Status of a posted entry
+POSTED = 1
+
+# "+l.AccountId" keeps the planner on the line id range instead of walking the AccountId index
+_LINE_TOTALS_SQL = """
+    SELECT l.AccountId, SUM(l.DebitAmount) - SUM(l.CreditAmount), MAX(l.Id)
+    FROM JournalEntryLines l
+    JOIN JournalEntries je ON je.Id = l.JournalEntryId
+    WHERE l.Id > ? AND je.Status = ?
+    GROUP BY +l.AccountId
+"""
+
+
+def normal_balance(account_type, net_minor: int) -> int:
+    """Net debit amount signed by the account's normal side"""
+    return net_minor if account_type in DEBIT_NORMAL_TYPES else -net_minor
+
+
+def line_totals(db: Database, after_line_id: int = 0) -> tuple:
+    """({account_id: net debit}, last line id) over the posted lines after after_line_id"""
+    db.cursor.execute(_LINE_TOTALS_SQL, (after_line_id, POSTED))
+    totals, last_line_id = {}, after_line_id
+    for account_id, net_minor, max_id in db.cursor.fetchall():
+        totals[account_id] = net_minor or 0
+        last_line_id = max(last_line_id, max_id)
+    return totals, last_line_id
+
+
+def latest_snapshot(db: Database):
+    """The newest snapshot that can be rolled forward, or None"""
+    db.cursor.execute("""
+        SELECT Id, AsOfDate, GeneratedDate, LastJournalLineId
+        FROM TrialBalances
+        WHERE LastJournalLineId IS NOT NULL
+        ORDER BY LastJournalLineId DESC, Id DESC
+        LIMIT 1
+    """)
+    row = db.cursor.fetchone()
+    if not row:
+        return None
+    return {'id': row[0], 'as_of': row[1], 'generated': row[2], 'last_line_id': row[3]}
+
+
+def snapshot_balances(db: Database, snapshot_id: int) -> dict:
+    """{account_id: net debit} stored with a snapshot"""
+    db.cursor.execute("""
+        SELECT AccountId, DebitBalance - CreditBalance
+        FROM TrialBalanceLines
+        WHERE TrialBalanceId = ?
+    """, (snapshot_id,))
+    return {account_id: net_minor for account_id, net_minor in db.cursor.fetchall()}
+
+
+def current_balances(db: Database, rebuild: bool = False) -> tuple:
+    """
+    ({account_id: net debit}, last line id, snapshot rolled forward or None).
+
+    With rebuild=True, or without a snapshot, every posted line is summed.
+    """
+    snapshot = None if rebuild else latest_snapshot(db)
+    if snapshot is None:
+        balances, last_line_id = line_totals(db)
+        return balances, last_line_id, None
+    balances = snapshot_balances(db, snapshot['id'])
+    delta, last_line_id = line_totals(db, snapshot['last_line_id'])
+    for account_id, net_minor in delta.items():
+        balances[account_id] = balances.get(account_id, 0) + net_minor
+    return balances, last_line_id, snapshot
+
+
+def take_snapshot(db: Database, user_id: int, as_of_date=None, rebuild: bool = False) -> int:
+    """Store the current balances as a trial balance snapshot; returns its id"""
+    with db.transaction():
+        balances, last_line_id, _ = current_balances(db, rebuild)
+        timestamp = format_timestamp()
+        db.cursor.execute("""
+            INSERT INTO TrialBalances (GeneratedDate, AsOfDate, GeneratedByUserId, LastJournalLineId)
+            VALUES (?, ?, ?, ?)
+        """, (timestamp, format_date(as_of_date), user_id, last_line_id))
+        snapshot_id = db.cursor.lastrowid
+        db.cursor.executemany("""
+            INSERT INTO TrialBalanceLines (TrialBalanceId, AccountId, DebitBalance, CreditBalance)
+            VALUES (?, ?, ?, ?)
+        """, [(snapshot_id, account_id, max(net_minor, 0), max(-net_minor, 0))
+              for account_id, net_minor in sorted(balances.items()) if net_minor])
+    return snapshot_id
+
+
+def load_accounts(db: Database, active_only: bool = True) -> list:
+    """Chart of accounts ordered by code: [{'id', 'code', 'name', 'type', 'category', 'active'}]"""
+    db.cursor.execute(f"""
+        SELECT Id, AccountCode, AccountName, Type, Category, IsActive
+        FROM Accounts
+        {'WHERE IsActive = 1' if active_only else ''}
+        ORDER BY AccountCode
+    """)
+    return [{'id': row[0], 'code': row[1], 'name': row[2], 'type': row[3], 'category': row[4], 'active': bool(row[5])}
+            for row in db.cursor.fetchall()]
+
+
+def account_balances(db: Database) -> list:
+    """Chart of accounts with the running Accounts.Balance of each: one indexed read, no journal scan"""
+    db.cursor.execute("""
+        SELECT Id, AccountCode, AccountName, Type, Category, IsActive, Balance
+        FROM Accounts
+        ORDER BY AccountCode
+    """)
+    return [{'id': row[0], 'code': row[1], 'name': row[2], 'type': row[3], 'category': row[4],
+             'active': bool(row[5]), 'balance': row[6] or 0}
+            for row in db.cursor.fetchall()]
+
+
+def trial_balance(db: Database, rebuild: bool = False) -> dict:
+    """
+    Current trial balance.
+
+    Returns {'lines': [{account fields, 'debit', 'credit', 'balance'}], 'total_debit',
+    'total_credit', 'last_line_id', 'snapshot'}. 'balance' is signed by the account's
+    normal side (positive debits for assets and expenses, positive credits otherwise).
+    """
+    balances, last_line_id, snapshot = current_balances(db, rebuild)
+    lines, total_debit, total_credit = [], 0, 0
+    for account in load_accounts(db, active_only=False):
+        net_minor = balances.pop(account['id'], 0)
+        if not net_minor and not account['active']:
+            continue
+        line = dict(account)
+        line['debit'] = max(net_minor, 0)
+        line['credit'] = max(-net_minor, 0)
+        line['balance'] = normal_balance(account['type'], net_minor)
+        total_debit += line['debit']
+        total_credit += line['credit']
+        lines.append(line)
+    # Lines against accounts that no longer exist still have to balance
+    for account_id, net_minor in sorted(balances.items()):
+        if net_minor:
+            lines.append({'id': account_id, 'code': '?', 'name': f"Unknown account {account_id}", 'type': None,
+                          'category': None, 'active': False, 'debit': max(net_minor, 0),
+                          'credit': max(-net_minor, 0), 'balance': net_minor})
+            total_debit += max(net_minor, 0)
+            total_credit += max(-net_minor, 0)
+    return {'lines': lines, 'total_debit': total_debit, 'total_credit': total_credit,
+            'last_line_id': last_line_id, 'snapshot': snapshot}
+
+
+def verify_account_balances(db: Database) -> list:
+    """
+    Compare Accounts.Balance (maintained by the migration 010 triggers) with the posted lines.
+
+    Returns [(account_id, code, balance, expected)] for the accounts that
+    disagree; empty when every running balance is correct.
+    """
+    totals, _ = line_totals(db)
+    mismatches = []
+    db.cursor.execute("SELECT Id, AccountCode, Type, Balance FROM Accounts ORDER BY AccountCode")
+    for account_id, code, account_type, balance in db.cursor.fetchall():
+        expected = normal_balance(account_type, totals.get(account_id, 0))
+        if (balance or 0) != expected:
+            mismatches.append((account_id, code, balance, expected))
+    return mismatches
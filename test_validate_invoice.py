@@ -16,7 +16,7 @@ def test_validate_invoice():
     }
     
     # Override any method we need to ensure the test runs
-    app.update_invoice_status = lambda invoice_id, new_status: True
+    app.update_invoice_status = lambda invoice_id, transition, **values: True
     app.get_invoice_stakeholders = lambda invoice_id: {'seller_user_id': 1, 'buyer_user_id': 2, 'seller_name': 'Supply Solutions Ltd', 'buyer_name': 'MegaCorp Industries'}
     app.send_notification = lambda *args, **kwargs: True
     app.wait_for_enter = lambda: None